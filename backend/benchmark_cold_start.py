@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Benchmark de arranque en frío de la API.
+
+Cada corrida usa un proceso nuevo y mide:
+- import: tiempo de `import main` dentro del proceso
+- ready: desde lanzar uvicorn hasta la primera respuesta 200 de /health
+
+Uso:
+    python benchmark_cold_start.py           # 10 corridas
+    python benchmark_cold_start.py --runs 20
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def time_import() -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+def time_ready(timeout: float = 30) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    return (time.perf_counter() - start) * 1000
+            except httpx.TransportError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError("La API no respondió /health a tiempo")
+    finally:
+        process.terminate()
+        process.wait()
+
+def summary(name: str, values):
+    print(f"{name:<8} mediana {statistics.median(values):8.1f} ms   "
+          f"mín {min(values):8.1f} ms   máx {max(values):8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"🚀 Arranque en frío ({args.runs} corridas)")
+    summary("import", [time_import() for _ in range(args.runs)])
+    summary("ready", [time_ready() for _ in range(args.runs)])
+
+if __name__ == "__main__":
+    main()
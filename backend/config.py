@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,6 +14,148 @@ class Settings(BaseSettings):
     DB_USER: str = os.getenv("DB_USER", "postgres")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
     
+    # Réplica de lectura (opcional). Si DB_READ_HOST está vacío se usa la base principal
+    DB_READ_HOST: str = os.getenv("DB_READ_HOST", "")
+    DB_READ_PORT: str = os.getenv("DB_READ_PORT", "5432")
+    DB_READ_NAME: str = os.getenv("DB_READ_NAME", "")
+    DB_READ_USER: str = os.getenv("DB_READ_USER", "")
+    DB_READ_PASSWORD: str = os.getenv("DB_READ_PASSWORD", "")
+    
+    # Pool de conexiones
+    # DB_POOL_MODE: "default" (QueuePool con overflow y pre-ping) o "fixed"
+    # (tamaño fijo, sin pre-ping, validación en segundo plano; apto para pgbouncer)
+    DB_POOL_MODE: str = os.getenv("DB_POOL_MODE", "default")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_POOL_VALIDATION_INTERVAL: int = int(os.getenv("DB_POOL_VALIDATION_INTERVAL", "60"))
+    
+    # Timeouts de consultas por tipo de endpoint (ms, 0 = sin límite)
+    DB_STATEMENT_TIMEOUT_CRUD_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_CRUD_MS", "2000"))
+    DB_STATEMENT_TIMEOUT_ANALYTICS_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_ANALYTICS_MS", "10000"))
+    DB_STATEMENT_TIMEOUT_REPORTS_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_REPORTS_MS", "30000"))
+    # Cada cuánto (s) se revisa si el cliente cerró la conexión para cancelar su consulta
+    DB_DISCONNECT_POLL_INTERVAL: float = float(os.getenv("DB_DISCONNECT_POLL_INTERVAL", "0.5"))
+    
+    # Cola de reportes en segundo plano
+    REPORT_JOBS_DIR: str = os.getenv("REPORT_JOBS_DIR", os.path.join(tempfile.gettempdir(), "cexcie_report_jobs"))
+    REPORT_JOB_WORKERS: int = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+    # Trabajos pendientes (en cola, sin empezar) admitidos por proceso; los demás reciben 429
+    REPORT_JOB_MAX_PENDING: int = int(os.getenv("REPORT_JOB_MAX_PENDING", "20"))
+    REPORT_JOB_RETENTION_HOURS: float = float(os.getenv("REPORT_JOB_RETENTION_HOURS", "24"))
+    REPORT_JOB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("REPORT_JOB_STATEMENT_TIMEOUT_MS", "600000"))
+    
+    # Caché de reportes en disco
+    REPORT_CACHE_ENABLED: bool = os.getenv("REPORT_CACHE_ENABLED", "true").lower() == "true"
+    REPORT_CACHE_DIR: str = os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cexcie_report_cache"))
+    REPORT_CACHE_MAX_MB: int = int(os.getenv("REPORT_CACHE_MAX_MB", "512"))
+    # Segundos que se reutiliza el sello de versión de datos antes de consultarlo de nuevo
+    REPORT_CACHE_VERSION_TTL: float = float(os.getenv("REPORT_CACHE_VERSION_TTL", "2"))
+    
+    # Filas por row group / lote en exportaciones parquet y arrow
+    REPORT_COLUMNAR_BATCH_SIZE: int = int(os.getenv("REPORT_COLUMNAR_BATCH_SIZE", "50000"))
+    
+    # Snapshot columnar de analytics en memoria
+    ANALYTICS_SNAPSHOT_ENABLED: bool = os.getenv("ANALYTICS_SNAPSHOT_ENABLED", "false").lower() == "true"
+    ANALYTICS_SNAPSHOT_REFRESH_SECONDS: int = int(os.getenv("ANALYTICS_SNAPSHOT_REFRESH_SECONDS", "60"))
+    # Antigüedad máxima (s) para responder desde el snapshot; si se supera se consulta la base
+    ANALYTICS_SNAPSHOT_MAX_AGE: int = int(os.getenv("ANALYTICS_SNAPSHOT_MAX_AGE", "300"))
+    ANALYTICS_SNAPSHOT_INTERACTION_DAYS: int = int(os.getenv("ANALYTICS_SNAPSHOT_INTERACTION_DAYS", "35"))
+    
+    # Series temporales: zona horaria por defecto y rollup horario incremental
+    ANALYTICS_TIMEZONE: str = os.getenv("ANALYTICS_TIMEZONE", "America/Lima")
+    ANALYTICS_TIME_SERIES_MAX_POINTS: int = int(os.getenv("ANALYTICS_TIME_SERIES_MAX_POINTS", "5000"))
+    ANALYTICS_ROLLUP_ENABLED: bool = os.getenv("ANALYTICS_ROLLUP_ENABLED", "true").lower() == "true"
+    ANALYTICS_ROLLUP_INTERVAL: int = int(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "300"))
+    # Horas previas a la última marca que se recalculan en cada pasada (datos tardíos)
+    ANALYTICS_ROLLUP_LOOKBACK_HOURS: int = int(os.getenv("ANALYTICS_ROLLUP_LOOKBACK_HOURS", "48"))
+    # Ejecutar rollups y mantenimiento de particiones también al arrancar (no solo tras el primer intervalo)
+    BACKGROUND_RUN_AT_START: bool = os.getenv("BACKGROUND_RUN_AT_START", "false").lower() == "true"
+    
+    # Salud de dispositivos: estados de interacción que cuentan como error y minutos sin actividad para marcar inactivo
+    DEVICE_ERROR_STATES: str = os.getenv("DEVICE_ERROR_STATES", "error,fallido,cancelado")
+    DEVICE_IDLE_MINUTES: int = int(os.getenv("DEVICE_IDLE_MINUTES", "30"))
+    DEVICE_ROLLUP_ENABLED: bool = os.getenv("DEVICE_ROLLUP_ENABLED", "true").lower() == "true"
+    
+    # Recorridos por flujo: pasos máximos por ruta y horas hacia atrás para reconstruir un recorrido
+    FLOW_MAX_PATH_STEPS: int = int(os.getenv("FLOW_MAX_PATH_STEPS", "10"))
+    FLOW_MAX_HOURS: int = int(os.getenv("FLOW_MAX_HOURS", "24"))
+    FLOW_ROLLUP_ENABLED: bool = os.getenv("FLOW_ROLLUP_ENABLED", "true").lower() == "true"
+    
+    # Sesiones de visita: minutos sin interacciones que cierran una sesión
+    SESSION_GAP_MINUTES: int = int(os.getenv("SESSION_GAP_MINUTES", "30"))
+    SESSION_ROLLUP_ENABLED: bool = os.getenv("SESSION_ROLLUP_ENABLED", "true").lower() == "true"
+    
+    # Particiones mensuales de interaccion: meses futuros a crear y retención (0 = sin límite)
+    INTERACCION_PARTITIONS_ENABLED: bool = os.getenv("INTERACCION_PARTITIONS_ENABLED", "true").lower() == "true"
+    INTERACCION_PARTITIONS_AHEAD: int = int(os.getenv("INTERACCION_PARTITIONS_AHEAD", "3"))
+    INTERACCION_RETENTION_MONTHS: int = int(os.getenv("INTERACCION_RETENTION_MONTHS", "0"))
+    
+    # Archivo frío en parquet de interacciones y resultados de tests antiguos
+    ARCHIVE_ENABLED: bool = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+    ARCHIVE_AFTER_MONTHS: int = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+    ARCHIVE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_BATCH_SIZE", "10000"))
+    
+    # Control de admisión: concurrencia por clase de endpoint (0 = sin límite) y cola de espera
+    ADMISSION_CRUD_CONCURRENCY: int = int(os.getenv("ADMISSION_CRUD_CONCURRENCY", "0"))
+    ADMISSION_CRUD_QUEUE: int = int(os.getenv("ADMISSION_CRUD_QUEUE", "0"))
+    ADMISSION_ANALYTICS_CONCURRENCY: int = int(os.getenv("ADMISSION_ANALYTICS_CONCURRENCY", "12"))
+    ADMISSION_ANALYTICS_QUEUE: int = int(os.getenv("ADMISSION_ANALYTICS_QUEUE", "24"))
+    ADMISSION_REPORTS_CONCURRENCY: int = int(os.getenv("ADMISSION_REPORTS_CONCURRENCY", "4"))
+    ADMISSION_REPORTS_QUEUE: int = int(os.getenv("ADMISSION_REPORTS_QUEUE", "8"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    # Rate limit por cliente (token bucket) de analytics y reportes (0 = sin límite)
+    RATE_LIMIT_ANALYTICS_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_ANALYTICS_PER_MINUTE", "120"))
+    RATE_LIMIT_ANALYTICS_BURST: int = int(os.getenv("RATE_LIMIT_ANALYTICS_BURST", "30"))
+    RATE_LIMIT_REPORTS_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_REPORTS_PER_MINUTE", "20"))
+    RATE_LIMIT_REPORTS_BURST: int = int(os.getenv("RATE_LIMIT_REPORTS_BURST", "5"))
+    # Proxies de confianza delante de la API que agregan X-Forwarded-For (0 = usar la IP de la conexión)
+    TRUSTED_PROXY_HOPS: int = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+    
+    # Coalescencia de cálculos idénticos en curso (analytics, dashboard y reportes)
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    
+    # Profiler por solicitud: header X-Profile-Token (vacío = deshabilitado) y/o fracción muestreada
+    PROFILER_TOKEN: str = os.getenv("PROFILER_TOKEN", "")
+    PROFILER_SAMPLE_RATE: float = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+    PROFILER_INTERVAL_MS: float = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+    PROFILER_DIR: str = os.getenv("PROFILER_DIR", os.path.join(tempfile.gettempdir(), "cexcie_profiles"))
+    PROFILER_MAX_ARTIFACTS: int = int(os.getenv("PROFILER_MAX_ARTIFACTS", "50"))
+    
+    # Trazas distribuidas (IDs OpenTelemetry, header traceparent): exportador "file" (JSONL) u "otlp" (HTTP/JSON)
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+    TRACING_SAMPLE_RATE: float = float(os.getenv("TRACING_SAMPLE_RATE", "1"))
+    TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "file")
+    TRACING_FILE: str = os.getenv("TRACING_FILE", os.path.join(tempfile.gettempdir(), "cexcie_traces.jsonl"))
+    TRACING_OTLP_ENDPOINT: str = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "cexcie-dashboard-api")
+    TRACING_QUEUE_SIZE: int = int(os.getenv("TRACING_QUEUE_SIZE", "10000"))
+    
+    # EXPLAIN automático de consultas lentas (umbral en ms) o muestreadas, por clase de endpoint
+    EXPLAIN_ENABLED: bool = os.getenv("EXPLAIN_ENABLED", "false").lower() == "true"
+    EXPLAIN_THRESHOLD_MS: float = float(os.getenv("EXPLAIN_THRESHOLD_MS", "1000"))
+    EXPLAIN_SAMPLE_RATE: float = float(os.getenv("EXPLAIN_SAMPLE_RATE", "0"))
+    EXPLAIN_CLASSES: str = os.getenv("EXPLAIN_CLASSES", "analytics,reports")
+    EXPLAIN_ANALYZE: bool = os.getenv("EXPLAIN_ANALYZE", "true").lower() == "true"
+    EXPLAIN_BUFFER_SIZE: int = int(os.getenv("EXPLAIN_BUFFER_SIZE", "200"))
+    # Límite de EXPLAIN por minuto y segundos antes de volver a explicar la misma sentencia
+    EXPLAIN_MAX_PER_MINUTE: int = int(os.getenv("EXPLAIN_MAX_PER_MINUTE", "6"))
+    EXPLAIN_DEDUP_SECONDS: float = float(os.getenv("EXPLAIN_DEDUP_SECONDS", "300"))
+    EXPLAIN_STATEMENT_TIMEOUT_MS: int = int(os.getenv("EXPLAIN_STATEMENT_TIMEOUT_MS", "30000"))
+    
+    # Máximo de prospectos por actualización en lote
+    PROSPECT_BATCH_MAX_ROWS: int = int(os.getenv("PROSPECT_BATCH_MAX_ROWS", "5000"))
+    
+    # Detección de prospectos duplicados (claves de bloqueo, procesamiento incremental)
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_INTERVAL: int = int(os.getenv("DEDUP_INTERVAL", "60"))
+    DEDUP_BATCH_SIZE: int = int(os.getenv("DEDUP_BATCH_SIZE", "500"))
+    DEDUP_MAX_BLOCK_SIZE: int = int(os.getenv("DEDUP_MAX_BLOCK_SIZE", "50"))
+    DEDUP_MIN_SCORE: float = float(os.getenv("DEDUP_MIN_SCORE", "0.5"))
+    
     # API
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "CExCIE Dashboard MVP"
@@ -40,6 +183,15 @@ class Settings(BaseSettings):
     def DATABASE_URL(self) -> str:
         return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
     
+    @property
+    def DB_READ_URL(self) -> Optional[str]:
+        if not self.DB_READ_HOST:
+            return None
+        user = self.DB_READ_USER or self.DB_USER
+        password = self.DB_READ_PASSWORD or self.DB_PASSWORD
+        name = self.DB_READ_NAME or self.DB_NAME
+        return f"postgresql://{user}:{password}@{self.DB_READ_HOST}:{self.DB_READ_PORT}/{name}"
+    
     class Config:
         case_sensitive = True
 
@@ -1,7 +1,10 @@
+# Perfil de arranque (STARTUP_PROFILE=true): el hook se instala antes de cualquier otro import
+from services.startup_profile import startup_profile
+startup_profile.install()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
-import uvicorn
 
 # Create FastAPI app
 app = FastAPI(
@@ -19,6 +22,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profiler por solicitud (solo si hay token o tasa de muestreo configurados)
+from services.request_profiler import request_profiler, ProfilerMiddleware, instrument_routes as instrument_routes_for_profiler
+if request_profiler.enabled:
+    app.add_middleware(ProfilerMiddleware)
+
+# Trazas por solicitud (las rutas se instrumentan al final, una vez incluidos los routers)
+from services.tracing import tracer, TracingMiddleware, instrument_routes
+if tracer.enabled:
+    app.add_middleware(TracingMiddleware)
+
+# EXPLAIN automático de consultas lentas (EXPLAIN_ENABLED=true)
+from services.explain_capture import explain_capture
+explain_capture.install()
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -33,12 +50,90 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+# Tareas en segundo plano
+from models.database import engine, validate_idle_connections, stop_disconnect_watch_on_return
+from services.scheduler import scheduler
+from services.report_jobs import report_jobs
+from services.analytics_snapshot import analytics_snapshot
+from services.time_series import refresh_hourly_rollup
+from services.device_health import refresh_device_rollup
+from services.flow_paths import refresh_flow_rollup
+from services.sessions import refresh_session_rollup
+from services.partitions import maintain_interaction_partitions
+from services.archive import archive_old_data
+from services.dedup import process_pending as process_pending_duplicates
+
+if settings.DB_POOL_MODE == "fixed":
+    scheduler.register(
+        "db-pool-validation",
+        settings.DB_POOL_VALIDATION_INTERVAL,
+        lambda: validate_idle_connections(engine)
+    )
+
+scheduler.register("report-jobs-cleanup", 3600, report_jobs.cleanup)
+
+# Rollups incrementales: cada uno se omite si falta su migración
+rollups = [
+    ("analytics-hourly-rollup", settings.ANALYTICS_ROLLUP_ENABLED, refresh_hourly_rollup),
+    ("device-hourly-rollup", settings.DEVICE_ROLLUP_ENABLED, refresh_device_rollup),
+    ("flow-paths-rollup", settings.FLOW_ROLLUP_ENABLED, refresh_flow_rollup),
+    ("visit-sessions-rollup", settings.SESSION_ROLLUP_ENABLED, refresh_session_rollup),
+]
+for name, enabled, refresh in rollups:
+    if enabled:
+        scheduler.register(name, settings.ANALYTICS_ROLLUP_INTERVAL, refresh, run_at_start=settings.BACKGROUND_RUN_AT_START)
+
+if settings.INTERACCION_PARTITIONS_ENABLED:
+    scheduler.register(
+        "interaccion-partitions",
+        86400,
+        maintain_interaction_partitions,
+        run_at_start=settings.BACKGROUND_RUN_AT_START
+    )
+
+if settings.ARCHIVE_ENABLED:
+    scheduler.register("cold-archive", 86400, archive_old_data)
+
+if settings.DEDUP_ENABLED:
+    scheduler.register("prospect-dedup", settings.DEDUP_INTERVAL, process_pending_duplicates)
+
+if settings.ANALYTICS_SNAPSHOT_ENABLED:
+    scheduler.register(
+        "analytics-snapshot",
+        settings.ANALYTICS_SNAPSHOT_REFRESH_SECONDS,
+        analytics_snapshot.refresh,
+        run_at_start=True
+    )
+
+@app.on_event("startup")
+async def start_background_tasks():
+    scheduler.start()
+    startup_profile.mark("startup_complete")
+    startup_profile.log_summary()
+    startup_profile.uninstall()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    scheduler.stop()
+    report_jobs.shutdown()
+    tracer.shutdown()
+
 # Import routers
-from routers import prospects_legacy, dashboard_legacy, analytics, reports
+from routers import prospects_legacy, duplicates, dashboard_legacy, analytics, reports, monitoring
+# duplicates va antes que prospects_legacy: /prospects/duplicates no debe caer en /prospects/{prospect_id}
+app.include_router(duplicates.router, prefix=f"{settings.API_V1_STR}", tags=["prospects"])
 app.include_router(prospects_legacy.router, prefix=f"{settings.API_V1_STR}", tags=["prospects"])
 app.include_router(dashboard_legacy.router, prefix=f"{settings.API_V1_STR}", tags=["dashboard"])
 app.include_router(analytics.router, prefix=f"{settings.API_V1_STR}", tags=["analytics"])
 app.include_router(reports.router, prefix=f"{settings.API_V1_STR}", tags=["reports"])
+app.include_router(monitoring.router, prefix=f"{settings.API_V1_STR}", tags=["monitoring"])
+stop_disconnect_watch_on_return(app)
+if request_profiler.enabled:
+    instrument_routes_for_profiler(app)
+if tracer.enabled:
+    instrument_routes(app)
+startup_profile.mark("routers_loaded")
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""Aplicar las migraciones pendientes de la base de datos.
+
+Uso:
+    python migrate.py           # aplica las pendientes
+    python migrate.py --status  # lista aplicadas y pendientes
+"""
+import sys
+from sqlalchemy import create_engine
+from config import settings
+import migrations
+
+def main():
+    # Engine propio sin statement_timeout: los backfills pueden tardar
+    engine = create_engine(settings.DATABASE_URL)
+    if "--status" in sys.argv:
+        done = set(migrations.applied(engine))
+        for version, module in migrations.available():
+            mark = "✅" if version in done else "⏳"
+            print(f"{mark} {version}: {module.description}")
+        return
+
+    applied = migrations.upgrade(engine)
+    if applied:
+        print(f"✅ {len(applied)} migración(es) aplicada(s)")
+    else:
+        print("✅ Base de datos al día")
+
+if __name__ == "__main__":
+    main()
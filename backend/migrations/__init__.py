@@ -0,0 +1,67 @@
+"""Migraciones de esquema de la base legacy.
+
+Cada módulo `mNNN_nombre.py` define `description` y `upgrade(engine)`. Se aplican
+en orden y quedan registradas en la tabla `schema_migrations`. Reciben el engine
+(y no una transacción) para poder ejecutar pasos que no admiten transacción,
+como CREATE INDEX CONCURRENTLY o backfills por lotes con commit por lote.
+"""
+import importlib
+import pkgutil
+import re
+from typing import List, Tuple
+from sqlalchemy import text
+
+MODULE_PATTERN = re.compile(r"^m(\d{3})_\w+$")
+
+# Clave del advisory lock que evita ejecutar migraciones en paralelo
+LOCK_KEY = 734120033
+
+def available() -> List[Tuple[str, object]]:
+    """Migraciones del paquete ordenadas por número: [(version, módulo)]"""
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        if MODULE_PATTERN.match(module_info.name):
+            migrations.append((module_info.name, importlib.import_module(f"{__name__}.{module_info.name}")))
+    return sorted(migrations, key=lambda item: item[0])
+
+def ensure_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(100) PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+            )
+        """))
+
+def applied(engine) -> List[str]:
+    ensure_table(engine)
+    with engine.connect() as connection:
+        return [row[0] for row in connection.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+def pending(engine) -> List[Tuple[str, object]]:
+    done = set(applied(engine))
+    return [(version, module) for version, module in available() if version not in done]
+
+def upgrade(engine, log=print) -> List[str]:
+    """Aplicar las migraciones pendientes en orden; devuelve las versiones aplicadas"""
+    ensure_table(engine)
+    lock = engine.connect()
+    try:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        lock.commit()
+        applied_versions = []
+        for version, module in pending(engine):
+            log(f"▶ {version}: {module.description}")
+            module.upgrade(engine)
+            with engine.begin() as connection:
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                    {"version": version, "description": module.description}
+                )
+            applied_versions.append(version)
+        return applied_versions
+    finally:
+        lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+        lock.commit()
+        lock.close()
@@ -0,0 +1,83 @@
+from sqlalchemy import text
+
+description = "Historial append-only de cambios de estado de prospectos"
+
+BACKFILL_BATCH_SIZE = 5000
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS prospecto_estado_historial (
+                historial_id BIGSERIAL PRIMARY KEY,
+                prospecto_id UUID NOT NULL,
+                estado_anterior VARCHAR(50),
+                estado_nuevo VARCHAR(50),
+                -- Canal y ciudad al momento del cambio
+                origen VARCHAR(50),
+                ciudad VARCHAR(100),
+                fecha_cambio TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+                -- Tiempo desde el registro; NULL en altas y en filas de backfill
+                segundos_desde_registro DOUBLE PRECISION,
+                es_backfill BOOLEAN NOT NULL DEFAULT false
+            )
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_historial_prospecto_fecha
+            ON prospecto_estado_historial (prospecto_id, fecha_cambio)
+        """))
+        # Índice parcial de conversiones: las métricas de tiempo se resuelven con un index-only scan
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_historial_conversiones
+            ON prospecto_estado_historial (fecha_cambio)
+            INCLUDE (origen, ciudad, segundos_desde_registro)
+            WHERE estado_nuevo = 'Matriculado' AND segundos_desde_registro IS NOT NULL
+        """))
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION registrar_cambio_estado() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO prospecto_estado_historial
+                        (prospecto_id, estado_nuevo, origen, ciudad, fecha_cambio)
+                    VALUES
+                        (NEW.prospecto_id, NEW.estado, NEW.origen, NEW.ciudad,
+                         COALESCE(NEW.fecha_registro, now() AT TIME ZONE 'utc'));
+                ELSIF NEW.estado IS DISTINCT FROM OLD.estado THEN
+                    INSERT INTO prospecto_estado_historial
+                        (prospecto_id, estado_anterior, estado_nuevo, origen, ciudad, segundos_desde_registro)
+                    VALUES
+                        (NEW.prospecto_id, OLD.estado, NEW.estado, NEW.origen, NEW.ciudad,
+                         EXTRACT(EPOCH FROM (now() AT TIME ZONE 'utc') - NEW.fecha_registro));
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_prospecto_estado_historial ON prospecto"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_prospecto_estado_historial
+            AFTER INSERT OR UPDATE OF estado ON prospecto
+            FOR EACH ROW EXECUTE FUNCTION registrar_cambio_estado()
+        """))
+
+    # Estado actual de los prospectos existentes, por lotes y con commit por lote.
+    # Se desconoce cuándo cambiaron, así que quedan fuera de las métricas de tiempo.
+    last_id = None
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(text("""
+                INSERT INTO prospecto_estado_historial
+                    (prospecto_id, estado_nuevo, origen, ciudad, fecha_cambio, es_backfill)
+                SELECT p.prospecto_id, p.estado, p.origen, p.ciudad,
+                       COALESCE(p.fecha_registro, now() AT TIME ZONE 'utc'), true
+                FROM prospecto p
+                WHERE (CAST(:last_id AS UUID) IS NULL OR p.prospecto_id > CAST(:last_id AS UUID))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM prospecto_estado_historial h WHERE h.prospecto_id = p.prospecto_id
+                  )
+                ORDER BY p.prospecto_id
+                LIMIT :batch_size
+                RETURNING prospecto_id
+            """), {"last_id": last_id, "batch_size": BACKFILL_BATCH_SIZE}).scalars().all()
+        if not rows:
+            break
+        last_id = str(max(rows))
@@ -0,0 +1,34 @@
+from sqlalchemy import text
+
+description = "Rollup horario de métricas, marcas de agregados incrementales e índices de tiempo"
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS agregado_watermark (
+                nombre VARCHAR(100) PRIMARY KEY,
+                valor TIMESTAMP NOT NULL,
+                actualizado_en TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+            )
+        """))
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS serie_horaria (
+                metrica VARCHAR(30) NOT NULL,
+                hora TIMESTAMP NOT NULL,
+                total BIGINT NOT NULL,
+                PRIMARY KEY (metrica, hora)
+            )
+        """))
+
+    # Índices sobre las columnas de tiempo de las tablas fuente, sin bloquear escrituras
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prospecto_fecha_registro ON prospecto (fecha_registro)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_interaccion_timestamp ON interaccion (timestamp)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_historial_estado_fecha "
+            "ON prospecto_estado_historial (estado_nuevo, fecha_cambio)"
+        ))
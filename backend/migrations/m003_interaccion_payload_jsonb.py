@@ -0,0 +1,65 @@
+from sqlalchemy import text
+
+description = "Columna JSONB de payloads de interacciones con backfill por lotes e índice GIN"
+
+BACKFILL_BATCH_SIZE = 5000
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        # Columna nullable sin default: el ALTER no reescribe la tabla
+        connection.execute(text("ALTER TABLE interaccion ADD COLUMN IF NOT EXISTS payload_jsonb JSONB"))
+        # Los payloads que no son JSON válido quedan en NULL en lugar de hacer fallar la escritura
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION safe_jsonb(valor TEXT) RETURNS JSONB AS $$
+            BEGIN
+                RETURN valor::jsonb;
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql IMMUTABLE
+        """))
+        # Los dispositivos siguen escribiendo payload_json (texto); el trigger mantiene la copia JSONB
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION sincronizar_payload_jsonb() RETURNS trigger AS $$
+            BEGIN
+                NEW.payload_jsonb := safe_jsonb(NEW.payload_json);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_interaccion_payload_jsonb ON interaccion"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_interaccion_payload_jsonb
+            BEFORE INSERT OR UPDATE OF payload_json ON interaccion
+            FOR EACH ROW EXECUTE FUNCTION sincronizar_payload_jsonb()
+        """))
+
+    # Backfill por rangos de clave, con commit por lote para no retener locks
+    last_id = None
+    while True:
+        with engine.begin() as connection:
+            upper_id = connection.execute(text("""
+                SELECT MAX(interaccion_id) FROM (
+                    SELECT interaccion_id FROM interaccion
+                    WHERE (CAST(:last_id AS UUID) IS NULL OR interaccion_id > CAST(:last_id AS UUID))
+                    ORDER BY interaccion_id
+                    LIMIT :batch_size
+                ) lote
+            """), {"last_id": last_id, "batch_size": BACKFILL_BATCH_SIZE}).scalar()
+            if upper_id is None:
+                break
+            connection.execute(text("""
+                UPDATE interaccion
+                SET payload_jsonb = safe_jsonb(payload_json)
+                WHERE (CAST(:last_id AS UUID) IS NULL OR interaccion_id > CAST(:last_id AS UUID))
+                  AND interaccion_id <= CAST(:upper_id AS UUID)
+                  AND payload_json IS NOT NULL
+                  AND payload_jsonb IS NULL
+            """), {"last_id": last_id, "upper_id": str(upper_id)})
+        last_id = str(upper_id)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_interaccion_payload_gin
+            ON interaccion USING GIN (payload_jsonb jsonb_path_ops)
+        """))
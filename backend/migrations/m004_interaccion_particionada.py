@@ -0,0 +1,103 @@
+from datetime import datetime
+from sqlalchemy import text
+from config import settings
+from services.partitions import (
+    add_months, create_monthly_partition, ensure_future_partitions, is_partitioned, month_start
+)
+
+description = "Particionar interaccion por mes sobre timestamp (copia en línea y swap)"
+
+NEW_TABLE = "interaccion_particionada"
+OLD_TABLE = "interaccion_sin_particionar"
+# Las filas sin timestamp no pueden ir en la clave de partición: se les asigna esta fecha (partición DEFAULT)
+NULL_TIMESTAMP = "1970-01-01"
+
+def _columns(connection):
+    names = connection.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'interaccion'
+        ORDER BY ordinal_position
+    """)).scalars().all()
+    quoted = [f'"{name}"' for name in names]
+    select = [
+        f"COALESCE(\"timestamp\", TIMESTAMP '{NULL_TIMESTAMP}')" if name == "timestamp" else f'"{name}"'
+        for name in names
+    ]
+    return ", ".join(quoted), ", ".join(select)
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        if is_partitioned(connection, "interaccion"):
+            return
+        columns, select = _columns(connection)
+        first = connection.execute(text("SELECT MIN(timestamp) FROM interaccion")).scalar()
+
+        # Misma definición de columnas (y orden) que la tabla actual; la PK debe incluir la clave
+        connection.execute(text(f"""
+            CREATE TABLE {NEW_TABLE} (
+                LIKE interaccion INCLUDING DEFAULTS,
+                PRIMARY KEY (interaccion_id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """))
+        connection.execute(text(f"CREATE TABLE interaccion_default PARTITION OF {NEW_TABLE} DEFAULT"))
+        month = month_start(first.date()) if first else month_start(datetime.utcnow().date())
+        while month <= month_start(datetime.utcnow().date()):
+            create_monthly_partition(connection, NEW_TABLE, month, prefix="interaccion")
+            month = add_months(month, 1)
+        ensure_future_partitions(connection, NEW_TABLE, settings.INTERACCION_PARTITIONS_AHEAD, prefix="interaccion")
+
+        # Índices en el padre: se propagan a cada partición (actual y futura)
+        connection.execute(text(f"CREATE INDEX ON {NEW_TABLE} (timestamp)"))
+        connection.execute(text(f"CREATE INDEX ON {NEW_TABLE} (prospecto_id)"))
+        connection.execute(text(f"CREATE INDEX ON {NEW_TABLE} USING GIN (payload_jsonb jsonb_path_ops)"))
+        connection.execute(text(f"""
+            CREATE TRIGGER trg_interaccion_payload_jsonb
+            BEFORE INSERT OR UPDATE OF payload_json ON {NEW_TABLE}
+            FOR EACH ROW EXECUTE FUNCTION sincronizar_payload_jsonb()
+        """))
+
+        # Mientras dura la copia, las inserciones nuevas se replican en la tabla particionada
+        connection.execute(text(f"""
+            CREATE OR REPLACE FUNCTION replicar_interaccion_particionada() RETURNS trigger AS $$
+            BEGIN
+                NEW.timestamp := COALESCE(NEW.timestamp, TIMESTAMP '{NULL_TIMESTAMP}');
+                INSERT INTO {NEW_TABLE} VALUES (NEW.*) ON CONFLICT DO NOTHING;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("""
+            CREATE TRIGGER trg_replicar_interaccion
+            AFTER INSERT ON interaccion
+            FOR EACH ROW EXECUTE FUNCTION replicar_interaccion_particionada()
+        """))
+
+    # Copia de los datos existentes, un mes por transacción. Lo insertado desde que
+    # existe el trigger ya está replicado (ON CONFLICT evita duplicados).
+    copy_sql = text(f"""
+        INSERT INTO {NEW_TABLE} ({columns})
+        SELECT {select} FROM interaccion
+        WHERE timestamp >= :desde AND timestamp < :hasta
+        ON CONFLICT DO NOTHING
+    """)
+    last = add_months(month_start(datetime.utcnow().date()), settings.INTERACCION_PARTITIONS_AHEAD + 1)
+    month = month_start(first.date()) if first else last
+    while month < last:
+        with engine.begin() as connection:
+            connection.execute(copy_sql, {"desde": month, "hasta": add_months(month, 1)})
+        month = add_months(month, 1)
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+            INSERT INTO {NEW_TABLE} ({columns})
+            SELECT {select} FROM interaccion
+            WHERE timestamp IS NULL OR timestamp >= :desde
+            ON CONFLICT DO NOTHING
+        """), {"desde": last})
+
+    # Swap: bloqueo breve y cambio de nombres. La tabla original queda como respaldo.
+    with engine.begin() as connection:
+        connection.execute(text("LOCK TABLE interaccion IN ACCESS EXCLUSIVE MODE"))
+        connection.execute(text("DROP TRIGGER trg_replicar_interaccion ON interaccion"))
+        connection.execute(text("DROP FUNCTION replicar_interaccion_particionada()"))
+        connection.execute(text(f"ALTER TABLE interaccion RENAME TO {OLD_TABLE}"))
+        connection.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO interaccion"))
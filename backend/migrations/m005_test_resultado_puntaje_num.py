@@ -0,0 +1,122 @@
+from sqlalchemy import text
+
+description = "Puntaje numérico de tests con backfill y distribución de puntajes por test_id"
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Clave de unicidad de la distribución: test_id, clasificación y puntaje pueden ser NULL
+FRECUENCIA_KEY = """
+    COALESCE(test_id, '00000000-0000-0000-0000-000000000000'::uuid),
+    COALESCE(clasificacion, ''),
+    COALESCE(puntaje, 'NaN'::numeric)
+"""
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE test_resultado ADD COLUMN IF NOT EXISTS puntaje_num NUMERIC"))
+        # Puntajes no numéricos quedan en NULL; se acepta coma decimal ("85,5")
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION safe_numeric(valor TEXT) RETURNS NUMERIC AS $$
+                SELECT CASE
+                    WHEN btrim(replace(valor, ',', '.')) ~ '^[-+]?([0-9]+([.][0-9]*)?|[.][0-9]+)$'
+                    THEN btrim(replace(valor, ',', '.'))::numeric
+                END
+            $$ LANGUAGE sql IMMUTABLE
+        """))
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION sincronizar_puntaje_num() RETURNS trigger AS $$
+            BEGIN
+                NEW.puntaje_num := safe_numeric(NEW.puntaje);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_test_resultado_puntaje_num ON test_resultado"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_test_resultado_puntaje_num
+            BEFORE INSERT OR UPDATE OF puntaje ON test_resultado
+            FOR EACH ROW EXECUTE FUNCTION sincronizar_puntaje_num()
+        """))
+
+    with engine.begin() as connection:
+        # Cantidad de resultados por (test_id, clasificación, puntaje): de aquí salen
+        # histogramas, percentiles y estadísticas sin recorrer test_resultado
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS test_puntaje_frecuencia (
+                test_id UUID,
+                clasificacion VARCHAR,
+                puntaje NUMERIC,
+                total BIGINT NOT NULL
+            )
+        """))
+        connection.execute(text(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_test_puntaje_frecuencia
+            ON test_puntaje_frecuencia ({FRECUENCIA_KEY})
+        """))
+        connection.execute(text(f"""
+            CREATE OR REPLACE FUNCTION sumar_frecuencia_puntaje(
+                p_test_id UUID, p_clasificacion VARCHAR, p_puntaje NUMERIC, p_delta INTEGER
+            ) RETURNS void AS $$
+                INSERT INTO test_puntaje_frecuencia (test_id, clasificacion, puntaje, total)
+                VALUES (p_test_id, p_clasificacion, p_puntaje, p_delta)
+                ON CONFLICT ({FRECUENCIA_KEY})
+                DO UPDATE SET total = test_puntaje_frecuencia.total + EXCLUDED.total
+            $$ LANGUAGE sql
+        """))
+        # Los borrados del archivado en frío no cambian la distribución histórica
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION actualizar_frecuencia_puntaje() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' AND current_setting('cexcie.archiving', true) = 'on' THEN
+                    RETURN NULL;
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM sumar_frecuencia_puntaje(OLD.test_id, OLD.clasificacion, safe_numeric(OLD.puntaje), -1);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM sumar_frecuencia_puntaje(NEW.test_id, NEW.clasificacion, safe_numeric(NEW.puntaje), 1);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        # Carga inicial y trigger en la misma transacción, con las escrituras bloqueadas,
+        # para que ningún resultado quede contado dos veces ni fuera de la distribución
+        connection.execute(text("LOCK TABLE test_resultado IN SHARE ROW EXCLUSIVE MODE"))
+        connection.execute(text("DELETE FROM test_puntaje_frecuencia"))
+        connection.execute(text("""
+            INSERT INTO test_puntaje_frecuencia (test_id, clasificacion, puntaje, total)
+            SELECT test_id, clasificacion, safe_numeric(puntaje), COUNT(*)
+            FROM test_resultado
+            GROUP BY 1, 2, 3
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_test_resultado_frecuencia ON test_resultado"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_test_resultado_frecuencia
+            AFTER INSERT OR DELETE OR UPDATE OF test_id, clasificacion, puntaje ON test_resultado
+            FOR EACH ROW EXECUTE FUNCTION actualizar_frecuencia_puntaje()
+        """))
+
+    # Backfill de puntaje_num por rangos de clave, con commit por lote
+    last_id = None
+    while True:
+        with engine.begin() as connection:
+            upper_id = connection.execute(text("""
+                SELECT MAX(resultado_id) FROM (
+                    SELECT resultado_id FROM test_resultado
+                    WHERE (CAST(:last_id AS UUID) IS NULL OR resultado_id > CAST(:last_id AS UUID))
+                    ORDER BY resultado_id
+                    LIMIT :batch_size
+                ) lote
+            """), {"last_id": last_id, "batch_size": BACKFILL_BATCH_SIZE}).scalar()
+            if upper_id is None:
+                break
+            connection.execute(text("""
+                UPDATE test_resultado
+                SET puntaje_num = safe_numeric(puntaje)
+                WHERE (CAST(:last_id AS UUID) IS NULL OR resultado_id > CAST(:last_id AS UUID))
+                  AND resultado_id <= CAST(:upper_id AS UUID)
+                  AND puntaje IS NOT NULL
+                  AND puntaje_num IS NULL
+            """), {"last_id": last_id, "upper_id": str(upper_id)})
+        last_id = str(upper_id)
@@ -0,0 +1,84 @@
+from sqlalchemy import text
+
+description = "Claves de bloqueo, cola y pares candidatos para detectar prospectos duplicados"
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        # Claves normalizadas por prospecto: dni, correo, parte local del correo, celular y nombre fonético
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS prospecto_clave_bloqueo (
+                prospecto_id UUID NOT NULL,
+                tipo VARCHAR(20) NOT NULL,
+                clave VARCHAR(255) NOT NULL,
+                PRIMARY KEY (prospecto_id, tipo, clave)
+            )
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_clave_bloqueo_clave
+            ON prospecto_clave_bloqueo (tipo, clave) INCLUDE (prospecto_id)
+        """))
+        # Pares con prospecto_a < prospecto_b para no guardar cada par dos veces
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS prospecto_duplicado_candidato (
+                prospecto_a UUID NOT NULL,
+                prospecto_b UUID NOT NULL,
+                puntaje DOUBLE PRECISION NOT NULL,
+                motivos VARCHAR(255) NOT NULL,
+                estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+                detectado_en TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+                PRIMARY KEY (prospecto_a, prospecto_b),
+                CHECK (prospecto_a < prospecto_b)
+            )
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_duplicado_candidato_estado
+            ON prospecto_duplicado_candidato (estado, puntaje DESC)
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_duplicado_candidato_b
+            ON prospecto_duplicado_candidato (prospecto_b)
+        """))
+        # Registro de fusiones: permite resolver ids de datos archivados o externos
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS prospecto_fusion (
+                prospecto_origen UUID PRIMARY KEY,
+                prospecto_destino UUID NOT NULL,
+                fecha_fusion TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+            )
+        """))
+        # Prospectos nuevos o modificados pendientes de calcular claves y candidatos
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS prospecto_dedup_pendiente (
+                prospecto_id UUID PRIMARY KEY,
+                encolado_en TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+            )
+        """))
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION encolar_dedup_prospecto() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    DELETE FROM prospecto_clave_bloqueo WHERE prospecto_id = OLD.prospecto_id;
+                    DELETE FROM prospecto_dedup_pendiente WHERE prospecto_id = OLD.prospecto_id;
+                    DELETE FROM prospecto_duplicado_candidato
+                    WHERE prospecto_a = OLD.prospecto_id OR prospecto_b = OLD.prospecto_id;
+                ELSE
+                    INSERT INTO prospecto_dedup_pendiente (prospecto_id)
+                    VALUES (NEW.prospecto_id)
+                    ON CONFLICT (prospecto_id) DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_prospecto_dedup ON prospecto"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_prospecto_dedup
+            AFTER INSERT OR DELETE OR UPDATE OF dni, nombre, correo, celular ON prospecto
+            FOR EACH ROW EXECUTE FUNCTION encolar_dedup_prospecto()
+        """))
+        # Los prospectos existentes se procesan por lotes desde la tarea de deduplicación
+        connection.execute(text("""
+            INSERT INTO prospecto_dedup_pendiente (prospecto_id)
+            SELECT prospecto_id FROM prospecto
+            ON CONFLICT (prospecto_id) DO NOTHING
+        """))
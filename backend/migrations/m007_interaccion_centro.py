@@ -0,0 +1,149 @@
+from sqlalchemy import text
+from services.partitions import is_partitioned
+
+description = "centro_id desnormalizado en interaccion y relación prospecto-centro, con backfill e índices"
+
+BACKFILL_BATCH_SIZE = 5000
+
+def _create_index_concurrently(engine, table: str, name: str, definition: str):
+    """CREATE INDEX CONCURRENTLY; en tablas particionadas, partición por partición y luego ATTACH"""
+    with engine.begin() as connection:
+        partitioned = is_partitioned(connection, table)
+        partitions = connection.execute(text("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = :table AND p.relnamespace = 'public'::regnamespace
+        """), {"table": table}).scalars().all() if partitioned else []
+        if partitioned:
+            # Índice inválido en el padre; queda válido al adjuntar el de cada partición
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}"))
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if not partitioned:
+            connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+            return
+        for partition in partitions:
+            partition_index = f"{partition}_{name.removeprefix('ix_')}"[:63]
+            connection.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {definition}"
+            ))
+            attached = connection.execute(text("""
+                SELECT 1 FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE c.relname = :index
+            """), {"index": partition_index}).scalar()
+            if not attached:
+                connection.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"))
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        # Nullable sin default: solo cambia el catálogo (en el padre y en todas las particiones)
+        connection.execute(text("ALTER TABLE interaccion ADD COLUMN IF NOT EXISTS centro_id UUID"))
+        # El centro se fija al ingresar la interacción: si el dispositivo cambia de centro,
+        # el historial conserva el centro donde ocurrió cada interacción
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION asignar_centro_interaccion() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' AND NEW.centro_id IS NOT NULL THEN
+                    RETURN NEW;
+                END IF;
+                NEW.centro_id := (SELECT centro_id FROM dispositivo WHERE dispositivo_id = NEW.dispositivo_id);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_interaccion_centro ON interaccion"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_interaccion_centro
+            BEFORE INSERT OR UPDATE OF dispositivo_id ON interaccion
+            FOR EACH ROW EXECUTE FUNCTION asignar_centro_interaccion()
+        """))
+
+        # Prospectos atendidos en cada centro: filtro por centro de las métricas de prospectos
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS prospecto_centro (
+                centro_id UUID NOT NULL,
+                prospecto_id UUID NOT NULL,
+                primera_interaccion TIMESTAMP,
+                PRIMARY KEY (centro_id, prospecto_id)
+            )
+        """))
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION registrar_prospecto_centro() RETURNS trigger AS $$
+            BEGIN
+                IF NEW.centro_id IS NOT NULL AND NEW.prospecto_id IS NOT NULL THEN
+                    INSERT INTO prospecto_centro (centro_id, prospecto_id, primera_interaccion)
+                    VALUES (NEW.centro_id, NEW.prospecto_id, NEW.timestamp)
+                    ON CONFLICT (centro_id, prospecto_id) DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_interaccion_prospecto_centro ON interaccion"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_interaccion_prospecto_centro
+            AFTER INSERT OR UPDATE OF centro_id, prospecto_id ON interaccion
+            FOR EACH ROW EXECUTE FUNCTION registrar_prospecto_centro()
+        """))
+        # Prospectos eliminados (o fusionados como duplicados) salen de la relación
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION limpiar_prospecto_centro() RETURNS trigger AS $$
+            BEGIN
+                DELETE FROM prospecto_centro WHERE prospecto_id = OLD.prospecto_id;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS trg_prospecto_centro_limpieza ON prospecto"))
+        connection.execute(text("""
+            CREATE TRIGGER trg_prospecto_centro_limpieza
+            AFTER DELETE ON prospecto
+            FOR EACH ROW EXECUTE FUNCTION limpiar_prospecto_centro()
+        """))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_prospecto_centro_prospecto ON prospecto_centro (prospecto_id)"
+        ))
+
+    # Backfill por rangos de clave con commit por lote: centro de cada interacción y
+    # relación prospecto-centro del mismo lote
+    last_id = None
+    while True:
+        with engine.begin() as connection:
+            upper_id = connection.execute(text("""
+                SELECT MAX(interaccion_id) FROM (
+                    SELECT interaccion_id FROM interaccion
+                    WHERE (CAST(:last_id AS UUID) IS NULL OR interaccion_id > CAST(:last_id AS UUID))
+                    ORDER BY interaccion_id
+                    LIMIT :batch_size
+                ) lote
+            """), {"last_id": last_id, "batch_size": BACKFILL_BATCH_SIZE}).scalar()
+            if upper_id is None:
+                break
+            params = {"last_id": last_id, "upper_id": str(upper_id)}
+            connection.execute(text("""
+                UPDATE interaccion i
+                SET centro_id = d.centro_id
+                FROM dispositivo d
+                WHERE d.dispositivo_id = i.dispositivo_id
+                  AND (CAST(:last_id AS UUID) IS NULL OR i.interaccion_id > CAST(:last_id AS UUID))
+                  AND i.interaccion_id <= CAST(:upper_id AS UUID)
+                  AND i.centro_id IS NULL
+                  AND d.centro_id IS NOT NULL
+            """), params)
+            connection.execute(text("""
+                INSERT INTO prospecto_centro (centro_id, prospecto_id, primera_interaccion)
+                SELECT centro_id, prospecto_id, MIN(timestamp)
+                FROM interaccion
+                WHERE (CAST(:last_id AS UUID) IS NULL OR interaccion_id > CAST(:last_id AS UUID))
+                  AND interaccion_id <= CAST(:upper_id AS UUID)
+                  AND centro_id IS NOT NULL
+                  AND prospecto_id IS NOT NULL
+                GROUP BY centro_id, prospecto_id
+                ON CONFLICT (centro_id, prospecto_id) DO UPDATE
+                SET primera_interaccion = LEAST(prospecto_centro.primera_interaccion, EXCLUDED.primera_interaccion)
+            """), params)
+        last_id = str(upper_id)
+
+    _create_index_concurrently(engine, "interaccion", "ix_interaccion_centro_timestamp", "(centro_id, timestamp)")
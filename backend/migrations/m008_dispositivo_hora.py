@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+description = "Rollup horario por dispositivo (interacciones, errores y última interacción)"
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS dispositivo_hora (
+                dispositivo_id VARCHAR NOT NULL,
+                hora TIMESTAMP NOT NULL,
+                total BIGINT NOT NULL,
+                errores BIGINT NOT NULL,
+                ultima_interaccion TIMESTAMP NOT NULL,
+                PRIMARY KEY (dispositivo_id, hora)
+            )
+        """))
+        # Refrescos y consultas por rango de horas de todos los dispositivos
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_dispositivo_hora_hora ON dispositivo_hora (hora)"))
@@ -0,0 +1,44 @@
+from sqlalchemy import text
+
+description = "Recorridos por flujo y agregados de transiciones, pasos y rutas entre módulos"
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        # Un recorrido por flow_id: módulos en orden (repeticiones consecutivas colapsadas)
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS flujo_recorrido (
+                flow_id UUID PRIMARY KEY,
+                inicio TIMESTAMP NOT NULL,
+                fin TIMESTAMP NOT NULL,
+                interacciones INTEGER NOT NULL,
+                modulos TEXT[] NOT NULL,
+                ruta TEXT NOT NULL
+            )
+        """))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_flujo_recorrido_inicio ON flujo_recorrido (inicio)"))
+        # Agregados que lee el endpoint; se ajustan con deltas al recalcular recorridos
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS flujo_transicion (
+                paso INTEGER NOT NULL,
+                origen TEXT NOT NULL,
+                destino TEXT NOT NULL,
+                total BIGINT NOT NULL,
+                PRIMARY KEY (paso, origen, destino)
+            )
+        """))
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS flujo_paso (
+                paso INTEGER NOT NULL,
+                modulo TEXT NOT NULL,
+                llegan BIGINT NOT NULL,
+                abandonan BIGINT NOT NULL,
+                PRIMARY KEY (paso, modulo)
+            )
+        """))
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS flujo_ruta (
+                ruta TEXT PRIMARY KEY,
+                total BIGINT NOT NULL
+            )
+        """))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_flujo_ruta_total ON flujo_ruta (total DESC)"))
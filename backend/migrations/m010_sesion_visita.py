@@ -0,0 +1,29 @@
+from sqlalchemy import text
+
+description = "Sesiones de visita por prospecto o uid_nfc, separadas por inactividad"
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        # visitante: prospecto_id si la interacción lo tiene; si no, 'nfc:' || uid_nfc
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS sesion_visita (
+                visitante TEXT NOT NULL,
+                inicio TIMESTAMP NOT NULL,
+                fin TIMESTAMP NOT NULL,
+                prospecto_id UUID,
+                uid_nfc VARCHAR,
+                centro_id UUID,
+                duracion_segundos INTEGER NOT NULL,
+                interacciones INTEGER NOT NULL,
+                modulos TEXT[] NOT NULL,
+                dispositivos TEXT[] NOT NULL,
+                PRIMARY KEY (visitante, inicio)
+            )
+        """))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_sesion_visita_inicio ON sesion_visita (inicio)"))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_sesion_visita_centro_inicio ON sesion_visita (centro_id, inicio)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_sesion_visita_prospecto ON sesion_visita (prospecto_id, inicio)"
+        ))
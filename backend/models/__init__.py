@@ -1,4 +1,4 @@
-from .database import Base, engine, SessionLocal, get_db
+from .database import Base, engine, read_engine, SessionLocal, ReadSessionLocal, get_db, get_read_db, get_reports_db
 from .prospect import Prospect
 from .interaction import Interaction
 from .test import Test
@@ -9,8 +9,12 @@ from .device import Device
 __all__ = [
     "Base",
     "engine",
+    "read_engine",
     "SessionLocal",
+    "ReadSessionLocal",
     "get_db",
+    "get_read_db",
+    "get_reports_db",
     "Prospect",
     "Interaction",
     "Test",
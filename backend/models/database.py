@@ -1,27 +1,356 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from typing import Generator
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import Pool, QueuePool
+from sqlalchemy.util import queue as sqla_queue
+from typing import AsyncGenerator, Dict
 from config import settings
+from services.admission import admission
+from services.tracing import tracer
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+# Límites (en ms) del histograma de espera por una conexión del pool
+WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+class PoolMetrics:
+    """Contadores del pool: esperas, timeouts y rotación de conexiones"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_count = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.timeouts = 0
+        self.checkouts = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.invalidations = 0
+        self.validation_runs = 0
+        self.validation_failures = 0
+
+    def observe_wait(self, elapsed_ms: float):
+        index = len(WAIT_BUCKETS_MS)
+        for i, limit in enumerate(WAIT_BUCKETS_MS):
+            if elapsed_ms <= limit:
+                index = i
+                break
+        with self._lock:
+            self.wait_buckets[index] += 1
+            self.wait_count += 1
+            self.wait_total_ms += elapsed_ms
+            self.wait_max_ms = max(self.wait_max_ms, elapsed_ms)
+
+    def incr(self, counter: str, amount: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            histogram = [
+                {'le_ms': limit, 'count': count}
+                for limit, count in zip(WAIT_BUCKETS_MS + ['+Inf'], self.wait_buckets)
+            ]
+            return {
+                'wait': {
+                    'count': self.wait_count,
+                    'avg_ms': round(self.wait_total_ms / self.wait_count, 3) if self.wait_count else 0,
+                    'max_ms': round(self.wait_max_ms, 3),
+                    'histogram': histogram
+                },
+                'timeouts': self.timeouts,
+                'checkouts': self.checkouts,
+                'churn': {
+                    'opened': self.connections_opened,
+                    'closed': self.connections_closed,
+                    'invalidated': self.invalidations
+                },
+                'validation': {
+                    'runs': self.validation_runs,
+                    'failures': self.validation_failures
+                }
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide el tiempo de espera de cada checkout"""
+
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics:
+                self.metrics.incr('timeouts')
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.observe_wait((time.perf_counter() - start) * 1000)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+# Métricas por engine ("primary", ...)
+pool_metrics: Dict[str, PoolMetrics] = {}
+
+def create_app_engine(url: str, name: str):
+    """Crear un engine con el pool configurado en settings e instrumentado"""
+    fixed = settings.DB_POOL_MODE == "fixed"
+    engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=0 if fixed else settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        # En modo fijo la validación se hace en segundo plano (validate_idle_connections)
+        pool_pre_ping=False if fixed else settings.DB_POOL_PRE_PING
+    )
+    metrics = PoolMetrics(name)
+    engine.pool.metrics = metrics
+    pool_metrics[name] = metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.incr('connections_opened')
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        metrics.incr('connections_closed')
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.incr('invalidations')
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.incr('checkouts')
+
+    return engine
+
+def pool_status(engine) -> Dict:
+    """Estado actual del pool de un engine junto con sus métricas acumuladas"""
+    pool = engine.pool
+    status = {
+        'mode': settings.DB_POOL_MODE,
+        'pool_size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': pool._max_overflow,
+        'timeout_s': pool.timeout(),
+        'recycle_s': pool._recycle,
+        'pre_ping': pool._pre_ping
+    }
+    metrics = getattr(pool, 'metrics', None)
+    if metrics:
+        status.update(metrics.snapshot())
+    return status
+
+def validate_idle_connections(engine):
+    """Validar con SELECT 1 las conexiones inactivas del pool (modo fijo sin pre-ping).
+
+    Toma los registros directamente de la cola del pool, sin bloquear y sin pasar
+    por el checkout instrumentado: la validación no cuenta como espera ni checkout.
+    """
+    pool = engine.pool
+    metrics = getattr(pool, 'metrics', None)
+    idle = pool.checkedin()
+    if idle == 0:
+        return
+    # El pool es FIFO: cada registro devuelto va al final y el siguiente es otro
+    for _ in range(idle):
+        try:
+            record = pool._pool.get(False)
+        except sqla_queue.Empty:
+            break
+        try:
+            dbapi_connection = record.get_connection()
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            # Sin autocommit el SELECT abre una transacción: no debe quedar "idle in transaction"
+            dbapi_connection.rollback()
+        except Exception as e:
+            record.invalidate(e)
+            if metrics:
+                metrics.incr('validation_failures')
+        finally:
+            pool._do_return_conn(record)
+    if metrics:
+        metrics.incr('validation_runs')
 
 # Create engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
-)
+engine = create_app_engine(settings.DATABASE_URL, "primary")
+
+# Engine de solo lectura (réplica); sin DB_READ_HOST apunta a la base principal
+read_engine = create_app_engine(settings.DB_READ_URL, "replica") if settings.DB_READ_URL else engine
+
+class RoutingSession(Session):
+    """Sesión que envía las lecturas a la réplica y las escrituras a la base principal.
+
+    Una vez que la sesión escribe (flush) queda fijada a la principal para que
+    las lecturas posteriores vean sus propios cambios.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("use_replica") and not self.info.get("force_primary") and not self._flushing:
+            return read_engine
+        return engine
+
+@event.listens_for(RoutingSession, "after_flush")
+def _stick_to_primary(session, flush_context):
+    session.info["force_primary"] = True
+
+def use_primary(db: Session) -> Session:
+    """Forzar que el resto de la sesión lea de la base principal"""
+    db.info["force_primary"] = True
+    return db
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sesiones para routers de solo lectura (analytics, reports, dashboard)
+ReadSessionLocal = sessionmaker(
+    class_=RoutingSession,
+    autocommit=False,
+    autoflush=False,
+    info={"use_replica": True}
+)
+
+@event.listens_for(Session, "after_begin")
+def _prepare_transaction(session, transaction, connection):
+    """Aplicar el statement_timeout de la sesión y registrar la conexión para poder cancelarla"""
+    timeout_ms = session.info.get("statement_timeout_ms")
+    if timeout_ms and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+    dbapi_connection = connection.connection.dbapi_connection
+    session.info["dbapi_connections"] = session.info.get("dbapi_connections", []) + [dbapi_connection]
+    # La instrumentación por sentencia (EXPLAIN de consultas lentas) solo ve la conexión
+    connection.info["endpoint_class"] = session.info.get("endpoint_class")
+
+@event.listens_for(Pool, "checkin")
+def _clear_connection_context(dbapi_connection, connection_record):
+    # info vive con la conexión física: no debe pasar al próximo checkout
+    connection_record.info.pop("endpoint_class", None)
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_transaction(session, transaction):
+    # Al terminar la transacción raíz las conexiones vuelven al pool y ya no son nuestras
+    if transaction.parent is None:
+        session.info["dbapi_connections"] = []
+
+def cancel_session_queries(db: Session):
+    """Cancelar las consultas en curso de una sesión (seguro desde otro hilo)"""
+    db.info["cancelled"] = True
+    for dbapi_connection in db.info.get("dbapi_connections", []):
+        cancel = getattr(dbapi_connection, "cancel", None)
+        if cancel:
+            try:
+                cancel()
+            except Exception:
+                pass
+
+# Se marca cuando el endpoint retorna: desde ahí la respuesta es dueña de receive
+_endpoint_done: contextvars.ContextVar = contextvars.ContextVar("endpoint_done", default=None)
+
+async def _cancel_on_disconnect(request: Request, db: Session, endpoint_done: threading.Event):
+    while True:
+        await asyncio.sleep(settings.DB_DISCONNECT_POLL_INTERVAL)
+        if endpoint_done.is_set():
+            return
+        if await request.is_disconnected():
+            cancel_session_queries(db)
+            return
+
+def _stop_watching_on_return(func):
+    def mark_done():
+        endpoint_done = _endpoint_done.get()
+        if endpoint_done is not None:
+            endpoint_done.set()
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_endpoint(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                mark_done()
+        return async_endpoint
+
+    @functools.wraps(func)
+    def endpoint(*args, **kwargs):
+        # Corre en el threadpool: Event es seguro entre hilos
+        try:
+            return func(*args, **kwargs)
+        finally:
+            mark_done()
+    return endpoint
+
+def stop_disconnect_watch_on_return(app):
+    """Dejar de vigilar la desconexión del cliente en cuanto retorna cada endpoint.
+
+    El cierre de las dependencias con yield ocurre después de enviar la respuesta;
+    sin esto el vigilante leería el http.disconnect normal del final de la solicitud.
+    """
+    from fastapi.routing import APIRoute
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            # El handler lee dependant.call en cada solicitud
+            route.dependant.call = _stop_watching_on_return(route.dependant.call)
+
+def session_dependency(session_factory, statement_timeout_ms: int, endpoint_class: str):
+    """Crear una dependencia de sesión con timeout por clase de endpoint.
+
+    Antes de abrir la sesión se pasa por el control de admisión de la clase
+    (rate limit por cliente y límite de concurrencia con cola acotada), así que
+    las solicitudes en espera no ocupan conexiones del pool. Mientras el endpoint
+    se ejecuta (en el threadpool) se vigila la conexión del cliente y, si se
+    desconecta, se cancela la consulta en curso en Postgres. La vigilancia termina
+    al retornar el endpoint (ver stop_disconnect_watch_on_return).
+    """
+    async def dependency(request: Request) -> AsyncGenerator:
+        # Span de la preparación (admisión + sesión); termina antes de entregar la sesión
+        setup = tracer.start_span(f"dependency {endpoint_class}", endpoint_class=endpoint_class)
+        try:
+            async with admission.admit(request, endpoint_class):
+                db = session_factory()
+                db.info["statement_timeout_ms"] = statement_timeout_ms
+                db.info["endpoint_class"] = endpoint_class
+                # Un mismo Event por solicitud, compartido si hay varias sesiones
+                endpoint_done = request.scope.setdefault("endpoint_done", threading.Event())
+                _endpoint_done.set(endpoint_done)
+                watcher = asyncio.ensure_future(_cancel_on_disconnect(request, db, endpoint_done))
+                if setup:
+                    tracer.end(setup)
+                    setup = None
+                try:
+                    yield db
+                finally:
+                    watcher.cancel()
+                    await run_in_threadpool(db.close)
+        except Exception as e:
+            if setup:
+                setup.error = f"{type(e).__name__}: {e}"
+                tracer.end(setup)
+            raise
+    return dependency
+
 # Create Base class
 Base = declarative_base()
 
-# Dependency to get DB session
-def get_db() -> Generator:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close() 
\ No newline at end of file
+# Dependencies to get DB sessions
+get_db = session_dependency(SessionLocal, settings.DB_STATEMENT_TIMEOUT_CRUD_MS, "crud")
+get_read_db = session_dependency(ReadSessionLocal, settings.DB_STATEMENT_TIMEOUT_ANALYTICS_MS, "analytics")
+get_reports_db = session_dependency(ReadSessionLocal, settings.DB_STATEMENT_TIMEOUT_REPORTS_MS, "reports")
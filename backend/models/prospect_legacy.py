@@ -1,6 +1,6 @@
-from sqlalchemy import Column, String, DateTime, Boolean, Text
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, DateTime, Boolean, Text, BigInteger, Float, Numeric
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from .database import Base
 
@@ -32,6 +32,20 @@ class ProspectoLegacy(Base):
             "created_at": self.fecha_registro.isoformat() if self.fecha_registro else None
         }
 
+class ProspectoEstadoHistorialLegacy(Base):
+    """Cambios de estado de prospectos (append-only, lo alimenta un trigger sobre `prospecto`)"""
+    __tablename__ = "prospecto_estado_historial"
+    
+    historial_id = Column(BigInteger, primary_key=True)
+    prospecto_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    estado_anterior = Column(String(50))
+    estado_nuevo = Column(String(50))
+    origen = Column(String(50))
+    ciudad = Column(String(100))
+    fecha_cambio = Column(DateTime, default=datetime.utcnow, nullable=False)
+    segundos_desde_registro = Column(Float)
+    es_backfill = Column(Boolean, default=False, nullable=False)
+
 class InteraccionLegacy(Base):
     __tablename__ = "interaccion"
     
@@ -39,14 +53,27 @@ class InteraccionLegacy(Base):
     prospecto_id = Column(UUID(as_uuid=True), index=True)
     uid_nfc = Column(String)
     dispositivo_id = Column(String)
+    # Centro del dispositivo al momento de la interacción (lo asigna un trigger al insertar);
+    # diferida para que las consultas del CRUD funcionen aunque falte la migración m007
+    centro_id = deferred(Column(UUID(as_uuid=True)))
     modulo = Column(String)
     accion = Column(String)
     flow_id = Column(UUID(as_uuid=True))
     orden_en_flujo = Column(String)
     estado_interaccion = Column(String)
     payload_json = Column(Text)  # JSON field
+    # Copia JSONB de payload_json (la mantiene un trigger); diferida para no cargarla en cada consulta
+    payload_jsonb = deferred(Column(JSONB))
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+class ProspectoCentroLegacy(Base):
+    """Prospectos con interacciones en cada centro (la mantiene un trigger sobre `interaccion`)"""
+    __tablename__ = "prospecto_centro"
+    
+    centro_id = Column(UUID(as_uuid=True), primary_key=True)
+    prospecto_id = Column(UUID(as_uuid=True), primary_key=True)
+    primera_interaccion = Column(DateTime)
+
 class TestResultadoLegacy(Base):
     __tablename__ = "test_resultado"
     
@@ -54,6 +81,8 @@ class TestResultadoLegacy(Base):
     test_id = Column(UUID(as_uuid=True))
     prospecto_id = Column(UUID(as_uuid=True), index=True)
     puntaje = Column(String)  # Puede ser integer, pero definido como string
+    # Copia numérica de puntaje (trigger); NULL si no es numérico. Diferida: puede faltar la migración m005
+    puntaje_num = deferred(Column(Numeric))
     clasificacion = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
@@ -1,29 +1,52 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import text, func, case, extract
 from typing import Optional, Dict, Any, List
-from models.database import get_db
+from models.database import get_read_db
+from routers.errors import http_error
+from services.analytics_snapshot import analytics_snapshot
+from services.conversion_time import average_conversion_days, conversion_time_stats
+from services.time_series import time_series, GRANULARITIES
+from services.score_stats import score_distribution
+from services.device_health import device_health
+from services.flow_paths import flow_paths
+from services.sessions import visit_sessions
+from services.single_flight import coalesce
+from services.centers import center_filter, prospects_in_center, interactions_in_center
+from config import settings
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from models.prospect_legacy import ProspectoLegacy, InteraccionLegacy, TestResultadoLegacy, AsesoriaLegacy
 from datetime import datetime, timedelta
 import calendar
+import json
+import re
+import uuid
 
 router = APIRouter()
 
 @router.get("/analytics/real-time-metrics")
-async def get_real_time_metrics(db: Session = Depends(get_db)):
+@coalesce
+def get_real_time_metrics(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Métricas en tiempo real para los KPI cards"""
     try:
+        center = [prospects_in_center(centro_id)] if centro_id else []
+        
         # Obtener totales
-        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).scalar()
+        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(*center).scalar()
         total_enrolled = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
-            ProspectoLegacy.estado == 'Matriculado'
+            ProspectoLegacy.estado == 'Matriculado',
+            *center
         ).scalar()
         
         # Calcular tasa de conversión
         conversion_rate = (total_enrolled / total_prospects * 100) if total_prospects > 0 else 0
         
-        # Tiempo promedio de conversión (simulado - en una implementación real usaríamos fecha de actualización)
-        avg_conversion_time = 18.5  # Promedio estimado en días
+        # Tiempo promedio de conversión según el historial de estados
+        avg_conversion_time = average_conversion_days(db, centro_id=centro_id) or 0
         
         # Calcular tendencias (comparar con mes anterior)
         from datetime import datetime, timedelta
@@ -32,12 +55,14 @@ async def get_real_time_metrics(db: Session = Depends(get_db)):
         
         # Leads este mes vs mes anterior
         current_month_leads = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
-            ProspectoLegacy.fecha_registro >= current_month
+            ProspectoLegacy.fecha_registro >= current_month,
+            *center
         ).scalar()
         
         previous_month_leads = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
             ProspectoLegacy.fecha_registro >= previous_month,
-            ProspectoLegacy.fecha_registro < current_month
+            ProspectoLegacy.fecha_registro < current_month,
+            *center
         ).scalar()
         
         leads_trend = ((current_month_leads - previous_month_leads) / previous_month_leads * 100) if previous_month_leads > 0 else 0
@@ -45,13 +70,15 @@ async def get_real_time_metrics(db: Session = Depends(get_db)):
         # Matriculados este mes vs mes anterior
         current_month_enrolled = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
             ProspectoLegacy.estado == 'Matriculado',
-            ProspectoLegacy.fecha_registro >= current_month
+            ProspectoLegacy.fecha_registro >= current_month,
+            *center
         ).scalar()
         
         previous_month_enrolled = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
             ProspectoLegacy.estado == 'Matriculado',
             ProspectoLegacy.fecha_registro >= previous_month,
-            ProspectoLegacy.fecha_registro < current_month
+            ProspectoLegacy.fecha_registro < current_month,
+            *center
         ).scalar()
         
         enrolled_trend = ((current_month_enrolled - previous_month_enrolled) / previous_month_enrolled * 100) if previous_month_enrolled > 0 else 0
@@ -61,6 +88,11 @@ async def get_real_time_metrics(db: Session = Depends(get_db)):
         previous_conversion = (previous_month_enrolled / previous_month_leads * 100) if previous_month_leads > 0 else 0
         conversion_trend = current_conversion - previous_conversion
         
+        # Tiempo de conversión de las matrículas de este mes vs mes anterior
+        current_time = average_conversion_days(db, start=current_month, centro_id=centro_id)
+        previous_time = average_conversion_days(db, start=previous_month, end=current_month, centro_id=centro_id)
+        time_trend = (current_time - previous_time) if current_time is not None and previous_time is not None else 0
+        
         return {
             'total_leads': total_prospects,
             'total_enrolled': total_enrolled,
@@ -70,33 +102,41 @@ async def get_real_time_metrics(db: Session = Depends(get_db)):
                 'leads_trend': round(leads_trend, 1),
                 'enrolled_trend': round(enrolled_trend, 1),
                 'conversion_trend': round(conversion_trend, 1),
-                'time_trend': 0  # Para futura implementación
+                'time_trend': round(time_trend, 1)
             }
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en métricas en tiempo real: {str(e)}")
+        raise http_error(e, "Error en métricas en tiempo real")
 
 @router.get("/analytics/conversion-funnel")
-async def get_conversion_funnel(
+@coalesce
+def get_conversion_funnel(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
 ):
     """Análisis del embudo de conversión"""
     try:
-        # Contar prospectos por estado
-        query = db.query(
-            ProspectoLegacy.estado,
-            func.count(ProspectoLegacy.prospecto_id).label('count')
-        )
-        
-        if start_date and end_date:
-            query = query.filter(
-                ProspectoLegacy.fecha_registro.between(start_date, end_date)
+        snapshot = analytics_snapshot.current()
+        if snapshot:
+            results = snapshot.state_counts(start_date, end_date, centro_id)
+        else:
+            # Contar prospectos por estado
+            query = db.query(
+                ProspectoLegacy.estado,
+                func.count(ProspectoLegacy.prospecto_id).label('count')
             )
-        
-        results = query.group_by(ProspectoLegacy.estado).all()
+            
+            if start_date and end_date:
+                query = query.filter(
+                    ProspectoLegacy.fecha_registro.between(start_date, end_date)
+                )
+            if centro_id:
+                query = query.filter(prospects_in_center(centro_id))
+            
+            results = query.group_by(ProspectoLegacy.estado).all()
         
         # Preparar datos para el embudo
         states_order = ['Nuevo', 'Contactado', 'En proceso', 'Matriculado', 'No interesado']
@@ -125,22 +165,58 @@ async def get_conversion_funnel(
         return {
             'funnel': funnel_data,
             'total_prospects': total,
-            'overall_conversion': round((state_counts.get('Matriculado', 0) / total * 100), 2) if total > 0 else 0
+            'overall_conversion': round((state_counts.get('Matriculado', 0) / total * 100), 2) if total > 0 else 0,
+            'snapshot_age_seconds': snapshot.age_seconds if snapshot else None
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis de embudo: {str(e)}")
+        raise http_error(e, "Error en análisis de embudo")
+
+@router.get("/analytics/conversion-time")
+@coalesce
+def get_conversion_time(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
+    """Tiempo de conversión (registro → matrícula): promedio y percentiles por canal y ciudad"""
+    try:
+        stats = conversion_time_stats(db, start_date, end_date, centro_id)
+        return {
+            **stats,
+            'filters': {
+                'start_date': start_date,
+                'end_date': end_date,
+                'centro_id': centro_id
+            }
+        }
+        
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido (use YYYY-MM-DD)")
+    except Exception as e:
+        raise http_error(e, "Error en análisis de tiempo de conversión")
 
 @router.get("/analytics/geographic-distribution")
-async def get_geographic_distribution(db: Session = Depends(get_db)):
+@coalesce
+def get_geographic_distribution(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Análisis de distribución geográfica"""
     try:
-        # Distribución por ciudad
-        city_stats = db.query(
-            ProspectoLegacy.ciudad,
-            func.count(ProspectoLegacy.prospecto_id).label('total'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados')
-        ).group_by(ProspectoLegacy.ciudad).all()
+        snapshot = analytics_snapshot.current()
+        if snapshot:
+            city_stats = snapshot.city_stats(centro_id)
+        else:
+            # Distribución por ciudad
+            city_stats = db.query(
+                ProspectoLegacy.ciudad,
+                func.count(ProspectoLegacy.prospecto_id).label('total'),
+                func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados')
+            ).filter(
+                *([prospects_in_center(centro_id)] if centro_id else [])
+            ).group_by(ProspectoLegacy.ciudad).all()
         
         geographic_data = []
         for stat in city_stats:
@@ -162,23 +238,34 @@ async def get_geographic_distribution(db: Session = Depends(get_db)):
         return {
             'cities': geographic_data,
             'top_cities': geographic_data[:5],
-            'total_cities': len(geographic_data)
+            'total_cities': len(geographic_data),
+            'snapshot_age_seconds': snapshot.age_seconds if snapshot else None
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis geográfico: {str(e)}")
+        raise http_error(e, "Error en análisis geográfico")
 
 @router.get("/analytics/channel-effectiveness")
-async def get_channel_effectiveness(db: Session = Depends(get_db)):
+@coalesce
+def get_channel_effectiveness(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Análisis de efectividad de canales"""
     try:
-        # Efectividad por origen
-        origin_stats = db.query(
-            ProspectoLegacy.origen,
-            func.count(ProspectoLegacy.prospecto_id).label('total'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados'),
-            func.sum(case((ProspectoLegacy.estado == 'Contactado', 1), else_=0)).label('contactados')
-        ).group_by(ProspectoLegacy.origen).all()
+        snapshot = analytics_snapshot.current()
+        if snapshot:
+            origin_stats = snapshot.origin_stats(centro_id)
+        else:
+            # Efectividad por origen
+            origin_stats = db.query(
+                ProspectoLegacy.origen,
+                func.count(ProspectoLegacy.prospecto_id).label('total'),
+                func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados'),
+                func.sum(case((ProspectoLegacy.estado == 'Contactado', 1), else_=0)).label('contactados')
+            ).filter(
+                *([prospects_in_center(centro_id)] if centro_id else [])
+            ).group_by(ProspectoLegacy.origen).all()
         
         channel_data = []
         for stat in origin_stats:
@@ -206,28 +293,35 @@ async def get_channel_effectiveness(db: Session = Depends(get_db)):
         return {
             'channels': channel_data,
             'best_performing': channel_data[0] if channel_data else None,
-            'total_channels': len(channel_data)
+            'total_channels': len(channel_data),
+            'snapshot_age_seconds': snapshot.age_seconds if snapshot else None
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis de canales: {str(e)}")
+        raise http_error(e, "Error en análisis de canales")
 
 @router.get("/analytics/interaction-patterns")
-async def get_interaction_patterns(db: Session = Depends(get_db)):
+@coalesce
+def get_interaction_patterns(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Análisis de patrones de interacción"""
     try:
+        center = [interactions_in_center(centro_id)] if centro_id else []
+        
         # Interacciones por módulo
         module_stats = db.query(
             InteraccionLegacy.modulo,
             func.count(InteraccionLegacy.interaccion_id).label('total_interactions'),
             func.count(func.distinct(InteraccionLegacy.prospecto_id)).label('unique_prospects')
-        ).group_by(InteraccionLegacy.modulo).all()
+        ).filter(*center).group_by(InteraccionLegacy.modulo).all()
         
         # Dispositivos más utilizados
         device_stats = db.query(
             InteraccionLegacy.dispositivo_id,
             func.count(InteraccionLegacy.interaccion_id).label('interactions')
-        ).group_by(InteraccionLegacy.dispositivo_id).order_by(
+        ).filter(*center).group_by(InteraccionLegacy.dispositivo_id).order_by(
             func.count(InteraccionLegacy.interaccion_id).desc()
         ).limit(10).all()
         
@@ -235,7 +329,7 @@ async def get_interaction_patterns(db: Session = Depends(get_db)):
         status_stats = db.query(
             InteraccionLegacy.estado_interaccion,
             func.count(InteraccionLegacy.interaccion_id).label('count')
-        ).group_by(InteraccionLegacy.estado_interaccion).all()
+        ).filter(*center).group_by(InteraccionLegacy.estado_interaccion).all()
         
         modules = [{
             'module': stat.modulo,
@@ -262,65 +356,129 @@ async def get_interaction_patterns(db: Session = Depends(get_db)):
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis de interacciones: {str(e)}")
+        raise http_error(e, "Error en análisis de interacciones")
 
-@router.get("/analytics/test-performance")
-async def get_test_performance(db: Session = Depends(get_db)):
-    """Análisis de rendimiento de tests"""
+PAYLOAD_PATH_PATTERN = re.compile(r'^[\w-]+(\.[\w-]+)*$')
+
+@router.get("/analytics/interaction-payloads")
+@coalesce
+def get_interaction_payloads(
+    contains: Optional[str] = Query(None, description='Objeto JSON que el payload debe contener, p. ej. {"tipo": "quiz"}'),
+    group_by: Optional[str] = Query(None, description="Clave (o ruta con puntos) del payload para agrupar"),
+    modulo: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
+    """Filtrar y agrupar interacciones por claves de su payload JSON (resuelto en Postgres)"""
     try:
-        # Estadísticas de puntajes
-        score_stats = db.query(
-            func.avg(func.cast(TestResultadoLegacy.puntaje, db.Integer)).label('avg_score'),
-            func.min(func.cast(TestResultadoLegacy.puntaje, db.Integer)).label('min_score'),
-            func.max(func.cast(TestResultadoLegacy.puntaje, db.Integer)).label('max_score'),
-            func.count(TestResultadoLegacy.resultado_id).label('total_tests')
-        ).first()
-        
-        # Distribución por clasificación
-        classification_stats = db.query(
-            TestResultadoLegacy.clasificacion,
-            func.count(TestResultadoLegacy.resultado_id).label('count')
-        ).group_by(TestResultadoLegacy.clasificacion).all()
-        
-        # Correlación con matriculación
-        enrollment_correlation = db.query(
-            func.avg(func.cast(TestResultadoLegacy.puntaje, db.Integer)).label('avg_score')
-        ).join(
-            ProspectoLegacy, TestResultadoLegacy.prospecto_id == ProspectoLegacy.prospecto_id
-        ).filter(ProspectoLegacy.estado == 'Matriculado').first()
+        filters = [InteraccionLegacy.payload_jsonb.isnot(None)]
+        if contains:
+            try:
+                contains_obj = json.loads(contains)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="contains debe ser JSON válido")
+            if not isinstance(contains_obj, dict):
+                raise HTTPException(status_code=400, detail="contains debe ser un objeto JSON")
+            # @> con el índice GIN (jsonb_path_ops)
+            filters.append(InteraccionLegacy.payload_jsonb.contains(contains_obj))
+        if modulo:
+            filters.append(InteraccionLegacy.modulo == modulo)
+        if centro_id:
+            filters.append(interactions_in_center(centro_id))
+        try:
+            if start_date:
+                filters.append(InteraccionLegacy.timestamp >= datetime.fromisoformat(start_date))
+            if end_date:
+                filters.append(InteraccionLegacy.timestamp < datetime.fromisoformat(end_date) + timedelta(days=1))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Formato de fecha inválido (use YYYY-MM-DD)")
+        
+        if group_by:
+            if not PAYLOAD_PATH_PATTERN.match(group_by):
+                raise HTTPException(status_code=400, detail="group_by debe ser una clave o ruta con puntos (a.b.c)")
+            value = InteraccionLegacy.payload_jsonb[tuple(group_by.split('.'))].astext
+        else:
+            # Sin group_by: frecuencia de las claves de primer nivel
+            payload_object = case(
+                (func.jsonb_typeof(InteraccionLegacy.payload_jsonb) == 'object', InteraccionLegacy.payload_jsonb),
+                else_=func.cast('{}', JSONB)
+            )
+            value = func.jsonb_object_keys(payload_object)
+        
+        matches = db.query(
+            value.label('value'),
+            InteraccionLegacy.prospecto_id
+        ).filter(*filters).subquery()
         
-        classifications = [{
-            'classification': stat.clasificacion,
-            'count': stat.count,
-            'percentage': round((stat.count / score_stats.total_tests * 100), 2) if score_stats.total_tests > 0 else 0
-        } for stat in classification_stats]
+        results = db.query(
+            matches.c.value,
+            func.count().label('interactions'),
+            func.count(func.distinct(matches.c.prospecto_id)).label('unique_prospects')
+        ).group_by(matches.c.value).order_by(func.count().desc()).limit(limit).all()
+        
+        total_interactions = db.query(func.count(InteraccionLegacy.interaccion_id)).filter(*filters).scalar()
         
         return {
-            'overall_stats': {
-                'average_score': round(float(score_stats.avg_score), 2) if score_stats.avg_score else 0,
-                'min_score': int(score_stats.min_score) if score_stats.min_score else 0,
-                'max_score': int(score_stats.max_score) if score_stats.max_score else 0,
-                'total_tests': score_stats.total_tests
+            'group_by': group_by or 'keys',
+            'filters': {
+                'contains': contains,
+                'modulo': modulo,
+                'start_date': start_date,
+                'end_date': end_date,
+                'centro_id': centro_id
             },
-            'classifications': classifications,
-            'enrolled_avg_score': round(float(enrollment_correlation.avg_score), 2) if enrollment_correlation.avg_score else 0
+            'groups': [{
+                'value': row.value,
+                'interactions': row.interactions,
+                'unique_prospects': row.unique_prospects
+            } for row in results],
+            'total_interactions': total_interactions
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis de tests: {str(e)}")
+        raise http_error(e, "Error en análisis de payloads")
+
+@router.get("/analytics/test-performance")
+@coalesce
+def get_test_performance(
+    test_id: Optional[str] = Query(None, description="Limitar a un test (UUID)"),
+    bins: int = Query(10, ge=1, le=100, description="Intervalos del histograma"),
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
+    """Análisis de rendimiento de tests: histograma, percentiles y estadísticas por clasificación"""
+    try:
+        if test_id:
+            try:
+                test_id = str(uuid.UUID(test_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="test_id debe ser un UUID válido")
+        return score_distribution(db, test_id, bins, centro_id)
+
+    except Exception as e:
+        raise http_error(e, "Error en análisis de tests")
 
 @router.get("/analytics/advisory-impact")
-async def get_advisory_impact(db: Session = Depends(get_db)):
+@coalesce
+def get_advisory_impact(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Análisis del impacto de asesorías"""
     try:
+        advisories_center = [prospects_in_center(centro_id, AsesoriaLegacy.prospecto_id)] if centro_id else []
+        
         # Prospectos con y sin asesoría
         prospects_with_advisory = db.query(
             func.count(func.distinct(AsesoriaLegacy.prospecto_id)).label('count')
-        ).scalar()
+        ).filter(*advisories_center).scalar()
         
         total_prospects = db.query(
             func.count(ProspectoLegacy.prospecto_id)
-        ).scalar()
+        ).filter(*([prospects_in_center(centro_id)] if centro_id else [])).scalar()
         
         prospects_without_advisory = total_prospects - prospects_with_advisory
         
@@ -329,13 +487,13 @@ async def get_advisory_impact(db: Session = Depends(get_db)):
             func.count(func.distinct(ProspectoLegacy.prospecto_id))
         ).join(
             AsesoriaLegacy, ProspectoLegacy.prospecto_id == AsesoriaLegacy.prospecto_id
-        ).filter(ProspectoLegacy.estado == 'Matriculado').scalar()
+        ).filter(ProspectoLegacy.estado == 'Matriculado', *advisories_center).scalar()
         
         # Modalidades preferidas
         modality_stats = db.query(
             AsesoriaLegacy.modalidad_preferida,
             func.count(AsesoriaLegacy.asesoria_id).label('count')
-        ).group_by(AsesoriaLegacy.modalidad_preferida).all()
+        ).filter(*advisories_center).group_by(AsesoriaLegacy.modalidad_preferida).all()
         
         advisory_conversion = (enrolled_with_advisory / prospects_with_advisory * 100) if prospects_with_advisory > 0 else 0
         
@@ -354,12 +512,14 @@ async def get_advisory_impact(db: Session = Depends(get_db)):
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis de asesorías: {str(e)}")
+        raise http_error(e, "Error en análisis de asesorías")
 
 @router.get("/analytics/temporal-trends")
-async def get_temporal_trends(
+@coalesce
+def get_temporal_trends(
     period: str = Query('month', regex='^(day|week|month)$'),
-    db: Session = Depends(get_db)
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
 ):
     """Análisis de tendencias temporales"""
     try:
@@ -376,14 +536,19 @@ async def get_temporal_trends(
         
         cutoff_date = datetime.now() - timedelta(days=days_back)
         
-        # Tendencia de registros
-        registration_trend = db.query(
-            date_format.label('period'),
-            func.count(ProspectoLegacy.prospecto_id).label('registrations'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('enrollments')
-        ).filter(
-            ProspectoLegacy.fecha_registro >= cutoff_date
-        ).group_by(date_format).order_by(date_format).all()
+        snapshot = analytics_snapshot.current()
+        if snapshot:
+            registration_trend = snapshot.period_stats(period, cutoff_date, centro_id)
+        else:
+            # Tendencia de registros
+            registration_trend = db.query(
+                date_format.label('period'),
+                func.count(ProspectoLegacy.prospecto_id).label('registrations'),
+                func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('enrollments')
+            ).filter(
+                ProspectoLegacy.fecha_registro >= cutoff_date,
+                *([prospects_in_center(centro_id)] if centro_id else [])
+            ).group_by(date_format).order_by(date_format).all()
         
         trends = [{
             'period': trend.period.isoformat() if trend.period else None,
@@ -395,48 +560,179 @@ async def get_temporal_trends(
         return {
             'period': period,
             'trends': trends,
-            'total_periods': len(trends)
+            'total_periods': len(trends),
+            'snapshot_age_seconds': snapshot.age_seconds if snapshot else None
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en análisis temporal: {str(e)}")
+        raise http_error(e, "Error en análisis temporal")
+
+def _local_range(start: Optional[str], end: Optional[str], tz: Optional[str], granularity: str,
+                 default_hours: Optional[int] = None):
+    """Validar zona horaria y rango [start, end) en hora local.
+
+    Sin start ni end: los últimos 30 días o, con `default_hours`, esas horas hasta la hora en curso.
+    """
+    timezone = tz or settings.ANALYTICS_TIMEZONE
+    try:
+        local_now = datetime.now(ZoneInfo(timezone)).replace(tzinfo=None)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Zona horaria inválida: {timezone}")
+    
+    try:
+        if default_hours and not start and not end:
+            end_dt = local_now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            start_dt = end_dt - timedelta(hours=default_hours)
+        else:
+            # Una fecha sin hora como `end` incluye ese día completo
+            end_dt = datetime.fromisoformat(end) if end else local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+            if not end or len(end) == 10:
+                end_dt += timedelta(days=1)
+            start_dt = datetime.fromisoformat(start) if start else end_dt - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido (use ISO 8601)")
+    
+    if start_dt.tzinfo or end_dt.tzinfo:
+        raise HTTPException(status_code=400, detail="Use fechas sin offset y el parámetro tz")
+    if start_dt >= end_dt:
+        raise HTTPException(status_code=400, detail="start debe ser anterior a end")
+    if (end_dt - start_dt) / GRANULARITIES[granularity] > settings.ANALYTICS_TIME_SERIES_MAX_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El rango supera {settings.ANALYTICS_TIME_SERIES_MAX_POINTS} puntos; use una granularidad mayor"
+        )
+    return start_dt, end_dt, timezone
+
+@router.get("/analytics/time-series")
+@coalesce
+def get_time_series(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: str = Query('day', regex='^(hour|day|week|month)$'),
+    tz: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
+    """Serie temporal sin huecos de registros, matrículas e interacciones"""
+    try:
+        start_dt, end_dt, timezone = _local_range(start, end, tz, granularity)
+        return time_series(db, start_dt, end_dt, granularity, timezone, centro_id)
+        
+    except Exception as e:
+        raise http_error(e, "Error en serie temporal")
+
+@router.get("/analytics/devices")
+@coalesce
+def get_device_health(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: str = Query('hour', regex='^(hour|day)$'),
+    tz: Optional[str] = None,
+    idle_minutes: Optional[int] = Query(None, ge=1, description="Minutos sin interacciones para marcar un dispositivo inactivo"),
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
+    """Throughput por intervalo, última interacción, tasa de error e inactividad de cada dispositivo"""
+    try:
+        # Por defecto, las últimas 24 horas hasta la hora en curso
+        start_dt, end_dt, timezone = _local_range(start, end, tz, granularity, default_hours=24)
+        return device_health(
+            db, start_dt, end_dt, granularity, timezone,
+            idle_minutes or settings.DEVICE_IDLE_MINUTES, centro_id
+        )
+        
+    except Exception as e:
+        raise http_error(e, "Error en salud de dispositivos")
+
+@router.get("/analytics/flows")
+@coalesce
+def get_flow_paths(
+    max_steps: int = Query(settings.FLOW_MAX_PATH_STEPS, ge=2, le=settings.FLOW_MAX_PATH_STEPS),
+    min_count: int = Query(1, ge=1, description="Omitir transiciones con menos recorridos"),
+    paths: int = Query(10, ge=1, le=100, description="Cantidad de rutas más frecuentes"),
+    db: Session = Depends(get_read_db)
+):
+    """Recorridos entre módulos: transiciones, abandono por paso, rutas frecuentes y Sankey"""
+    try:
+        return flow_paths(db, max_steps, min_count, paths)
+        
+    except Exception as e:
+        raise http_error(e, "Error en análisis de recorridos")
+
+@router.get("/analytics/sessions")
+@coalesce
+def get_visit_sessions(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: str = Query('day', regex='^(hour|day)$'),
+    tz: Optional[str] = None,
+    prospecto_id: Optional[str] = None,
+    limit: int = Query(20, ge=0, le=500, description="Cantidad de sesiones recientes a listar"),
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
+    """Sesiones de visita (por prospecto o uid_nfc) separadas por inactividad"""
+    try:
+        start_dt, end_dt, timezone = _local_range(start, end, tz, granularity)
+        if prospecto_id:
+            try:
+                prospecto_id = str(uuid.UUID(prospecto_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="prospecto_id debe ser un UUID válido")
+        return visit_sessions(db, start_dt, end_dt, granularity, timezone, centro_id, prospecto_id, limit)
+        
+    except Exception as e:
+        raise http_error(e, "Error en sesiones de visita")
 
 @router.get("/analytics/operational-kpis")
-async def get_operational_kpis(db: Session = Depends(get_db)):
+@coalesce
+def get_operational_kpis(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """KPIs operacionales en tiempo real"""
     try:
-        today = datetime.now().date()
+        center = [prospects_in_center(centro_id)] if centro_id else []
+
+        # Límites como timestamps (sin date() sobre la columna) para usar índices y podar particiones
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         week_ago = today - timedelta(days=7)
         month_ago = today - timedelta(days=30)
         
         # KPIs principales
-        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).scalar()
+        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(*center).scalar()
         new_this_week = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
-            func.date(ProspectoLegacy.fecha_registro) >= week_ago
+            ProspectoLegacy.fecha_registro >= week_ago,
+            *center
         ).scalar()
         enrolled_this_month = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
             ProspectoLegacy.estado == 'Matriculado',
-            func.date(ProspectoLegacy.fecha_registro) >= month_ago
+            ProspectoLegacy.fecha_registro >= month_ago,
+            *center
         ).scalar()
         
         # Prospectos en proceso
         in_process = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
-            ProspectoLegacy.estado.in_(['Contactado', 'En proceso'])
+            ProspectoLegacy.estado.in_(['Contactado', 'En proceso']),
+            *center
         ).scalar()
         
         # Interacciones recientes
         recent_interactions = db.query(func.count(InteraccionLegacy.interaccion_id)).filter(
-            func.date(InteraccionLegacy.timestamp) >= week_ago
+            InteraccionLegacy.timestamp >= week_ago,
+            *([interactions_in_center(centro_id)] if centro_id else [])
         ).scalar()
         
         # Tests completados esta semana
         recent_tests = db.query(func.count(TestResultadoLegacy.resultado_id)).filter(
-            func.date(TestResultadoLegacy.timestamp) >= week_ago
+            TestResultadoLegacy.timestamp >= week_ago,
+            *([prospects_in_center(centro_id, TestResultadoLegacy.prospecto_id)] if centro_id else [])
         ).scalar()
         
         # Asesorías programadas
         recent_advisories = db.query(func.count(AsesoriaLegacy.asesoria_id)).filter(
-            func.date(AsesoriaLegacy.fecha_asesoria) >= week_ago
+            AsesoriaLegacy.fecha_asesoria >= week_ago,
+            *([prospects_in_center(centro_id, AsesoriaLegacy.prospecto_id)] if centro_id else [])
         ).scalar()
         
         return {
@@ -451,4 +747,4 @@ async def get_operational_kpis(db: Session = Depends(get_db)):
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en KPIs operacionales: {str(e)}")
+        raise http_error(e, "Error en KPIs operacionales")
@@ -1,7 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from typing import Optional
 from sqlalchemy import func, text
-from models.database import get_db
+from models.database import get_read_db
+from routers.errors import http_error
+from services.analytics_snapshot import analytics_snapshot
+from services.single_flight import coalesce
+from services.centers import (
+    center_filter,
+    prospects_in_center,
+    interactions_in_center,
+    PROSPECTS_IN_CENTER_SQL,
+    INTERACTIONS_IN_CENTER_SQL
+)
 from models.prospect_legacy import (
     ProspectoLegacy, 
     InteraccionLegacy, 
@@ -10,32 +21,49 @@ from models.prospect_legacy import (
     CentroExperienciaLegacy,
     DispositivoLegacy
 )
+from datetime import date, datetime, timedelta
+import uuid
 
 router = APIRouter()
 
 @router.get("/dashboard/metrics")
-async def get_dashboard_metrics(db: Session = Depends(get_db)):
+@coalesce
+def get_dashboard_metrics(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Obtener métricas principales del dashboard"""
     try:
+        prospects, interactions, tests, advisories, centers, devices = [], [], [], [], [], []
+        if centro_id:
+            center_uuid = uuid.UUID(centro_id)
+            prospects = [prospects_in_center(centro_id)]
+            interactions = [interactions_in_center(centro_id)]
+            tests = [prospects_in_center(centro_id, TestResultadoLegacy.prospecto_id)]
+            advisories = [prospects_in_center(centro_id, AsesoriaLegacy.prospecto_id)]
+            centers = [CentroExperienciaLegacy.centro_id == center_uuid]
+            devices = [DispositivoLegacy.centro_id == center_uuid]
+        
         # Total de prospectos
-        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).scalar() or 0
+        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(*prospects).scalar() or 0
         
         # Total de interacciones
-        total_interactions = db.query(func.count(InteraccionLegacy.interaccion_id)).scalar() or 0
+        total_interactions = db.query(func.count(InteraccionLegacy.interaccion_id)).filter(*interactions).scalar() or 0
         
         # Total de tests completados
-        completed_tests = db.query(func.count(TestResultadoLegacy.resultado_id)).scalar() or 0
+        completed_tests = db.query(func.count(TestResultadoLegacy.resultado_id)).filter(*tests).scalar() or 0
         
         # Total de asesorías
-        total_advisories = db.query(func.count(AsesoriaLegacy.asesoria_id)).scalar() or 0
+        total_advisories = db.query(func.count(AsesoriaLegacy.asesoria_id)).filter(*advisories).scalar() or 0
         
         # Centros activos
         active_centers = db.query(func.count(CentroExperienciaLegacy.centro_id)).filter(
-            CentroExperienciaLegacy.activo == True
+            CentroExperienciaLegacy.activo == True,
+            *centers
         ).scalar() or 0
         
         # Total de dispositivos
-        total_devices = db.query(func.count(DispositivoLegacy.dispositivo_id)).scalar() or 0
+        total_devices = db.query(func.count(DispositivoLegacy.dispositivo_id)).filter(*devices).scalar() or 0
         
         return {
             "total_prospects": total_prospects,
@@ -48,22 +76,32 @@ async def get_dashboard_metrics(db: Session = Depends(get_db)):
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener métricas: {str(e)}")
+        raise http_error(e, "Error al obtener métricas")
 
 @router.get("/dashboard/interactions-chart")
-async def get_interactions_chart(db: Session = Depends(get_db)):
+@coalesce
+def get_interactions_chart(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Obtener datos para gráfico de interacciones por fecha"""
     try:
-        # Query para obtener interacciones por día de los últimos 30 días
-        result = db.execute(text("""
-            SELECT 
-                DATE(timestamp) as fecha,
-                COUNT(*) as total
-            FROM interaccion 
-            WHERE timestamp >= CURRENT_DATE - INTERVAL '30 days'
-            GROUP BY DATE(timestamp)
-            ORDER BY fecha
-        """))
+        snapshot = analytics_snapshot.current()
+        since = datetime.combine(date.today() - timedelta(days=30), datetime.min.time())
+        result = snapshot.interactions_by_day(since, centro_id) if snapshot else None
+        if result is None:
+            snapshot = None
+            center = f"AND {INTERACTIONS_IN_CENTER_SQL}" if centro_id else ""
+            # Query para obtener interacciones por día de los últimos 30 días
+            result = db.execute(text(f"""
+                SELECT 
+                    DATE(timestamp) as fecha,
+                    COUNT(*) as total
+                FROM interaccion 
+                WHERE timestamp >= :since {center}
+                GROUP BY DATE(timestamp)
+                ORDER BY fecha
+            """), {"since": since, "centro_id": centro_id})
         
         data = []
         for row in result:
@@ -74,34 +112,32 @@ async def get_interactions_chart(db: Session = Depends(get_db)):
         
         return {
             "data": data,
-            "period": "last_30_days"
+            "period": "last_30_days",
+            "snapshot_age_seconds": snapshot.age_seconds if snapshot else None
         }
         
     except Exception as e:
-        # Devolver datos de ejemplo si hay error
-        return {
-            "data": [
-                {"date": "2024-05-01", "interactions": 12},
-                {"date": "2024-05-02", "interactions": 8},
-                {"date": "2024-05-03", "interactions": 15},
-            ],
-            "period": "last_30_days"
-        }
+        raise http_error(e, "Error al obtener el gráfico de interacciones")
 
 @router.get("/dashboard/cities-chart") 
-async def get_cities_chart(db: Session = Depends(get_db)):
+@coalesce
+def get_cities_chart(
+    centro_id: Optional[str] = Depends(center_filter),
+    db: Session = Depends(get_read_db)
+):
     """Obtener datos para gráfico de prospectos por ciudad"""
     try:
-        result = db.execute(text("""
+        center = f"AND {PROSPECTS_IN_CENTER_SQL}" if centro_id else ""
+        result = db.execute(text(f"""
             SELECT 
                 ciudad,
                 COUNT(*) as total
             FROM prospecto 
-            WHERE ciudad IS NOT NULL
+            WHERE ciudad IS NOT NULL {center}
             GROUP BY ciudad
             ORDER BY total DESC
             LIMIT 10
-        """))
+        """), {"centro_id": centro_id})
         
         data = []
         for row in result:
@@ -116,12 +152,4 @@ async def get_cities_chart(db: Session = Depends(get_db)):
         }
         
     except Exception as e:
-        # Devolver datos de ejemplo si hay error
-        return {
-            "data": [
-                {"city": "Lima", "prospects": 45},
-                {"city": "Arequipa", "prospects": 23},
-                {"city": "Huancayo", "prospects": 18},
-            ],
-            "total_cities": 3
-        } 
\ No newline at end of file
+        raise http_error(e, "Error al obtener el gráfico de ciudades") 
\ No newline at end of file
@@ -0,0 +1,100 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import List
+from models.database import get_db
+from routers.errors import http_error
+from services.dedup import list_candidates, dismiss_candidates, merge_prospects
+from services.report_cache import report_cache
+from pydantic import BaseModel
+import uuid
+
+router = APIRouter()
+
+CANDIDATE_STATUSES = ("pendiente", "descartado")
+
+class MergeItem(BaseModel):
+    keep_id: str
+    merge_id: str
+
+class MergeRequest(BaseModel):
+    merges: List[MergeItem]
+
+class PairItem(BaseModel):
+    prospect_a: str
+    prospect_b: str
+
+class DismissRequest(BaseModel):
+    pairs: List[PairItem]
+
+def _uuid(value: str) -> str:
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"ID de prospecto inválido: {value}")
+
+@router.get("/prospects/duplicates")
+def get_duplicate_candidates(
+    status: str = Query("pendiente", description="pendiente o descartado"),
+    min_score: float = Query(0.0, ge=0, le=1, description="Puntaje mínimo del par"),
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """Pares de prospectos posiblemente duplicados, ordenados por puntaje"""
+    try:
+        if status not in CANDIDATE_STATUSES:
+            raise HTTPException(status_code=400, detail=f"status debe ser uno de: {', '.join(CANDIDATE_STATUSES)}")
+        result = list_candidates(db, status, min_score, limit, (page - 1) * limit)
+        pending = db.execute(text("SELECT COUNT(*) FROM prospecto_dedup_pendiente")).scalar()
+        return {**result, "page": page, "limit": limit, "pending_prospects": pending}
+
+    except Exception as e:
+        raise http_error(e, "Error al obtener duplicados")
+
+@router.post("/prospects/duplicates/dismiss")
+def dismiss_duplicate_candidates(request: DismissRequest, db: Session = Depends(get_db)):
+    """Descartar pares candidatos que no son la misma persona"""
+    try:
+        pairs = [(_uuid(pair.prospect_a), _uuid(pair.prospect_b)) for pair in request.pairs]
+        dismissed = dismiss_candidates(db, pairs)
+        db.commit()
+        return {"message": "Pares descartados", "dismissed": dismissed}
+
+    except Exception as e:
+        db.rollback()
+        raise http_error(e, "Error al descartar duplicados")
+
+@router.post("/prospects/duplicates/merge")
+def merge_duplicate_prospects(request: MergeRequest, db: Session = Depends(get_db)):
+    """Fusionar prospectos duplicados en lote: las interacciones, tests, asesorías e
+    historial del duplicado pasan al prospecto conservado y el duplicado se elimina"""
+    try:
+        merges = [(_uuid(item.keep_id), _uuid(item.merge_id)) for item in request.merges]
+        if not merges:
+            raise HTTPException(status_code=400, detail="No hay fusiones que aplicar")
+        keep_ids = {keep for keep, _ in merges}
+        merge_ids = [merge for _, merge in merges]
+        if len(set(merge_ids)) != len(merge_ids):
+            raise HTTPException(status_code=400, detail="Un prospecto no puede fusionarse dos veces")
+        if keep_ids & set(merge_ids):
+            raise HTTPException(
+                status_code=400,
+                detail="Un prospecto no puede conservarse y fusionarse en el mismo lote"
+            )
+
+        existing = db.execute(
+            text("SELECT COUNT(*) FROM prospecto WHERE prospecto_id = ANY(CAST(:ids AS UUID[]))"),
+            {"ids": list(keep_ids | set(merge_ids))}
+        ).scalar()
+        if existing != len(keep_ids) + len(merge_ids):
+            raise HTTPException(status_code=404, detail="Alguno de los prospectos no existe")
+
+        result = merge_prospects(db, merges)
+        db.commit()
+        report_cache.bump_data_version()
+        return {"message": "Prospectos fusionados exitosamente", **result}
+
+    except Exception as e:
+        db.rollback()
+        raise http_error(e, "Error al fusionar prospectos")
@@ -0,0 +1,29 @@
+from fastapi import HTTPException
+from sqlalchemy import exc
+
+# Códigos SQLSTATE de Postgres
+QUERY_CANCELED = "57014"
+LOCK_NOT_AVAILABLE = "55P03"
+
+def http_error(e: Exception, message: str) -> HTTPException:
+    """Traducir una excepción a HTTPException; timeouts de BD a 503/504 en vez de 500"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, exc.TimeoutError):
+        # Pool de conexiones agotado
+        return HTTPException(
+            status_code=503,
+            detail=f"{message}: no hay conexiones disponibles, intente nuevamente",
+            headers={"Retry-After": "5"}
+        )
+    if isinstance(e, exc.DBAPIError):
+        pgcode = getattr(e.orig, "pgcode", None)
+        if pgcode == QUERY_CANCELED:
+            return HTTPException(status_code=504, detail=f"{message}: la consulta excedió el tiempo límite")
+        if pgcode == LOCK_NOT_AVAILABLE:
+            return HTTPException(
+                status_code=503,
+                detail=f"{message}: recurso bloqueado, intente nuevamente",
+                headers={"Retry-After": "2"}
+            )
+    return HTTPException(status_code=500, detail=f"{message}: {str(e)}")
@@ -0,0 +1,99 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import FileResponse
+from typing import Optional
+from models.database import engine, read_engine, pool_status
+from services.report_cache import report_cache
+from services.analytics_snapshot import analytics_snapshot
+from services.startup_profile import startup_profile
+from services.admission import admission
+from services.single_flight import single_flight
+from services.tracing import tracer
+from services.explain_capture import explain_capture
+from services.request_profiler import request_profiler, require_profiler_token, FOLDED_SUFFIX
+
+router = APIRouter()
+
+@router.get("/monitoring/db-pool")
+async def get_db_pool_status():
+    """Estado y métricas del pool de conexiones"""
+    engines = {'primary': pool_status(engine)}
+    if read_engine is not engine:
+        engines['replica'] = pool_status(read_engine)
+    return {'engines': engines}
+
+@router.get("/monitoring/report-cache")
+async def get_report_cache_status():
+    """Estado de la caché de reportes en disco"""
+    return report_cache.stats()
+
+
+@router.get("/monitoring/analytics-snapshot")
+async def get_analytics_snapshot_status():
+    """Estado del snapshot de analytics en memoria"""
+    return analytics_snapshot.status()
+
+@router.get("/monitoring/startup")
+async def get_startup_profile():
+    """Perfil de arranque: fases y módulos más lentos de importar (STARTUP_PROFILE=true)"""
+    return startup_profile.report()
+
+@router.get("/monitoring/admission")
+async def get_admission_status():
+    """Bulkheads (activos, profundidad de cola, rechazos) y rate limits por clase de endpoint"""
+    return admission.status()
+
+@router.get("/monitoring/single-flight")
+async def get_single_flight_status():
+    """Cálculos en curso y solicitudes que compartieron un resultado, por endpoint"""
+    return single_flight.status()
+
+@router.get("/monitoring/tracing")
+async def get_tracing_status():
+    """Estado del exportador de trazas (exportados, descartados, errores)"""
+    return tracer.status()
+
+@router.get("/monitoring/traces")
+async def get_recent_traces(limit: int = Query(50, ge=1, le=200), path: Optional[str] = None):
+    """Últimas solicitudes trazadas con su desglose de latencia por tipo de span"""
+    traces = [trace for trace in reversed(tracer.recent)
+              if not path or path in trace['attributes'].get('http.target', '')]
+    return {'traces': traces[:limit]}
+
+@router.get("/monitoring/profiles", dependencies=[Depends(require_profiler_token)])
+async def list_request_profiles():
+    """Perfiles de solicitudes guardados (más reciente primero)"""
+    return {'profiles': request_profiler.list()}
+
+@router.get("/monitoring/profiles/{profile_id}", dependencies=[Depends(require_profiler_token)])
+async def get_request_profile(profile_id: str):
+    """Resumen de un perfil: tiempo SQL vs Python, desglose y funciones más costosas"""
+    return request_profiler.load(profile_id)
+
+@router.get("/monitoring/profiles/{profile_id}/folded", dependencies=[Depends(require_profiler_token)])
+async def download_request_profile(profile_id: str):
+    """Pilas muestreadas en formato folded (flamegraph.pl, speedscope)"""
+    return FileResponse(
+        request_profiler.path(profile_id, FOLDED_SUFFIX),
+        media_type="text/plain",
+        filename=f"{profile_id}{FOLDED_SUFFIX}"
+    )
+
+@router.get("/monitoring/slow-queries", dependencies=[Depends(require_profiler_token)])
+async def get_slow_query_plans(
+    endpoint_class: Optional[str] = None,
+    fingerprint: Optional[str] = Query(None, description="Huella del plan o de la sentencia"),
+    seq_scan: Optional[str] = Query(None, description="Solo planes con Seq Scan sobre esta tabla"),
+    changed_only: bool = Query(False, description="Solo capturas cuyo plan cambió respecto del anterior"),
+    include_plan: bool = Query(False, description="Incluir el JSON completo del EXPLAIN"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Planes capturados de consultas lentas o muestreadas (más reciente primero)"""
+    return {
+        'status': explain_capture.status(),
+        'plans': explain_capture.query(endpoint_class, fingerprint, seq_scan, changed_only, limit, include_plan)
+    }
+
+@router.get("/monitoring/slow-queries/fingerprints", dependencies=[Depends(require_profiler_token)])
+async def get_slow_query_fingerprints():
+    """Planes distintos por sentencia: más de uno indica un cambio de plan"""
+    return {'statements': explain_capture.fingerprints()}
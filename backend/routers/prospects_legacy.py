@@ -1,8 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func
-from typing import Optional, Dict, Any
+from sqlalchemy import text, func, select, update
+from typing import Optional, Dict, Any, List
 from models.database import get_db
+from config import settings
+from routers.errors import http_error
+from services.report_cache import report_cache
+from services.tracing import tracer
 from models.prospect_legacy import ProspectoLegacy, InteraccionLegacy, TestResultadoLegacy, AsesoriaLegacy
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
@@ -34,8 +38,54 @@ class ProspectUpdate(BaseModel):
     consentimiento_datos: Optional[bool] = None
     estado: Optional[str] = None
 
+class ProspectFilter(BaseModel):
+    search: Optional[str] = None
+    city: Optional[str] = None
+    status: Optional[str] = None
+    origin: Optional[str] = None
+
+class ProspectBatchUpdate(BaseModel):
+    ids: Optional[List[str]] = None
+    filter: Optional[ProspectFilter] = None
+    changes: ProspectUpdate
+    # Solo se actualizan los prospectos que están en este estado (p.ej. "Contactado")
+    expected_status: Optional[str] = None
+    dry_run: bool = False
+
+# Campos únicos por prospecto: no se pueden asignar en lote
+BATCH_EXCLUDED_FIELDS = {"dni", "correo"}
+
+# Mapear estados del frontend al backend
+STATUS_MAPPING = {
+    "nuevo": "Nuevo",
+    "contactado": "Contactado",
+    "en_proceso": "En proceso",
+    "matriculado": "Matriculado",
+    "no_interesado": "No interesado"
+}
+
+def prospect_filters(search: Optional[str] = None, city: Optional[str] = None,
+                     status: Optional[str] = None, origin: Optional[str] = None) -> List:
+    """Condiciones de filtrado de prospectos (listado y actualización en lote)"""
+    conditions = []
+    if search:
+        search_filter = f"%{search}%"
+        conditions.append(
+            (ProspectoLegacy.nombre.ilike(search_filter)) |
+            (ProspectoLegacy.dni.ilike(search_filter)) |
+            (ProspectoLegacy.correo.ilike(search_filter))
+        )
+    if city:
+        conditions.append(ProspectoLegacy.ciudad.ilike(f"%{city}%"))
+    if status:
+        backend_status = STATUS_MAPPING.get(status.lower(), status)
+        conditions.append(ProspectoLegacy.estado.ilike(f"%{backend_status}%"))
+    if origin:
+        conditions.append(ProspectoLegacy.origen.ilike(f"%{origin}%"))
+    return conditions
+
 @router.get("/prospects")
-async def get_prospects(
+def get_prospects(
     page: int = Query(1, ge=1),
     limit: int = Query(25, ge=1, le=100),
     search: Optional[str] = None,
@@ -46,35 +96,8 @@ async def get_prospects(
 ):
     """Obtener lista de prospectos con filtros y paginación"""
     try:
-        # Construir query base
-        query = db.query(ProspectoLegacy)
-        
-        # Aplicar filtros
-        if search:
-            search_filter = f"%{search}%"
-            query = query.filter(
-                (ProspectoLegacy.nombre.ilike(search_filter)) |
-                (ProspectoLegacy.dni.ilike(search_filter)) |
-                (ProspectoLegacy.correo.ilike(search_filter))
-            )
-        
-        if city:
-            query = query.filter(ProspectoLegacy.ciudad.ilike(f"%{city}%"))
-            
-        if status:
-            # Mapear estados del frontend al backend
-            status_mapping = {
-                "nuevo": "Nuevo",
-                "contactado": "Contactado", 
-                "en_proceso": "En proceso",
-                "matriculado": "Matriculado",
-                "no_interesado": "No interesado"
-            }
-            backend_status = status_mapping.get(status.lower(), status)
-            query = query.filter(ProspectoLegacy.estado.ilike(f"%{backend_status}%"))
-            
-        if origin:
-            query = query.filter(ProspectoLegacy.origen.ilike(f"%{origin}%"))
+        # Construir query base con los filtros
+        query = db.query(ProspectoLegacy).filter(*prospect_filters(search, city, status, origin))
         
         # Obtener total de registros para paginación
         total = query.count()
@@ -88,9 +111,10 @@ async def get_prospects(
         
         # Convertir a formato esperado por el frontend
         prospects_data = []
-        for prospect in prospects:
-            prospect_dict = prospect.to_dict()
-            prospects_data.append(prospect_dict)
+        with tracer.span("serialize.to_dict", rows=len(prospects)):
+            for prospect in prospects:
+                prospect_dict = prospect.to_dict()
+                prospects_data.append(prospect_dict)
         
         return {
             "data": prospects_data,
@@ -103,10 +127,10 @@ async def get_prospects(
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener prospectos: {str(e)}")
+        raise http_error(e, "Error al obtener prospectos")
 
 @router.get("/prospects/{prospect_id}")
-async def get_prospect(prospect_id: str, db: Session = Depends(get_db)):
+def get_prospect(prospect_id: str, db: Session = Depends(get_db)):
     """Obtener un prospecto específico por ID"""
     try:
         # Evitar que "new" sea tratado como un ID
@@ -125,10 +149,10 @@ async def get_prospect(prospect_id: str, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener prospecto: {str(e)}")
+        raise http_error(e, "Error al obtener prospecto")
 
 @router.post("/prospects")
-async def create_prospect(prospect_data: ProspectCreate, db: Session = Depends(get_db)):
+def create_prospect(prospect_data: ProspectCreate, db: Session = Depends(get_db)):
     """Crear un nuevo prospecto"""
     try:
         # Verificar si ya existe un prospecto con el mismo DNI o correo
@@ -161,6 +185,7 @@ async def create_prospect(prospect_data: ProspectCreate, db: Session = Depends(g
         db.add(new_prospect)
         db.commit()
         db.refresh(new_prospect)
+        report_cache.bump_data_version()
         
         return {
             "message": "Prospecto creado exitosamente",
@@ -171,10 +196,121 @@ async def create_prospect(prospect_data: ProspectCreate, db: Session = Depends(g
         raise
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error al crear prospecto: {str(e)}")
+        raise http_error(e, "Error al crear prospecto")
+
+@router.post("/prospects/batch-update")
+def batch_update_prospects(request: ProspectBatchUpdate, db: Session = Depends(get_db)):
+    """Actualizar en lote (por ids o por filtro) con un único UPDATE ... RETURNING"""
+    try:
+        changes = request.changes.dict(exclude_unset=True)
+        if not changes:
+            raise HTTPException(status_code=400, detail="No hay cambios que aplicar")
+        if BATCH_EXCLUDED_FIELDS & changes.keys():
+            raise HTTPException(status_code=400, detail="dni y correo no se pueden modificar en lote")
+        if (request.ids is None) == (request.filter is None):
+            raise HTTPException(status_code=400, detail="Indique ids o filter (solo uno)")
+
+        results: Dict[str, Dict[str, Any]] = {}
+        if request.ids is not None:
+            if len(request.ids) > settings.PROSPECT_BATCH_MAX_ROWS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Máximo {settings.PROSPECT_BATCH_MAX_ROWS} prospectos por lote"
+                )
+            valid_ids = []
+            for prospect_id in request.ids:
+                try:
+                    valid_ids.append(uuid.UUID(prospect_id))
+                except ValueError:
+                    results[prospect_id] = {"id": prospect_id, "result": "invalid_id"}
+            conditions = [ProspectoLegacy.prospecto_id.in_(valid_ids)]
+        else:
+            conditions = prospect_filters(**request.filter.dict())
+            if not conditions:
+                raise HTTPException(status_code=400, detail="El filtro no puede estar vacío")
+        if request.expected_status:
+            # Igual que filter.status: acepta la clave del frontend ("contactado") o el estado guardado
+            expected_status = STATUS_MAPPING.get(request.expected_status.lower(), request.expected_status)
+            if expected_status not in STATUS_MAPPING.values():
+                raise HTTPException(status_code=400, detail=f"Estado esperado desconocido: {request.expected_status}")
+            conditions.append(ProspectoLegacy.estado == expected_status)
+
+        # Filas objetivo bloqueadas y con su estado previo; el UPDATE las modifica en un solo paso.
+        # El límite + 1 detecta filtros que exceden el máximo permitido.
+        table = ProspectoLegacy.__table__
+        target = select(table.c.prospecto_id, table.c.estado.label("estado_anterior")).where(
+            *conditions
+        ).limit(settings.PROSPECT_BATCH_MAX_ROWS + 1).with_for_update().cte("objetivo")
+        updated = db.execute(
+            update(table)
+            .where(table.c.prospecto_id == target.c.prospecto_id)
+            .values(**changes)
+            .returning(table.c.prospecto_id, target.c.estado_anterior, table.c.estado)
+        ).all()
+        if len(updated) > settings.PROSPECT_BATCH_MAX_ROWS:
+            db.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail=f"El filtro abarca más de {settings.PROSPECT_BATCH_MAX_ROWS} prospectos"
+            )
+
+        for row in updated:
+            results[str(row.prospecto_id)] = {
+                "id": str(row.prospecto_id),
+                "result": "updated",
+                "previous_status": row.estado_anterior,
+                "status": row.estado
+            }
+
+        # Ids que no se actualizaron: inexistentes o en otro estado
+        if request.ids is not None:
+            missing = [prospect_id for prospect_id in valid_ids if str(prospect_id) not in results]
+            current = dict(db.query(ProspectoLegacy.prospecto_id, ProspectoLegacy.estado).filter(
+                ProspectoLegacy.prospecto_id.in_(missing)
+            ).all()) if missing else {}
+            for prospect_id in missing:
+                if prospect_id in current:
+                    results[str(prospect_id)] = {
+                        "id": str(prospect_id), "result": "skipped", "status": current[prospect_id]
+                    }
+                else:
+                    results[str(prospect_id)] = {"id": str(prospect_id), "result": "not_found"}
+
+        if request.dry_run:
+            db.rollback()
+        else:
+            db.commit()
+            if updated:
+                report_cache.bump_data_version()
+
+        # En modo ids, los resultados siguen el orden de la solicitud
+        if request.ids is not None:
+            keys = []
+            for prospect_id in request.ids:
+                try:
+                    keys.append(str(uuid.UUID(prospect_id)))
+                except ValueError:
+                    keys.append(prospect_id)
+            results = {key: results[key] for key in dict.fromkeys(keys)}
+
+        summary = {}
+        for result in results.values():
+            summary[result["result"]] = summary.get(result["result"], 0) + 1
+        return {
+            "message": "Simulación de actualización en lote" if request.dry_run else "Actualización en lote aplicada",
+            "dry_run": request.dry_run,
+            "summary": summary,
+            "results": list(results.values())
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise http_error(e, "Error en la actualización en lote")
 
 @router.put("/prospects/{prospect_id}")
-async def update_prospect(prospect_id: str, prospect_data: ProspectUpdate, db: Session = Depends(get_db)):
+def update_prospect(prospect_id: str, prospect_data: ProspectUpdate, db: Session = Depends(get_db)):
     """Actualizar un prospecto existente"""
     try:
         # Buscar el prospecto
@@ -193,6 +329,7 @@ async def update_prospect(prospect_id: str, prospect_data: ProspectUpdate, db: S
         
         db.commit()
         db.refresh(prospect)
+        report_cache.bump_data_version()
         
         return {
             "message": "Prospecto actualizado exitosamente",
@@ -203,10 +340,10 @@ async def update_prospect(prospect_id: str, prospect_data: ProspectUpdate, db: S
         raise
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error al actualizar prospecto: {str(e)}")
+        raise http_error(e, "Error al actualizar prospecto")
 
 @router.delete("/prospects/{prospect_id}")
-async def delete_prospect(prospect_id: str, db: Session = Depends(get_db)):
+def delete_prospect(prospect_id: str, db: Session = Depends(get_db)):
     """Eliminar un prospecto"""
     try:
         # Buscar el prospecto
@@ -220,6 +357,7 @@ async def delete_prospect(prospect_id: str, db: Session = Depends(get_db)):
         # Eliminar el prospecto
         db.delete(prospect)
         db.commit()
+        report_cache.bump_data_version()
         
         return {"message": "Prospecto eliminado exitosamente"}
         
@@ -227,10 +365,10 @@ async def delete_prospect(prospect_id: str, db: Session = Depends(get_db)):
         raise
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error al eliminar prospecto: {str(e)}")
+        raise http_error(e, "Error al eliminar prospecto")
 
 @router.get("/prospects/{prospect_id}/interactions")
-async def get_prospect_interactions(prospect_id: str, db: Session = Depends(get_db)):
+def get_prospect_interactions(prospect_id: str, db: Session = Depends(get_db)):
     """Obtener interacciones de un prospecto específico"""
     try:
         # Verificar que el prospecto existe
@@ -267,10 +405,10 @@ async def get_prospect_interactions(prospect_id: str, db: Session = Depends(get_
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener interacciones: {str(e)}")
+        raise http_error(e, "Error al obtener interacciones")
 
 @router.get("/prospects/{prospect_id}/tests")
-async def get_prospect_tests(prospect_id: str, db: Session = Depends(get_db)):
+def get_prospect_tests(prospect_id: str, db: Session = Depends(get_db)):
     """Obtener tests de un prospecto específico"""
     try:
         # Verificar que el prospecto existe
@@ -305,10 +443,10 @@ async def get_prospect_tests(prospect_id: str, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener tests: {str(e)}")
+        raise http_error(e, "Error al obtener tests")
 
 @router.get("/prospects/{prospect_id}/advisories")
-async def get_prospect_advisories(prospect_id: str, db: Session = Depends(get_db)):
+def get_prospect_advisories(prospect_id: str, db: Session = Depends(get_db)):
     """Obtener asesorías de un prospecto específico"""
     try:
         # Verificar que el prospecto existe
@@ -345,4 +483,4 @@ async def get_prospect_advisories(prospect_id: str, db: Session = Depends(get_db
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener asesorías: {str(e)}") 
\ No newline at end of file
+        raise http_error(e, "Error al obtener asesorías") 
\ No newline at end of file
@@ -1,47 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func, case, extract
-from typing import Optional, Dict, Any, List
-from models.database import get_db
+from typing import Optional, Dict, Any, List, IO
+from config import settings
+from models.database import get_reports_db, ReadSessionLocal
+from routers.errors import http_error
 from models.prospect_legacy import ProspectoLegacy, InteraccionLegacy, TestResultadoLegacy, AsesoriaLegacy
+from services.report_export import write_csv, write_xlsx
+from services.report_jobs import report_jobs, DONE
+from services.report_cache import report_cache, normalize_filters
+from services.admission import admission
+from services.single_flight import single_flight
+from services.tracing import tracer
+from services.conversion_time import average_conversion_days
+from services.archive import read_archived_rows
+from services.centers import center_filter, parse_centro_id, prospects_in_center, interactions_in_center
+from services.columnar_export import write_columnar, MEDIA_TYPES as COLUMNAR_MEDIA_TYPES, EXTENSIONS as COLUMNAR_EXTENSIONS
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 from datetime import datetime, timedelta
-from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, FileResponse, Response
 import io
+import itertools
 import json
+import os
+import tempfile
 
 router = APIRouter()
 
-@router.get("/reports/prospects")
-async def generate_prospects_report(
+# Columnas de las exportaciones por fila: (nombre, columna, tipo en parquet/arrow)
+PROSPECT_COLUMNS = [
+    ('id', ProspectoLegacy.prospecto_id, 'string'),
+    ('tipo_documento', ProspectoLegacy.tipo_documento, 'dictionary'),
+    ('dni', ProspectoLegacy.dni, 'string'),
+    ('nombre', ProspectoLegacy.nombre, 'string'),
+    ('correo', ProspectoLegacy.correo, 'string'),
+    ('celular', ProspectoLegacy.celular, 'string'),
+    ('ciudad', ProspectoLegacy.ciudad, 'dictionary'),
+    ('fecha_registro', ProspectoLegacy.fecha_registro, 'timestamp'),
+    ('origen', ProspectoLegacy.origen, 'dictionary'),
+    ('estado', ProspectoLegacy.estado, 'dictionary'),
+    ('consentimiento_datos', ProspectoLegacy.consentimiento_datos, 'bool')
+]
+
+INTERACTION_COLUMNS = [
+    ('prospecto_id', InteraccionLegacy.prospecto_id, 'string'),
+    ('modulo', InteraccionLegacy.modulo, 'dictionary'),
+    ('accion', InteraccionLegacy.accion, 'dictionary'),
+    ('dispositivo_id', InteraccionLegacy.dispositivo_id, 'dictionary'),
+    ('estado', InteraccionLegacy.estado_interaccion, 'dictionary'),
+    ('timestamp', InteraccionLegacy.timestamp, 'timestamp')
+]
+
+def filter_prospects(query, start_date=None, end_date=None, city=None, channel=None, status=None, centro_id=None):
+    """Aplicar los filtros del reporte de prospectos"""
+    if start_date:
+        query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
+    if end_date:
+        query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
+    if city:
+        query = query.filter(ProspectoLegacy.ciudad == city)
+    if channel:
+        query = query.filter(ProspectoLegacy.origen == channel)
+    if status:
+        query = query.filter(ProspectoLegacy.estado == status)
+    if centro_id:
+        query = query.filter(prospects_in_center(centro_id))
+    return query
+
+def build_prospects_report(
+    db: Session,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     city: Optional[str] = None,
     channel: Optional[str] = None,
     status: Optional[str] = None,
-    format: str = Query('json', regex='^(json|csv|excel)$'),
-    db: Session = Depends(get_db)
-):
-    """Generar reporte de prospectos"""
-    try:
-        # Construcción de la consulta base
-        query = db.query(ProspectoLegacy)
-        
-        # Aplicar filtros
-        if start_date:
-            query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
-        if end_date:
-            query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
-        if city:
-            query = query.filter(ProspectoLegacy.ciudad == city)
-        if channel:
-            query = query.filter(ProspectoLegacy.origen == channel)
-        if status:
-            query = query.filter(ProspectoLegacy.estado == status)
-        
-        prospects = query.all()
-        
-        # Preparar datos
-        data = []
+    centro_id: Optional[str] = None
+) -> Dict:
+    """Construir el reporte de prospectos"""
+    # Construcción de la consulta base
+    query = filter_prospects(db.query(ProspectoLegacy), start_date, end_date, city, channel, status, centro_id)
+    
+    prospects = query.all()
+    
+    # Preparar datos
+    data = []
+    with tracer.span("serialize.rows", report_type='prospects', rows=len(prospects)):
         for prospect in prospects:
             data.append({
                 'id': str(prospect.prospecto_id),
@@ -56,370 +101,483 @@ async def generate_prospects_report(
                 'estado': prospect.estado,
                 'consentimiento_datos': prospect.consentimiento_datos
             })
+    
+    return {
+        'report_type': 'prospects',
+        'generated_at': datetime.now().isoformat(),
+        'filters': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'city': city,
+            'channel': channel,
+            'status': status,
+            'centro_id': centro_id
+        },
+        'total_records': len(data),
+        'data': data
+    }
+
+@router.get("/reports/prospects")
+def generate_prospects_report(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    channel: Optional[str] = None,
+    status: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
+    format: str = Query('json', regex='^(json|csv|excel|parquet|arrow)$'),
+    db: Session = Depends(get_reports_db)
+):
+    """Generar reporte de prospectos"""
+    try:
+        if format in ('parquet', 'arrow'):
+            query = db.query(*[column for _, column, _ in PROSPECT_COLUMNS])
+            query = filter_prospects(query, start_date, end_date, city, channel, status, centro_id)
+            return generate_columnar_response(query, PROSPECT_COLUMNS, format, 'prospectos')
+        
+        report = build_prospects_report(db, start_date, end_date, city, channel, status, centro_id)
         
         if format == 'csv':
-            return generate_csv_response(data, 'prospectos')
+            return generate_csv_response(report['data'], 'prospectos')
         elif format == 'excel':
-            return generate_excel_response(data, 'prospectos')
+            return generate_excel_response(REPORTS['prospects']['sheets'](report), 'prospectos')
         else:
-            return {
-                'report_type': 'prospects',
-                'generated_at': datetime.now().isoformat(),
-                'filters': {
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'city': city,
-                    'channel': channel,
-                    'status': status
-                },
-                'total_records': len(data),
-                'data': data
-            }
-            
+            return report
+    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando reporte de prospectos: {str(e)}")
+        raise http_error(e, "Error generando reporte de prospectos")
+
+def build_conversions_report(
+    db: Session,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    centro_id: Optional[str] = None
+) -> Dict:
+    """Construir el reporte de conversiones"""
+    # Análisis del embudo de conversión
+    query = db.query(
+        ProspectoLegacy.estado,
+        func.count(ProspectoLegacy.prospecto_id).label('count'),
+        func.extract('month', ProspectoLegacy.fecha_registro).label('month'),
+        func.extract('year', ProspectoLegacy.fecha_registro).label('year')
+    )
+    
+    if start_date:
+        query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
+    if end_date:
+        query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
+    if centro_id:
+        query = query.filter(prospects_in_center(centro_id))
+    
+    results = query.group_by(
+        ProspectoLegacy.estado,
+        func.extract('month', ProspectoLegacy.fecha_registro),
+        func.extract('year', ProspectoLegacy.fecha_registro)
+    ).all()
+    
+    # Organizar datos
+    data = []
+    for result in results:
+        data.append({
+            'periodo': f"{int(result.year)}-{int(result.month):02d}",
+            'estado': result.estado,
+            'cantidad': result.count
+        })
+    
+    # Calcular tasas de conversión por canal
+    channel_conversion = db.query(
+        ProspectoLegacy.origen,
+        func.count(ProspectoLegacy.prospecto_id).label('total'),
+        func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados')
+    ).filter(
+        *([prospects_in_center(centro_id)] if centro_id else [])
+    ).group_by(ProspectoLegacy.origen).all()
+    
+    channel_data = []
+    for channel in channel_conversion:
+        total = channel.total
+        matriculados = channel.matriculados
+        conversion_rate = (matriculados / total * 100) if total > 0 else 0
+        
+        channel_data.append({
+            'canal': channel.origen or 'Directo',
+            'total_leads': total,
+            'matriculados': matriculados,
+            'tasa_conversion': round(conversion_rate, 2)
+        })
+    
+    return {
+        'report_type': 'conversions',
+        'generated_at': datetime.now().isoformat(),
+        'filters': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        },
+        'data': {
+            'funnel_data': data,
+            'channel_conversion': channel_data
+        }
+    }
 
 @router.get("/reports/conversions")
-async def generate_conversions_report(
+def generate_conversions_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
     format: str = Query('json', regex='^(json|csv|excel)$'),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_reports_db)
 ):
     """Generar reporte de conversiones"""
     try:
-        # Análisis del embudo de conversión
-        query = db.query(
-            ProspectoLegacy.estado,
-            func.count(ProspectoLegacy.prospecto_id).label('count'),
-            func.extract('month', ProspectoLegacy.fecha_registro).label('month'),
-            func.extract('year', ProspectoLegacy.fecha_registro).label('year')
-        )
-        
-        if start_date:
-            query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
-        if end_date:
-            query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
-        
-        results = query.group_by(
-            ProspectoLegacy.estado,
-            func.extract('month', ProspectoLegacy.fecha_registro),
-            func.extract('year', ProspectoLegacy.fecha_registro)
-        ).all()
-        
-        # Organizar datos
-        data = []
-        for result in results:
-            data.append({
-                'periodo': f"{int(result.year)}-{int(result.month):02d}",
-                'estado': result.estado,
-                'cantidad': result.count
-            })
-        
-        # Calcular tasas de conversión por canal
-        channel_conversion = db.query(
-            ProspectoLegacy.origen,
-            func.count(ProspectoLegacy.prospecto_id).label('total'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados')
-        ).group_by(ProspectoLegacy.origen).all()
-        
-        channel_data = []
-        for channel in channel_conversion:
-            total = channel.total
-            matriculados = channel.matriculados
-            conversion_rate = (matriculados / total * 100) if total > 0 else 0
-            
-            channel_data.append({
-                'canal': channel.origen or 'Directo',
-                'total_leads': total,
-                'matriculados': matriculados,
-                'tasa_conversion': round(conversion_rate, 2)
-            })
+        return serve_report(db, 'conversions', format, {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        })
+    
+    except Exception as e:
+        raise http_error(e, "Error generando reporte de conversiones")
+
+def build_channels_report(
+    db: Session,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    centro_id: Optional[str] = None
+) -> Dict:
+    """Construir el reporte de efectividad de canales"""
+    query = db.query(
+        ProspectoLegacy.origen,
+        func.count(ProspectoLegacy.prospecto_id).label('total'),
+        func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados'),
+        func.sum(case((ProspectoLegacy.estado == 'Contactado', 1), else_=0)).label('contactados'),
+        func.avg(func.extract('epoch', ProspectoLegacy.fecha_registro)).label('avg_time')
+    )
+    
+    if start_date:
+        query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
+    if end_date:
+        query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
+    if centro_id:
+        query = query.filter(prospects_in_center(centro_id))
+    
+    results = query.group_by(ProspectoLegacy.origen).all()
+    
+    data = []
+    for result in results:
+        total = result.total
+        matriculados = result.matriculados
+        contactados = result.contactados
         
-        report_data = {
-            'funnel_data': data,
-            'channel_conversion': channel_data
-        }
+        conversion_rate = (matriculados / total * 100) if total > 0 else 0
+        contact_rate = (contactados / total * 100) if total > 0 else 0
+        quality_score = (conversion_rate + contact_rate) / 2
         
-        if format == 'csv':
-            return generate_csv_response(data + channel_data, 'conversiones')
-        elif format == 'excel':
-            return generate_excel_response(report_data, 'conversiones')
-        else:
-            return {
-                'report_type': 'conversions',
-                'generated_at': datetime.now().isoformat(),
-                'filters': {
-                    'start_date': start_date,
-                    'end_date': end_date
-                },
-                'data': report_data
-            }
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando reporte de conversiones: {str(e)}")
+        data.append({
+            'canal': result.origen or 'Directo',
+            'total_leads': total,
+            'contactados': contactados,
+            'matriculados': matriculados,
+            'tasa_contacto': round(contact_rate, 2),
+            'tasa_conversion': round(conversion_rate, 2),
+            'score_calidad': round(quality_score, 2)
+        })
+    
+    # Ordenar por tasa de conversión
+    data.sort(key=lambda x: x['tasa_conversion'], reverse=True)
+    
+    return {
+        'report_type': 'channels',
+        'generated_at': datetime.now().isoformat(),
+        'filters': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        },
+        'total_channels': len(data),
+        'data': data
+    }
 
 @router.get("/reports/channels")
-async def generate_channels_report(
+def generate_channels_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
     format: str = Query('json', regex='^(json|csv|excel)$'),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_reports_db)
 ):
     """Generar reporte de efectividad de canales"""
     try:
-        query = db.query(
-            ProspectoLegacy.origen,
-            func.count(ProspectoLegacy.prospecto_id).label('total'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados'),
-            func.sum(case((ProspectoLegacy.estado == 'Contactado', 1), else_=0)).label('contactados'),
-            func.avg(func.extract('epoch', ProspectoLegacy.fecha_registro)).label('avg_time')
-        )
-        
-        if start_date:
-            query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
-        if end_date:
-            query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
-        
-        results = query.group_by(ProspectoLegacy.origen).all()
-        
-        data = []
-        for result in results:
-            total = result.total
-            matriculados = result.matriculados
-            contactados = result.contactados
-            
-            conversion_rate = (matriculados / total * 100) if total > 0 else 0
-            contact_rate = (contactados / total * 100) if total > 0 else 0
-            quality_score = (conversion_rate + contact_rate) / 2
-            
-            data.append({
-                'canal': result.origen or 'Directo',
-                'total_leads': total,
-                'contactados': contactados,
-                'matriculados': matriculados,
-                'tasa_contacto': round(contact_rate, 2),
-                'tasa_conversion': round(conversion_rate, 2),
-                'score_calidad': round(quality_score, 2)
-            })
+        return serve_report(db, 'channels', format, {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        })
+    
+    except Exception as e:
+        raise http_error(e, "Error generando reporte de canales")
+
+def build_geographic_report(
+    db: Session,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    centro_id: Optional[str] = None
+) -> Dict:
+    """Construir el reporte de distribución geográfica"""
+    query = db.query(
+        ProspectoLegacy.ciudad,
+        func.count(ProspectoLegacy.prospecto_id).label('total'),
+        func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados'),
+        func.sum(case((ProspectoLegacy.estado == 'Contactado', 1), else_=0)).label('contactados')
+    )
+    
+    if start_date:
+        query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
+    if end_date:
+        query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
+    if centro_id:
+        query = query.filter(prospects_in_center(centro_id))
+    
+    results = query.group_by(ProspectoLegacy.ciudad).all()
+    
+    data = []
+    for result in results:
+        total = result.total
+        matriculados = result.matriculados
+        contactados = result.contactados
         
-        # Ordenar por tasa de conversión
-        data.sort(key=lambda x: x['tasa_conversion'], reverse=True)
+        conversion_rate = (matriculados / total * 100) if total > 0 else 0
+        contact_rate = (contactados / total * 100) if total > 0 else 0
         
-        if format == 'csv':
-            return generate_csv_response(data, 'canales')
-        elif format == 'excel':
-            return generate_excel_response(data, 'canales')
-        else:
-            return {
-                'report_type': 'channels',
-                'generated_at': datetime.now().isoformat(),
-                'filters': {
-                    'start_date': start_date,
-                    'end_date': end_date
-                },
-                'total_channels': len(data),
-                'data': data
-            }
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando reporte de canales: {str(e)}")
+        data.append({
+            'ciudad': result.ciudad or 'No especificado',
+            'total_prospectos': total,
+            'contactados': contactados,
+            'matriculados': matriculados,
+            'tasa_contacto': round(contact_rate, 2),
+            'tasa_conversion': round(conversion_rate, 2)
+        })
+    
+    # Ordenar por total de prospectos
+    data.sort(key=lambda x: x['total_prospectos'], reverse=True)
+    
+    return {
+        'report_type': 'geographic',
+        'generated_at': datetime.now().isoformat(),
+        'filters': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        },
+        'total_cities': len(data),
+        'data': data
+    }
 
 @router.get("/reports/geographic")
-async def generate_geographic_report(
+def generate_geographic_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
     format: str = Query('json', regex='^(json|csv|excel)$'),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_reports_db)
 ):
     """Generar reporte de distribución geográfica"""
     try:
-        query = db.query(
-            ProspectoLegacy.ciudad,
-            func.count(ProspectoLegacy.prospecto_id).label('total'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados'),
-            func.sum(case((ProspectoLegacy.estado == 'Contactado', 1), else_=0)).label('contactados')
-        )
-        
-        if start_date:
-            query = query.filter(ProspectoLegacy.fecha_registro >= start_date)
-        if end_date:
-            query = query.filter(ProspectoLegacy.fecha_registro <= end_date)
-        
-        results = query.group_by(ProspectoLegacy.ciudad).all()
-        
-        data = []
-        for result in results:
-            total = result.total
-            matriculados = result.matriculados
-            contactados = result.contactados
-            
-            conversion_rate = (matriculados / total * 100) if total > 0 else 0
-            contact_rate = (contactados / total * 100) if total > 0 else 0
-            
-            data.append({
-                'ciudad': result.ciudad or 'No especificado',
-                'total_prospectos': total,
-                'contactados': contactados,
-                'matriculados': matriculados,
-                'tasa_contacto': round(contact_rate, 2),
-                'tasa_conversion': round(conversion_rate, 2)
-            })
-        
-        # Ordenar por total de prospectos
-        data.sort(key=lambda x: x['total_prospectos'], reverse=True)
+        report = build_geographic_report(db, start_date, end_date, centro_id)
         
         if format == 'csv':
-            return generate_csv_response(data, 'geografico')
+            return generate_csv_response(report['data'], 'geografico')
         elif format == 'excel':
-            return generate_excel_response(data, 'geografico')
+            return generate_excel_response(REPORTS['geographic']['sheets'](report), 'geografico')
         else:
-            return {
-                'report_type': 'geographic',
-                'generated_at': datetime.now().isoformat(),
-                'filters': {
-                    'start_date': start_date,
-                    'end_date': end_date
-                },
-                'total_cities': len(data),
-                'data': data
-            }
-            
+            return report
+    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando reporte geográfico: {str(e)}")
+        raise http_error(e, "Error generando reporte geográfico")
+
+def filter_interactions(query, start_date=None, end_date=None, centro_id=None):
+    """Aplicar los filtros del reporte de interacciones"""
+    if start_date:
+        query = query.filter(InteraccionLegacy.timestamp >= start_date)
+    if end_date:
+        query = query.filter(InteraccionLegacy.timestamp <= end_date)
+    if centro_id:
+        query = query.filter(interactions_in_center(centro_id))
+    return query
+
+def archived_interactions(start_date=None, end_date=None, centro_id=None):
+    """Interacciones del archivo frío (parquet) en el rango, en el orden de INTERACTION_COLUMNS"""
+    columns = [column.key for _, column, _ in INTERACTION_COLUMNS]
+    start = datetime.fromisoformat(start_date) if start_date else None
+    end = datetime.fromisoformat(end_date) if end_date else None
+    if not centro_id:
+        return read_archived_rows('interaccion', columns, start, end)
+    # Los archivos anteriores a centro_id no tienen la columna: esas filas no se atribuyen a ningún centro
+    rows = read_archived_rows('interaccion', columns + ['centro_id'], start, end)
+    return (row[:-1] for row in rows if row[-1] is not None and str(row[-1]) == centro_id)
+
+def build_interactions_report(
+    db: Session,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    centro_id: Optional[str] = None
+) -> Dict:
+    """Construir el reporte de interacciones"""
+    # Interacciones por prospecto
+    query = db.query(*[column for _, column, _ in INTERACTION_COLUMNS])
+    query = filter_interactions(query, start_date, end_date, centro_id)
+    
+    # Los rangos ya archivados se leen de los parquet, antes que las filas de la base
+    archived = list(archived_interactions(start_date, end_date, centro_id))
+    interactions = itertools.chain(archived, query.all())
+    
+    data = []
+    with tracer.span("serialize.rows", report_type='interactions') as span:
+        for prospecto_id, modulo, accion, dispositivo_id, estado, timestamp in interactions:
+            data.append({
+                'prospecto_id': str(prospecto_id),
+                'modulo': modulo,
+                'accion': accion,
+                'dispositivo_id': dispositivo_id,
+                'estado': estado,
+                'timestamp': timestamp.isoformat() if timestamp else None
+            })
+        if span:
+            span.set_attribute('rows', len(data))
+    
+    return {
+        'report_type': 'interactions',
+        'generated_at': datetime.now().isoformat(),
+        'filters': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        },
+        'total_interactions': len(data),
+        'archived_interactions': len(archived),
+        'data': data
+    }
 
 @router.get("/reports/interactions")
-async def generate_interactions_report(
+def generate_interactions_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    format: str = Query('json', regex='^(json|csv|excel)$'),
-    db: Session = Depends(get_db)
+    centro_id: Optional[str] = Depends(center_filter),
+    format: str = Query('json', regex='^(json|csv|excel|parquet|arrow)$'),
+    db: Session = Depends(get_reports_db)
 ):
     """Generar reporte de interacciones"""
     try:
-        # Interacciones por prospecto
-        query = db.query(
-            InteraccionLegacy.prospecto_id,
-            InteraccionLegacy.modulo,
-            InteraccionLegacy.accion,
-            InteraccionLegacy.dispositivo_id,
-            InteraccionLegacy.estado_interaccion,
-            InteraccionLegacy.timestamp
-        )
-        
-        if start_date:
-            query = query.filter(InteraccionLegacy.timestamp >= start_date)
-        if end_date:
-            query = query.filter(InteraccionLegacy.timestamp <= end_date)
+        if format in ('parquet', 'arrow'):
+            query = db.query(*[column for _, column, _ in INTERACTION_COLUMNS])
+            query = filter_interactions(query, start_date, end_date, centro_id)
+            return generate_columnar_response(
+                query, INTERACTION_COLUMNS, format, 'interacciones',
+                archived_rows=archived_interactions(start_date, end_date, centro_id)
+            )
         
-        interactions = query.all()
-        
-        data = []
-        for interaction in interactions:
-            data.append({
-                'prospecto_id': str(interaction.prospecto_id),
-                'modulo': interaction.modulo,
-                'accion': interaction.accion,
-                'dispositivo_id': interaction.dispositivo_id,
-                'estado': interaction.estado_interaccion,
-                'timestamp': interaction.timestamp.isoformat() if interaction.timestamp else None
-            })
+        report = build_interactions_report(db, start_date, end_date, centro_id)
         
         if format == 'csv':
-            return generate_csv_response(data, 'interacciones')
+            return generate_csv_response(report['data'], 'interacciones')
         elif format == 'excel':
-            return generate_excel_response(data, 'interacciones')
+            return generate_excel_response(REPORTS['interactions']['sheets'](report), 'interacciones')
         else:
-            return {
-                'report_type': 'interactions',
-                'generated_at': datetime.now().isoformat(),
-                'filters': {
-                    'start_date': start_date,
-                    'end_date': end_date
-                },
-                'total_interactions': len(data),
-                'data': data
-            }
-            
+            return report
+    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando reporte de interacciones: {str(e)}")
+        raise http_error(e, "Error generando reporte de interacciones")
+
+def build_executive_report(
+    db: Session,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    centro_id: Optional[str] = None
+) -> Dict:
+    """Construir el reporte ejecutivo"""
+    center = [prospects_in_center(centro_id)] if centro_id else []
+    
+    # KPIs principales
+    total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(*center).scalar()
+    total_enrolled = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
+        ProspectoLegacy.estado == 'Matriculado',
+        *center
+    ).scalar()
+    
+    conversion_rate = (total_enrolled / total_prospects * 100) if total_prospects > 0 else 0
+    
+    # Tiempo promedio de conversión según el historial de estados
+    avg_conversion_time = average_conversion_days(db, centro_id=centro_id) or 0
+    
+    # Top canales
+    top_channels = db.query(
+        ProspectoLegacy.origen,
+        func.count(ProspectoLegacy.prospecto_id).label('total'),
+        func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados')
+    ).filter(*center).group_by(ProspectoLegacy.origen).order_by(
+        func.count(ProspectoLegacy.prospecto_id).desc()
+    ).limit(5).all()
+    
+    # Top ciudades
+    top_cities = db.query(
+        ProspectoLegacy.ciudad,
+        func.count(ProspectoLegacy.prospecto_id).label('total')
+    ).filter(*center).group_by(ProspectoLegacy.ciudad).order_by(
+        func.count(ProspectoLegacy.prospecto_id).desc()
+    ).limit(5).all()
+    
+    executive_summary = {
+        'kpis': {
+            'total_prospects': total_prospects,
+            'total_enrolled': total_enrolled,
+            'conversion_rate': round(conversion_rate, 2),
+            'avg_conversion_time': avg_conversion_time
+        },
+        'top_channels': [
+            {
+                'canal': channel.origen or 'Directo',
+                'total': channel.total,
+                'matriculados': channel.matriculados,
+                'conversion_rate': round((channel.matriculados / channel.total * 100), 2) if channel.total > 0 else 0
+            } for channel in top_channels
+        ],
+        'top_cities': [
+            {
+                'ciudad': city.ciudad or 'No especificado',
+                'total': city.total
+            } for city in top_cities
+        ]
+    }
+    
+    return {
+        'report_type': 'executive',
+        'generated_at': datetime.now().isoformat(),
+        'filters': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        },
+        'data': executive_summary
+    }
 
 @router.get("/reports/executive")
-async def generate_executive_report(
+def generate_executive_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    centro_id: Optional[str] = Depends(center_filter),
     format: str = Query('json', regex='^(json|csv|excel)$'),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_reports_db)
 ):
     """Generar reporte ejecutivo"""
     try:
-        # KPIs principales
-        total_prospects = db.query(func.count(ProspectoLegacy.prospecto_id)).scalar()
-        total_enrolled = db.query(func.count(ProspectoLegacy.prospecto_id)).filter(
-            ProspectoLegacy.estado == 'Matriculado'
-        ).scalar()
-        
-        conversion_rate = (total_enrolled / total_prospects * 100) if total_prospects > 0 else 0
-        
-        # Top canales
-        top_channels = db.query(
-            ProspectoLegacy.origen,
-            func.count(ProspectoLegacy.prospecto_id).label('total'),
-            func.sum(case((ProspectoLegacy.estado == 'Matriculado', 1), else_=0)).label('matriculados')
-        ).group_by(ProspectoLegacy.origen).order_by(
-            func.count(ProspectoLegacy.prospecto_id).desc()
-        ).limit(5).all()
-        
-        # Top ciudades
-        top_cities = db.query(
-            ProspectoLegacy.ciudad,
-            func.count(ProspectoLegacy.prospecto_id).label('total')
-        ).group_by(ProspectoLegacy.ciudad).order_by(
-            func.count(ProspectoLegacy.prospecto_id).desc()
-        ).limit(5).all()
-        
-        executive_summary = {
-            'kpis': {
-                'total_prospects': total_prospects,
-                'total_enrolled': total_enrolled,
-                'conversion_rate': round(conversion_rate, 2),
-                'avg_conversion_time': 18.5  # Estimado
-            },
-            'top_channels': [
-                {
-                    'canal': channel.origen or 'Directo',
-                    'total': channel.total,
-                    'matriculados': channel.matriculados,
-                    'conversion_rate': round((channel.matriculados / channel.total * 100), 2) if channel.total > 0 else 0
-                } for channel in top_channels
-            ],
-            'top_cities': [
-                {
-                    'ciudad': city.ciudad or 'No especificado',
-                    'total': city.total
-                } for city in top_cities
-            ]
-        }
-        
-        if format == 'csv':
-            # Para CSV, aplanar la estructura
-            flat_data = [executive_summary['kpis']]
-            return generate_csv_response(flat_data, 'ejecutivo')
-        elif format == 'excel':
-            return generate_excel_response(executive_summary, 'ejecutivo')
-        else:
-            return {
-                'report_type': 'executive',
-                'generated_at': datetime.now().isoformat(),
-                'filters': {
-                    'start_date': start_date,
-                    'end_date': end_date
-                },
-                'data': executive_summary
-            }
-            
+        return serve_report(db, 'executive', format, {
+            'start_date': start_date,
+            'end_date': end_date,
+            'centro_id': centro_id
+        })
+    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando reporte ejecutivo: {str(e)}")
+        raise http_error(e, "Error generando reporte ejecutivo")
 
 def generate_csv_response(data: List[Dict], report_name: str):
     """Generar respuesta CSV"""
@@ -430,10 +588,7 @@ def generate_csv_response(data: List[Dict], report_name: str):
     output = io.StringIO()
     
     if isinstance(data[0], dict):
-        fieldnames = data[0].keys()
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data)
+        write_csv(data, output)
     else:
         writer = csv.writer(output)
         writer.writerows(data)
@@ -447,13 +602,230 @@ def generate_csv_response(data: List[Dict], report_name: str):
         headers={"Content-Disposition": f"attachment; filename={report_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
     )
 
-def generate_excel_response(data: Any, report_name: str):
-    """Generar respuesta Excel (simulado - requiere openpyxl)"""
-    # Para una implementación real, se usaría openpyxl o pandas
-    # Por ahora, devolvemos JSON con indicación de Excel
+def generate_columnar_response(query, columns: List, format: str, report_name: str, archived_rows=()):
+    """Generar respuesta Parquet o Arrow IPC leyendo la consulta con un cursor del servidor"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"El formato {format} requiere pyarrow instalado")
+    
+    extension = COLUMNAR_EXTENSIONS[format]
+    output = tempfile.NamedTemporaryFile(suffix=f".{extension}", delete=False)
+    try:
+        with output:
+            rows = itertools.chain(archived_rows, query.yield_per(settings.REPORT_COLUMNAR_BATCH_SIZE))
+            spec = [(name, kind) for name, _, kind in columns]
+            write_columnar(rows, spec, format, output, settings.REPORT_COLUMNAR_BATCH_SIZE)
+    except Exception:
+        os.remove(output.name)
+        raise
+    
+    return FileResponse(
+        output.name,
+        media_type=COLUMNAR_MEDIA_TYPES[format],
+        filename=f"{report_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+        background=BackgroundTask(os.remove, output.name)
+    )
+
+def generate_excel_response(sheets: Dict[str, List[Dict]], report_name: str):
+    """Generar respuesta Excel (XLSX con una hoja por sección)"""
+    output = io.BytesIO()
+    write_xlsx(sheets, output)
+    
+    return Response(
+        output.getvalue(),
+        media_type=MEDIA_TYPES['excel'],
+        headers={"Content-Disposition": f"attachment; filename={report_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"}
+    )
+
+# Reportes disponibles: builder, nombre de archivo, tablas que lee, filtros, filas CSV y hojas XLSX
+REPORTS = {
+    'prospects': {
+        'builder': build_prospects_report,
+        'name': 'prospectos',
+        'tables': ('prospecto', 'prospecto_centro'),
+        'filters': ('start_date', 'end_date', 'city', 'channel', 'status', 'centro_id'),
+        'csv': lambda r: r['data'],
+        'sheets': lambda r: {'prospectos': r['data']}
+    },
+    'conversions': {
+        'builder': build_conversions_report,
+        'name': 'conversiones',
+        'tables': ('prospecto', 'prospecto_centro'),
+        'filters': ('start_date', 'end_date', 'centro_id'),
+        'csv': lambda r: r['data']['funnel_data'] + r['data']['channel_conversion'],
+        'sheets': lambda r: {'embudo': r['data']['funnel_data'], 'canales': r['data']['channel_conversion']}
+    },
+    'channels': {
+        'builder': build_channels_report,
+        'name': 'canales',
+        'tables': ('prospecto', 'prospecto_centro'),
+        'filters': ('start_date', 'end_date', 'centro_id'),
+        'csv': lambda r: r['data'],
+        'sheets': lambda r: {'canales': r['data']}
+    },
+    'geographic': {
+        'builder': build_geographic_report,
+        'name': 'geografico',
+        'tables': ('prospecto', 'prospecto_centro'),
+        'filters': ('start_date', 'end_date', 'centro_id'),
+        'csv': lambda r: r['data'],
+        'sheets': lambda r: {'geografico': r['data']}
+    },
+    'interactions': {
+        'builder': build_interactions_report,
+        'name': 'interacciones',
+        'tables': ('interaccion',),
+        'filters': ('start_date', 'end_date', 'centro_id'),
+        'csv': lambda r: r['data'],
+        'sheets': lambda r: {'interacciones': r['data']}
+    },
+    'executive': {
+        'builder': build_executive_report,
+        'name': 'ejecutivo',
+        'tables': ('prospecto', 'prospecto_estado_historial', 'prospecto_centro'),
+        'filters': ('start_date', 'end_date', 'centro_id'),
+        'csv': lambda r: [r['data']['kpis']],
+        'sheets': lambda r: {
+            'kpis': [r['data']['kpis']],
+            'top_canales': r['data']['top_channels'],
+            'top_ciudades': r['data']['top_cities']
+        }
+    }
+}
+
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+EXTENSIONS = {'json': 'json', 'csv': 'csv', 'excel': 'xlsx'}
+
+def write_report(report_type: str, format: str, report: Dict, fileobj: IO[bytes]):
+    """Escribir un reporte ya construido en el formato pedido"""
+    definition = REPORTS[report_type]
+    if format == 'csv':
+        rows = definition['csv'](report)
+        if not rows:
+            raise HTTPException(status_code=404, detail="No hay datos para generar el reporte")
+        text_output = io.TextIOWrapper(fileobj, encoding='utf-8', newline='', write_through=True)
+        write_csv(rows, text_output)
+        text_output.detach()
+    elif format == 'excel':
+        write_xlsx(definition['sheets'](report), fileobj)
+    else:
+        fileobj.write(json.dumps(jsonable_encoder(report)).encode('utf-8'))
+
+def iter_file(fileobj: IO[bytes], chunk_size: int = 64 * 1024):
+    while chunk := fileobj.read(chunk_size):
+        yield chunk
+
+def serve_report(db: Session, report_type: str, format: str, filters: Dict):
+    """Responder un reporte desde la caché en disco, generándolo si no está"""
+    definition = REPORTS[report_type]
+    extension = EXTENSIONS[format]
+    key = report_cache.key(report_type, format, filters, definition['tables'])
+    headers = {}
+    if format != 'json':
+        headers['Content-Disposition'] = f"attachment; filename={definition['name']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+    # El archivo ya abierto se sirve aunque otra petición lo desaloje de la caché
+    cached = report_cache.get(key, extension) if key else None
+    if cached:
+        headers['Content-Length'] = str(os.fstat(cached.fileno()).st_size)
+        headers['X-Report-Cache'] = 'hit'
+        return StreamingResponse(
+            iter_file(cached),
+            media_type=MEDIA_TYPES[format],
+            headers=headers,
+            background=BackgroundTask(cached.close)
+        )
+
+    def build():
+        with tracer.span("report.build", report_type=report_type):
+            report = definition['builder'](db, **filters)
+        output = io.BytesIO()
+        with tracer.span("report.encode", report_type=report_type, format=format):
+            write_report(report_type, format, report, output)
+        if key:
+            report_cache.put(key, extension, output.getvalue())
+        return output.getvalue()
+
+    # Fallos simultáneos del mismo reporte se generan una sola vez
+    flight_key = ('report', report_type, format, key or tuple(normalize_filters(filters).items()))
+    content = single_flight.do(flight_key, build, lambda: bool(db.info.get("cancelled")))
+    headers['X-Report-Cache'] = 'miss' if key else 'bypass'
+    return Response(content, media_type=MEDIA_TYPES[format], headers=headers)
+
+class ReportJobCreate(BaseModel):
+    report_type: str = Field(pattern='^(prospects|conversions|channels|geographic|interactions|executive)$')
+    format: str = Field('csv', pattern='^(csv|excel)$')
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    city: Optional[str] = None
+    channel: Optional[str] = None
+    status: Optional[str] = None
+    centro_id: Optional[str] = None
+
+def _render_report(report_type: str, format: str, filters: Dict):
+    """Función que el worker ejecuta para escribir el reporte en `path`"""
+    definition = REPORTS[report_type]
+
+    def render(path: str):
+        db = ReadSessionLocal()
+        db.info["statement_timeout_ms"] = settings.REPORT_JOB_STATEMENT_TIMEOUT_MS
+        db.info["endpoint_class"] = "report_jobs"
+        try:
+            report = definition['builder'](db, **filters)
+        finally:
+            db.close()
+
+        with open(path, 'wb') as f:
+            write_report(report_type, format, report, f)
+
+    return render
+
+@router.post("/reports/jobs", status_code=202)
+def create_report_job(job_data: ReportJobCreate, request: Request):
+    """Encolar la generación de un reporte en segundo plano"""
+    # No toma sesión (el trabajo abre la suya): el rate limit de reportes se aplica aquí
+    admission.check_rate(request, 'reports')
+    definition = REPORTS[job_data.report_type]
+    filters = {name: getattr(job_data, name) for name in definition['filters']}
+    try:
+        filters['centro_id'] = parse_centro_id(filters.get('centro_id'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="centro_id debe ser un UUID válido")
+
+    job, deduplicated = report_jobs.submit(
+        job_data.report_type,
+        job_data.format,
+        filters,
+        _render_report(job_data.report_type, job_data.format, filters)
+    )
+
     return {
-        'format': 'excel',
-        'message': 'Excel generation would be implemented here with openpyxl',
-        'data': data,
-        'filename': f"{report_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    } 
\ No newline at end of file
+        **job.to_dict(),
+        'deduplicated': deduplicated,
+        'status_url': f"{settings.API_V1_STR}/reports/jobs/{job.id}",
+        'download_url': f"{settings.API_V1_STR}/reports/jobs/{job.id}/download"
+    }
+
+@router.get("/reports/jobs/{job_id}")
+def get_report_job(job_id: str):
+    """Consultar el estado de un reporte en segundo plano"""
+    job = report_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de reporte no encontrado")
+    return job.to_dict()
+
+@router.get("/reports/jobs/{job_id}/download")
+def download_report_job(job_id: str):
+    """Descargar el archivo generado por un reporte en segundo plano"""
+    job = report_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de reporte no encontrado")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"El reporte aún no está disponible (estado: {job.status})")
+    return FileResponse(job.path, media_type=MEDIA_TYPES[job.format], filename=job.filename)
@@ -0,0 +1,207 @@
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import HTTPException, Request
+from config import settings
+
+# Clientes sin solicitudes en este tiempo se eliminan del limitador
+IDLE_CLIENT_SECONDS = 600
+MAX_TRACKED_CLIENTS = 10000
+
+class Bulkhead:
+    """Límite de solicitudes concurrentes de una clase de endpoint, con cola de espera acotada"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.max_waiting = 0
+        self.wait_total_ms = 0.0
+        self.hold_total_s = 0.0
+        self.released = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def retry_after(self) -> int:
+        # Tiempo medio que se ocupa un cupo: estimación de cuándo se libera uno
+        average_hold = self.hold_total_s / self.released if self.released else 1
+        return max(1, math.ceil(average_hold))
+
+    def _reject(self, counter: str, detail: str):
+        setattr(self, counter, getattr(self, counter) + 1)
+        raise HTTPException(
+            status_code=429,
+            detail=f"{detail}, intente nuevamente",
+            headers={"Retry-After": str(self.retry_after())}
+        )
+
+    async def acquire(self):
+        # El semáforo se crea en el event loop que atiende las solicitudes
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        start = time.perf_counter()
+        if not self._semaphore.locked():
+            # Hay cupo: el acquire no suspende, así que nadie se adelanta
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.queue_size:
+                self._reject('rejected_queue_full', f"Capacidad de {self.name} agotada")
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject('rejected_timeout', f"Tiempo de espera agotado en la cola de {self.name}")
+            finally:
+                self.waiting -= 1
+            self.wait_total_ms += (time.perf_counter() - start) * 1000
+        self.admitted += 1
+        self.active += 1
+
+    def release(self, held_seconds: float):
+        self.active -= 1
+        self.released += 1
+        self.hold_total_s += held_seconds
+        self._semaphore.release()
+
+    def snapshot(self) -> Dict:
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'queue_depth': self.waiting,
+            'queue_size': self.queue_size,
+            'max_queue_depth': self.max_waiting,
+            'admitted': self.admitted,
+            'rejected': {
+                'queue_full': self.rejected_queue_full,
+                'timeout': self.rejected_timeout
+            },
+            'avg_wait_ms': round(self.wait_total_ms / self.admitted, 3) if self.admitted else 0,
+            'avg_hold_s': round(self.hold_total_s / self.released, 3) if self.released else 0
+        }
+
+class TokenBucketLimiter:
+    """Rate limit por cliente: `per_minute` solicitudes sostenidas con ráfagas de hasta `burst`"""
+
+    def __init__(self, name: str, per_minute: int, burst: int):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _prune(self, now: float):
+        idle = [client for client, (_, updated) in self._buckets.items() if now - updated > IDLE_CLIENT_SECONDS]
+        for client in idle:
+            del self._buckets[client]
+
+    def check(self, client: str):
+        """Consumir un token del cliente o rechazar con 429 y el tiempo hasta el próximo"""
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > MAX_TRACKED_CLIENTS:
+                self._prune(now)
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = [tokens, now]
+                self.rejected += 1
+                retry_after = math.ceil((1 - tokens) / self.rate)
+            else:
+                self._buckets[client] = [tokens - 1, now]
+                self.allowed += 1
+                return
+        raise HTTPException(
+            status_code=429,
+            detail=f"Demasiadas solicitudes de {self.name}, intente nuevamente",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def snapshot(self) -> Dict:
+        return {
+            'per_minute': round(self.rate * 60),
+            'burst': self.burst,
+            'tracked_clients': len(self._buckets),
+            'allowed': self.allowed,
+            'rejected': self.rejected
+        }
+
+def client_key(request: Request, trusted_hops: Optional[int] = None) -> str:
+    """IP del cliente: la que vio el proxy de confianza más externo o, sin proxies, la de la conexión.
+
+    Las entradas de la izquierda de X-Forwarded-For las controla el cliente; solo las
+    `trusted_hops` de la derecha las agregan nuestros proxies (Vercel, Render, Railway).
+    """
+    if trusted_hops is None:
+        trusted_hops = settings.TRUSTED_PROXY_HOPS
+    if trusted_hops > 0:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if hops:
+            return hops[-min(trusted_hops, len(hops))]
+    return request.client.host if request.client else "desconocido"
+
+class AdmissionController:
+    """Bulkheads y rate limits por clase de endpoint (crud, analytics, reports)"""
+
+    def __init__(self):
+        self.bulkheads = {
+            'crud': Bulkhead('crud', settings.ADMISSION_CRUD_CONCURRENCY,
+                             settings.ADMISSION_CRUD_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT),
+            'analytics': Bulkhead('analytics', settings.ADMISSION_ANALYTICS_CONCURRENCY,
+                                  settings.ADMISSION_ANALYTICS_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT),
+            'reports': Bulkhead('reports', settings.ADMISSION_REPORTS_CONCURRENCY,
+                                settings.ADMISSION_REPORTS_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT),
+        }
+        self.limiters = {
+            'analytics': TokenBucketLimiter('analytics', settings.RATE_LIMIT_ANALYTICS_PER_MINUTE,
+                                            settings.RATE_LIMIT_ANALYTICS_BURST),
+            'reports': TokenBucketLimiter('reports', settings.RATE_LIMIT_REPORTS_PER_MINUTE,
+                                          settings.RATE_LIMIT_REPORTS_BURST),
+        }
+
+    def check_rate(self, request: Request, endpoint_class: str):
+        """Consumir un token del rate limit del cliente en la clase (429 si no quedan)"""
+        limiter = self.limiters.get(endpoint_class)
+        if limiter and limiter.enabled:
+            limiter.check(client_key(request))
+
+    @asynccontextmanager
+    async def admit(self, request: Request, endpoint_class: str):
+        """Aplicar rate limit y esperar cupo antes de tomar una conexión del pool"""
+        self.check_rate(request, endpoint_class)
+        bulkhead = self.bulkheads.get(endpoint_class)
+        if not bulkhead or not bulkhead.enabled:
+            yield
+            return
+        await bulkhead.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            bulkhead.release(time.perf_counter() - start)
+
+    def status(self) -> Dict:
+        return {
+            'bulkheads': {name: bulkhead.snapshot() for name, bulkhead in self.bulkheads.items()},
+            'rate_limits': {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+        }
+
+admission = AdmissionController()
@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# numpy y pandas se importan dentro de los métodos: solo cargan si el snapshot está habilitado
+
+# Filas con los mismos atributos que devuelven las consultas de analytics
+StateCount = namedtuple('StateCount', ['estado', 'count'])
+CityStat = namedtuple('CityStat', ['ciudad', 'total', 'matriculados'])
+OriginStat = namedtuple('OriginStat', ['origen', 'total', 'matriculados', 'contactados'])
+PeriodStat = namedtuple('PeriodStat', ['period', 'registrations', 'enrollments'])
+DayCount = namedtuple('DayCount', ['fecha', 'total'])
+
+class EncodedColumn:
+    """Columna de texto codificada por diccionario: códigos enteros + etiquetas"""
+
+    def __init__(self, values: list):
+        import numpy as np
+        import pandas as pd
+
+        codes, labels = pd.factorize(np.array(values, dtype=object), use_na_sentinel=False)
+        dtype = np.int16 if len(labels) < np.iinfo(np.int16).max else np.int32
+        self.codes = codes.astype(dtype)
+        # factorize representa los NULL como NaN; se devuelven como None igual que la base
+        self.labels = [None if pd.isna(label) else label for label in labels]
+
+    def code_of(self, label) -> int:
+        try:
+            return self.labels.index(label)
+        except ValueError:
+            return -1
+
+    def counts(self, mask=None):
+        import numpy as np
+
+        codes = self.codes if mask is None else self.codes[mask]
+        return np.bincount(codes, minlength=len(self.labels))
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+def _datetimes(values: list):
+    import numpy as np
+
+    return np.array(values, dtype='datetime64[us]')
+
+def _parse_date(value: str):
+    import numpy as np
+
+    return np.datetime64(datetime.fromisoformat(value), 'us')
+
+class AnalyticsSnapshot:
+    """Copia columnar e inmutable de `prospecto` y de las interacciones recientes"""
+
+    def __init__(self, prospects: list, interactions: list, interactions_since: datetime,
+                 prospect_centers: list = ()):
+        import numpy as np
+
+        ids, ciudades, origenes, estados, fechas = zip(*prospects) if prospects else ((), (), (), (), ())
+        self.ciudad = EncodedColumn(list(ciudades))
+        self.origen = EncodedColumn(list(origenes))
+        self.estado = EncodedColumn(list(estados))
+        self.fecha_registro = _datetimes(list(fechas))
+
+        # Posiciones (en las columnas de prospectos) de los prospectos de cada centro
+        position = {prospecto_id: i for i, prospecto_id in enumerate(ids)}
+        by_center: Dict[str, list] = {}
+        for centro_id, prospecto_id in prospect_centers:
+            if prospecto_id in position:
+                by_center.setdefault(str(centro_id), []).append(position[prospecto_id])
+        self.centro_prospectos = {centro: np.array(rows, dtype=np.int32) for centro, rows in by_center.items()}
+
+        self.interaccion_timestamp = _datetimes([row[0] for row in interactions])
+        self.interaccion_centro = EncodedColumn([str(row[1]) if row[1] else None for row in interactions])
+        self.interactions_since = interactions_since
+
+        self.built_at = time.monotonic()
+        self.built_at_wall = datetime.utcnow()
+
+    @property
+    def age_seconds(self) -> float:
+        return round(time.monotonic() - self.built_at, 3)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.ciudad.nbytes + self.origen.nbytes + self.estado.nbytes + self.fecha_registro.nbytes
+                + sum(rows.nbytes for rows in self.centro_prospectos.values())
+                + self.interaccion_timestamp.nbytes + self.interaccion_centro.nbytes)
+
+    def _is_state(self, state: str):
+        return self.estado.codes == self.estado.code_of(state)
+
+    def _center_mask(self, centro_id: Optional[str]):
+        """Máscara de los prospectos del centro (None = todos)"""
+        if not centro_id:
+            return None
+        import numpy as np
+
+        mask = np.zeros(len(self.fecha_registro), dtype=bool)
+        rows = self.centro_prospectos.get(centro_id)
+        if rows is not None:
+            mask[rows] = True
+        return mask
+
+    @staticmethod
+    def _and(mask, other):
+        return other if mask is None else mask & other
+
+    def state_counts(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                     centro_id: Optional[str] = None) -> List[StateCount]:
+        mask = self._center_mask(centro_id)
+        if start_date and end_date:
+            mask = self._and(mask, (self.fecha_registro >= _parse_date(start_date)) & (self.fecha_registro <= _parse_date(end_date)))
+        counts = self.estado.counts(mask)
+        return [StateCount(label, int(count)) for label, count in zip(self.estado.labels, counts) if count]
+
+    def _grouped_totals(self, column: EncodedColumn, *states: str, mask=None) -> list:
+        import numpy as np
+
+        codes = column.codes if mask is None else column.codes[mask]
+        totals = np.bincount(codes, minlength=len(column.labels))
+        by_state = []
+        for state in states:
+            weights = self._is_state(state)
+            by_state.append(np.bincount(codes, weights=weights if mask is None else weights[mask],
+                                        minlength=len(column.labels)))
+        return [
+            (label, int(totals[i]), *[int(values[i]) for values in by_state])
+            for i, label in enumerate(column.labels) if totals[i]
+        ]
+
+    def city_stats(self, centro_id: Optional[str] = None) -> List[CityStat]:
+        mask = self._center_mask(centro_id)
+        return [CityStat(*row) for row in self._grouped_totals(self.ciudad, 'Matriculado', mask=mask)]
+
+    def origin_stats(self, centro_id: Optional[str] = None) -> List[OriginStat]:
+        mask = self._center_mask(centro_id)
+        return [OriginStat(*row) for row in self._grouped_totals(self.origen, 'Matriculado', 'Contactado', mask=mask)]
+
+    def period_stats(self, period: str, cutoff: datetime, centro_id: Optional[str] = None) -> List[PeriodStat]:
+        import numpy as np
+        import pandas as pd
+
+        mask = self._and(self._center_mask(centro_id), self.fecha_registro >= np.datetime64(cutoff, 'us'))
+        fechas = self.fecha_registro[mask]
+        if period == 'day':
+            keys = fechas.astype('datetime64[D]')
+        elif period == 'week':
+            # Semanas que empiezan en lunes, como date_trunc('week') en Postgres (1970-01-01 fue jueves)
+            days = fechas.astype('datetime64[D]')
+            keys = days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+        else:
+            keys = fechas.astype('datetime64[M]').astype('datetime64[D]')
+        periods, inverse = np.unique(keys, return_inverse=True)
+        registrations = np.bincount(inverse, minlength=len(periods))
+        enrollments = np.bincount(inverse, weights=self._is_state('Matriculado')[mask], minlength=len(periods))
+        # Igual que en SQL: date() devuelve fechas y date_trunc() timestamps
+        to_python = (lambda p: pd.Timestamp(p).date()) if period == 'day' else (lambda p: pd.Timestamp(p).to_pydatetime())
+        return [
+            PeriodStat(to_python(p), int(r), int(e))
+            for p, r, e in zip(periods, registrations, enrollments)
+        ]
+
+    def interactions_by_day(self, since: datetime, centro_id: Optional[str] = None) -> Optional[List[DayCount]]:
+        """Interacciones por día desde `since`, o None si el snapshot no cubre ese rango"""
+        if since < self.interactions_since:
+            return None
+        import numpy as np
+        import pandas as pd
+
+        mask = self.interaccion_timestamp >= np.datetime64(since, 'us')
+        if centro_id:
+            mask &= self.interaccion_centro.codes == self.interaccion_centro.code_of(centro_id)
+        days, counts = np.unique(self.interaccion_timestamp[mask].astype('datetime64[D]'), return_counts=True)
+        return [DayCount(pd.Timestamp(d).date(), int(c)) for d, c in zip(days, counts)]
+
+class AnalyticsSnapshotEngine:
+    """Mantiene el snapshot vigente y lo reconstruye periódicamente desde la réplica"""
+
+    def __init__(self):
+        self._snapshot: Optional[AnalyticsSnapshot] = None
+        self._refresh_lock = threading.Lock()
+        self.last_error: Optional[str] = None
+        self.last_build_seconds: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.ANALYTICS_SNAPSHOT_ENABLED
+
+    def current(self) -> Optional[AnalyticsSnapshot]:
+        """Snapshot utilizable (habilitado y no vencido) o None para consultar la base"""
+        snapshot = self._snapshot
+        if not self.enabled or snapshot is None:
+            return None
+        if snapshot.age_seconds > settings.ANALYTICS_SNAPSHOT_MAX_AGE:
+            return None
+        return snapshot
+
+    def refresh(self):
+        from sqlalchemy import text
+        from models.database import ReadSessionLocal
+
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        start = time.perf_counter()
+        try:
+            interactions_since = (datetime.now() - timedelta(days=settings.ANALYTICS_SNAPSHOT_INTERACTION_DAYS)).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            db = ReadSessionLocal()
+            db.info["statement_timeout_ms"] = settings.DB_STATEMENT_TIMEOUT_REPORTS_MS
+            try:
+                prospects = db.execute(text(
+                    "SELECT prospecto_id, ciudad, origen, estado, fecha_registro FROM prospecto"
+                )).all()
+                prospect_centers = db.execute(text(
+                    "SELECT centro_id, prospecto_id FROM prospecto_centro"
+                )).all()
+                interactions = db.execute(text(
+                    "SELECT timestamp, centro_id FROM interaccion WHERE timestamp >= :since"
+                ), {"since": interactions_since}).all()
+            finally:
+                db.close()
+            self._snapshot = AnalyticsSnapshot(prospects, interactions, interactions_since, prospect_centers)
+            self.last_error = None
+        except Exception as e:
+            logger.exception("Error reconstruyendo el snapshot de analytics")
+            self.last_error = str(e)
+        finally:
+            self.last_build_seconds = round(time.perf_counter() - start, 3)
+            self._refresh_lock.release()
+
+    def status(self):
+        snapshot = self._snapshot
+        return {
+            'enabled': self.enabled,
+            'age_seconds': snapshot.age_seconds if snapshot else None,
+            'built_at': snapshot.built_at_wall.isoformat() if snapshot else None,
+            'prospects': len(snapshot.fecha_registro) if snapshot else 0,
+            'recent_interactions': len(snapshot.interaccion_timestamp) if snapshot else 0,
+            'centers': len(snapshot.centro_prospectos) if snapshot else 0,
+            'memory_bytes': snapshot.nbytes if snapshot else 0,
+            'last_build_seconds': self.last_build_seconds,
+            'last_error': self.last_error
+        }
+
+analytics_snapshot = AnalyticsSnapshotEngine()
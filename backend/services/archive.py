@@ -0,0 +1,241 @@
+import logging
+import os
+import uuid
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from config import settings
+from services.columnar_export import write_columnar
+from services.partitions import add_months, is_partitioned, list_partitions, month_start
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "cold-archive"
+
+# Tablas que se archivan y su columna de tiempo
+ARCHIVE_SOURCES = {
+    'interaccion': 'timestamp',
+    'test_resultado': 'timestamp',
+}
+
+# Columnas de texto con pocos valores distintos: se codifican por diccionario en parquet
+DICTIONARY_COLUMNS = {'modulo', 'accion', 'dispositivo_id', 'estado_interaccion', 'clasificacion'}
+
+def _month_dir(table: str, month: date) -> str:
+    return os.path.join(settings.ARCHIVE_DIR, table, f"year={month.year}", f"month={month.month:02d}")
+
+def _columns(connection: Connection, table: str) -> List[Tuple[str, str]]:
+    """Columnas de la tabla con su tipo para parquet (las JSONB derivadas se omiten)"""
+    rows = connection.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :table
+        ORDER BY ordinal_position
+    """), {"table": table}).all()
+    columns = []
+    for name, data_type in rows:
+        if data_type == 'jsonb':
+            continue
+        if data_type.startswith('timestamp'):
+            kind = 'timestamp'
+        elif data_type == 'boolean':
+            kind = 'bool'
+        elif name in DICTIONARY_COLUMNS:
+            kind = 'dictionary'
+        else:
+            kind = 'string'
+        columns.append((name, kind))
+    return columns
+
+def _write_archive(table: str, month: date, label: str, rows, columns) -> Tuple[Optional[str], int]:
+    """Escribir las filas en un parquet del mes y verificar el conteo: (ruta, filas)"""
+    import pyarrow.parquet as pq
+
+    directory = _month_dir(table, month)
+    os.makedirs(directory, exist_ok=True)
+    # Nombres únicos por ejecución: nunca se pisa ni se borra el archivo de otra
+    run_id = uuid.uuid4().hex[:8]
+    tmp_path = os.path.join(directory, f".{label}.{run_id}.parquet.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            written = write_columnar(rows, columns, 'parquet', f, settings.ARCHIVE_BATCH_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+        if written == 0:
+            os.remove(tmp_path)
+            return None, 0
+        if pq.ParquetFile(tmp_path).metadata.num_rows != written:
+            raise RuntimeError(f"El archivo de {label} no contiene las {written} filas esperadas")
+        path = os.path.join(directory, f"{label}-{written}-{run_id}.parquet")
+        os.replace(tmp_path, path)
+        return path, written
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _mark_archiving(connection: Connection):
+    # Los triggers de agregados ignoran los borrados hechos por el archivado
+    connection.execute(text("SET LOCAL cexcie.archiving = 'on'"))
+
+def _discard_on_error(path: Optional[str]):
+    # Si la transacción no se confirma, las filas siguen en la base: el archivo (de esta ejecución) sobra
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def _archive_partition(engine, table: str, partition: str, month: date):
+    """Volcar una partición completa a parquet y luego desvincularla y eliminarla"""
+    path = None
+    try:
+        with engine.begin() as connection:
+            _mark_archiving(connection)
+            columns = _columns(connection, table)
+            names = ", ".join(f'"{name}"' for name, _ in columns)
+            expected = connection.execute(text(f"SELECT COUNT(*) FROM {partition}")).scalar()
+            rows = connection.execution_options(
+                stream_results=True, max_row_buffer=settings.ARCHIVE_BATCH_SIZE
+            ).execute(text(f"SELECT {names} FROM {partition}"))
+            path, written = _write_archive(table, month, partition, rows, columns)
+            if written != expected:
+                raise RuntimeError(f"{partition}: {expected} filas en la base, {written} archivadas")
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+            connection.execute(text(f"DROP TABLE {partition}"))
+    except Exception:
+        _discard_on_error(path)
+        raise
+    logger.info("Partición %s archivada (%s filas)", partition, expected)
+
+def _archive_month_rows(engine, table: str, source: str, column: str, month: date, cutoff: datetime):
+    """Mover a parquet las filas de un mes de `source` con DELETE ... RETURNING por lotes.
+
+    Todo ocurre en una transacción: si el archivo no se puede escribir o verificar,
+    el rollback conserva las filas en la base.
+    """
+    start = datetime.combine(month, datetime.min.time())
+    end = min(datetime.combine(add_months(month, 1), datetime.min.time()), cutoff)
+    path = None
+    try:
+        with engine.begin() as connection:
+            _mark_archiving(connection)
+            columns = _columns(connection, table)
+            names = ", ".join(f'"{name}"' for name, _ in columns)
+
+            def deleted_rows():
+                while True:
+                    batch = connection.execute(text(f"""
+                        DELETE FROM {source}
+                        WHERE ctid IN (
+                            SELECT ctid FROM {source}
+                            WHERE "{column}" >= :start AND "{column}" < :end
+                            LIMIT :batch_size
+                        )
+                        RETURNING {names}
+                    """), {"start": start, "end": end, "batch_size": settings.ARCHIVE_BATCH_SIZE}).all()
+                    if not batch:
+                        return
+                    yield from batch
+
+            label = f"{source}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+            path, _ = _write_archive(table, month, label, deleted_rows(), columns)
+    except Exception:
+        _discard_on_error(path)
+        raise
+    if path:
+        logger.info("Filas de %s (%s) archivadas en %s", source, month.isoformat(), path)
+
+def archive_table(engine, table: str, cutoff: datetime):
+    column = ARCHIVE_SOURCES[table]
+    with engine.connect() as connection:
+        partitioned = is_partitioned(connection, table)
+        partitions = list_partitions(connection, table) if partitioned else []
+    if partitioned:
+        for name, lower, upper in partitions:
+            if upper <= cutoff:
+                _archive_partition(engine, table, name, lower.date())
+        # La partición DEFAULT puede tener filas antiguas (p. ej. sin timestamp)
+        source = f"{table}_default"
+    else:
+        source = table
+    with engine.connect() as connection:
+        months = connection.execute(text(f"""
+            SELECT DISTINCT date_trunc('month', "{column}") FROM {source}
+            WHERE "{column}" < :cutoff ORDER BY 1
+        """), {"cutoff": cutoff}).scalars().all()
+    for month in months:
+        _archive_month_rows(engine, table, source, column, month.date(), cutoff)
+
+def archive_old_data():
+    """Tarea periódica: archivar en parquet los datos anteriores a ARCHIVE_AFTER_MONTHS.
+
+    Un advisory lock de sesión (el archivado usa varias transacciones) asegura que
+    una sola instancia archive a la vez.
+    """
+    from models.database import engine
+
+    cutoff = datetime.combine(add_months(month_start(datetime.utcnow().date()), -settings.ARCHIVE_AFTER_MONTHS), datetime.min.time())
+    # En autocommit: la conexión del lock no queda "idle in transaction" mientras se archiva
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+        locked = lock_connection.execute(
+            text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": LOCK_NAME}
+        ).scalar()
+        if not locked:
+            logger.info("Archivado en proceso en otra instancia; se omite")
+            return
+        try:
+            for table in ARCHIVE_SOURCES:
+                try:
+                    archive_table(engine, table, cutoff)
+                except Exception:
+                    logger.exception("Error archivando %s", table)
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": LOCK_NAME})
+
+def archived_months(table: str) -> List[date]:
+    """Meses con archivos en el archivo frío, en orden"""
+    base = os.path.join(settings.ARCHIVE_DIR, table)
+    months = []
+    if not os.path.isdir(base):
+        return months
+    for year_dir in os.listdir(base):
+        if not year_dir.startswith('year='):
+            continue
+        for month_dir in os.listdir(os.path.join(base, year_dir)):
+            if month_dir.startswith('month='):
+                months.append(date(int(year_dir[5:]), int(month_dir[6:]), 1))
+    return sorted(months)
+
+def read_archived_rows(table: str, columns: List[str], start: Optional[datetime] = None,
+                       end: Optional[datetime] = None) -> Iterator[tuple]:
+    """Filas archivadas de `table` con timestamp en [start, end], como tuplas de `columns`.
+
+    Solo se abren los meses que intersectan el rango y, dentro de cada archivo,
+    pyarrow filtra por row group usando las estadísticas de la columna de tiempo.
+    """
+    months = [
+        month for month in archived_months(table)
+        if (start is None or datetime.combine(add_months(month, 1), datetime.min.time()) > start)
+        and (end is None or datetime.combine(month, datetime.min.time()) <= end)
+    ]
+    if not months:
+        return
+    import pyarrow.parquet as pq
+
+    column = ARCHIVE_SOURCES[table]
+    filters = []
+    if start is not None:
+        filters.append((column, '>=', start))
+    if end is not None:
+        filters.append((column, '<=', end))
+    for month in months:
+        directory = _month_dir(table, month)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.parquet'):
+                continue
+            path = os.path.join(directory, name)
+            available = set(pq.ParquetFile(path).schema_arrow.names)
+            data = pq.read_table(path, columns=[c for c in columns if c in available], filters=filters or None)
+            values = [
+                data.column(c).to_pylist() if c in available else [None] * data.num_rows
+                for c in columns
+            ]
+            yield from zip(*values)
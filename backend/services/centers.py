@@ -0,0 +1,34 @@
+import uuid
+from typing import Optional
+from fastapi import HTTPException, Query
+from sqlalchemy import select
+from models.prospect_legacy import ProspectoLegacy, InteraccionLegacy, ProspectoCentroLegacy
+
+# Filtros por centro en SQL textual (parámetro :centro_id)
+PROSPECTS_IN_CENTER_SQL = "prospecto_id IN (SELECT prospecto_id FROM prospecto_centro WHERE centro_id = CAST(:centro_id AS UUID))"
+INTERACTIONS_IN_CENTER_SQL = "centro_id = CAST(:centro_id AS UUID)"
+
+def parse_centro_id(value: Optional[str]) -> Optional[str]:
+    """UUID normalizado del centro o None; ValueError si no es un UUID válido"""
+    if not value:
+        return None
+    return str(uuid.UUID(value))
+
+def prospects_in_center(centro_id: str, column=ProspectoLegacy.prospecto_id):
+    """Condición: el prospecto tuvo interacciones en el centro (semi-join sobre prospecto_centro)"""
+    return column.in_(
+        select(ProspectoCentroLegacy.prospecto_id).where(ProspectoCentroLegacy.centro_id == uuid.UUID(centro_id))
+    )
+
+def interactions_in_center(centro_id: str):
+    """Condición: la interacción ocurrió en el centro (columna desnormalizada, índice por centro y fecha)"""
+    return InteraccionLegacy.centro_id == uuid.UUID(centro_id)
+
+def center_filter(
+    centro_id: Optional[str] = Query(None, description="Limitar a un centro de experiencia (UUID)")
+) -> Optional[str]:
+    """Dependencia: parámetro centro_id validado (400 si no es un UUID)"""
+    try:
+        return parse_centro_id(centro_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="centro_id debe ser un UUID válido")
@@ -0,0 +1,69 @@
+import itertools
+from typing import IO, Iterable, List, Tuple
+
+# Tipos de columna soportados: "string", "dictionary" (string codificado por diccionario),
+# "timestamp" y "bool". pyarrow se importa solo al exportar.
+ColumnSpec = Tuple[str, str]
+
+MEDIA_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+def _arrow_type(pa, kind: str):
+    if kind == 'dictionary':
+        return pa.dictionary(pa.int32(), pa.string())
+    if kind == 'timestamp':
+        return pa.timestamp('us')
+    if kind == 'bool':
+        return pa.bool_()
+    return pa.string()
+
+def _column_values(values, kind: str):
+    if kind in ('string', 'dictionary'):
+        return [None if v is None else str(v) for v in values]
+    return list(values)
+
+def write_columnar(rows: Iterable[tuple], columns: List[ColumnSpec], format: str,
+                   fileobj: IO[bytes], batch_size: int) -> int:
+    """Escribir filas en Parquet o Arrow IPC por lotes de `batch_size`.
+
+    Cada lote se convierte en un RecordBatch (un row group en Parquet), así que
+    la memoria queda acotada al tamaño del lote aunque el cursor sea enorme.
+    Devuelve el número de filas escritas.
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([(name, _arrow_type(pa, kind)) for name, kind in columns])
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(
+            fileobj,
+            schema,
+            compression='zstd',
+            use_dictionary=[name for name, kind in columns if kind == 'dictionary']
+        )
+        write = writer.write_batch
+    else:
+        # El formato stream admite diccionarios distintos en cada lote
+        writer = pa.ipc.new_stream(fileobj, schema)
+        write = writer.write_batch
+
+    total = 0
+    iterator = iter(rows)
+    try:
+        while True:
+            chunk = list(itertools.islice(iterator, batch_size))
+            if not chunk:
+                break
+            arrays = [
+                pa.array(_column_values(values, kind), type=_arrow_type(pa, kind))
+                for (name, kind), values in zip(columns, zip(*chunk))
+            ]
+            write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            total += len(chunk)
+    finally:
+        writer.close()
+    return total
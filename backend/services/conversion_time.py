@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services.centers import PROSPECTS_IN_CENTER_SQL
+
+SECONDS_PER_DAY = 86400
+PERCENTILES = (0.5, 0.75, 0.9)
+
+# Transiciones a "Matriculado" con duración conocida (cubiertas por ix_historial_conversiones)
+CONVERSIONS_WHERE = """
+    estado_nuevo = 'Matriculado' AND segundos_desde_registro IS NOT NULL
+    AND (CAST(:start AS TIMESTAMP) IS NULL OR fecha_cambio >= CAST(:start AS TIMESTAMP))
+    AND (CAST(:end AS TIMESTAMP) IS NULL OR fecha_cambio < CAST(:end AS TIMESTAMP))
+"""
+
+def _conversions_where(centro_id: Optional[str]) -> str:
+    return CONVERSIONS_WHERE + (f" AND {PROSPECTS_IN_CENTER_SQL}" if centro_id else "")
+
+def _range(start_date: Optional[str], end_date: Optional[str]) -> Dict:
+    # end_date es inclusivo: se compara contra el inicio del día siguiente
+    start = datetime.fromisoformat(start_date) if start_date else None
+    end = datetime.fromisoformat(end_date) + timedelta(days=1) if end_date else None
+    return {"start": start, "end": end}
+
+def _days(seconds) -> Optional[float]:
+    return round(seconds / SECONDS_PER_DAY, 1) if seconds is not None else None
+
+def average_conversion_days(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                            centro_id: Optional[str] = None) -> Optional[float]:
+    """Días promedio desde el registro hasta la matrícula (conversiones entre start y end)"""
+    seconds = db.execute(
+        text(f"SELECT AVG(segundos_desde_registro) FROM prospecto_estado_historial WHERE {_conversions_where(centro_id)}"),
+        {"start": start, "end": end, "centro_id": centro_id}
+    ).scalar()
+    return _days(seconds)
+
+def conversion_time_stats(db: Session, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          centro_id: Optional[str] = None) -> Dict:
+    """Promedio y percentiles del tiempo de conversión, global, por canal y por ciudad"""
+    rows = db.execute(text(f"""
+        SELECT
+            GROUPING(origen) AS por_origen,
+            GROUPING(ciudad) AS por_ciudad,
+            origen,
+            ciudad,
+            COUNT(*) AS conversions,
+            AVG(segundos_desde_registro) AS avg_seconds,
+            percentile_cont(ARRAY[{', '.join(str(p) for p in PERCENTILES)}])
+                WITHIN GROUP (ORDER BY segundos_desde_registro) AS percentiles
+        FROM prospecto_estado_historial
+        WHERE {_conversions_where(centro_id)}
+        GROUP BY GROUPING SETS ((), (origen), (ciudad))
+    """), {**_range(start_date, end_date), "centro_id": centro_id}).all()
+
+    def stats(row):
+        return {
+            'conversions': row.conversions,
+            'avg_days': _days(row.avg_seconds),
+            **{f'p{int(p * 100)}_days': _days(value) for p, value in zip(PERCENTILES, row.percentiles)}
+        }
+
+    overall = {'conversions': 0, 'avg_days': None, **{f'p{int(p * 100)}_days': None for p in PERCENTILES}}
+    channels, cities = [], []
+    for row in rows:
+        # GROUPING() vale 1 en las columnas que no forman parte del grupo
+        if row.por_origen and row.por_ciudad:
+            overall = stats(row)
+        elif not row.por_origen:
+            channels.append({'channel': row.origen or 'Directo', **stats(row)})
+        else:
+            cities.append({'city': row.ciudad or 'No especificado', **stats(row)})
+
+    channels.sort(key=lambda x: x['conversions'], reverse=True)
+    cities.sort(key=lambda x: x['conversions'], reverse=True)
+    return {'overall': overall, 'channels': channels, 'cities': cities}
@@ -0,0 +1,337 @@
+import logging
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from itertools import combinations
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from config import settings
+from services.sessions import merge_prospect_sessions
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "prospecto-dedup"
+
+# Peso de cada coincidencia en el puntaje del par (se combinan como 1 - Π(1 - peso))
+WEIGHTS = {
+    'dni': 0.95,
+    'correo': 0.9,
+    'celular': 0.7,
+    'correo_local': 0.4,
+    'nombre': 0.6,
+}
+
+# Similitud mínima de nombres para que cuente como coincidencia
+NAME_SIMILARITY = 0.8
+
+# Tablas hijas cuyo prospecto_id se reasigna al fusionar
+CHILD_TABLES = ('interaccion', 'test_resultado', 'asesoria', 'prospecto_estado_historial')
+
+NAME_PARTICLES = {'de', 'del', 'la', 'las', 'los', 'y', 'da', 'di', 'van', 'von', 'san'}
+
+# --- Normalización y claves de bloqueo ---
+
+def _ascii(value: str) -> str:
+    return unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode().lower()
+
+def normalize_dni(value: Optional[str]) -> Optional[str]:
+    dni = re.sub(r'[^0-9A-Za-z]', '', value or '').upper()
+    return dni if len(dni) >= 6 else None
+
+def normalize_email(value: Optional[str]) -> Optional[str]:
+    email = (value or '').strip().lower()
+    return email if '@' in email else None
+
+def email_local_part(value: Optional[str]) -> Optional[str]:
+    """Parte local sin puntos ni sufijo +etiqueta (juan.perez+web@x -> juanperez)"""
+    email = normalize_email(value)
+    if not email:
+        return None
+    local = email.split('@', 1)[0].split('+', 1)[0].replace('.', '')
+    return local if len(local) >= 4 else None
+
+def normalize_phone(value: Optional[str]) -> Optional[str]:
+    """Últimos 9 dígitos (celular peruano sin prefijo +51)"""
+    digits = re.sub(r'\D', '', value or '')
+    return digits[-9:] if len(digits) >= 7 else None
+
+def phonetic_token(token: str) -> str:
+    """Clave fonética de una palabra en español: letras que suenan igual comparten código"""
+    t = re.sub(r'[^a-z]', '', _ascii(token))
+    t = t.replace('ch', 'x').replace('ll', 'y').replace('qu', 'k')
+    t = re.sub(r'g(?=[ei])', 'j', t)
+    t = re.sub(r'gu(?=[ei])', 'g', t)  # "gue"/"gui" tras convertir la g suave
+    t = re.sub(r'c(?=[ei])', 's', t)
+    t = t.replace('c', 'k').replace('q', 'k').replace('z', 's').replace('v', 'b').replace('w', 'b').replace('h', '')
+    t = re.sub(r'y$', 'i', t)
+    return re.sub(r'(.)\1+', r'\1', t)
+
+def name_tokens(value: Optional[str]) -> List[str]:
+    tokens = []
+    for word in _ascii(value or '').split():
+        code = phonetic_token(word)
+        if code and word not in NAME_PARTICLES and code not in tokens:
+            tokens.append(code)
+    return tokens
+
+def name_keys(value: Optional[str]) -> Set[str]:
+    """Pares (sin orden) de palabras fonéticas: "Juan Pérez" y "Pérez García, Juan" comparten bloque"""
+    tokens = name_tokens(value)[:4]
+    if len(tokens) == 1:
+        return set(tokens)
+    return {' '.join(sorted(pair)) for pair in combinations(tokens, 2)}
+
+def blocking_keys(dni, nombre, correo, celular) -> Set[Tuple[str, str]]:
+    """Claves (tipo, clave) de un prospecto; dos prospectos son candidatos si comparten alguna"""
+    keys = {('nombre', key) for key in name_keys(nombre)}
+    for tipo, clave in (
+        ('dni', normalize_dni(dni)),
+        ('correo', normalize_email(correo)),
+        ('correo_local', email_local_part(correo)),
+        ('celular', normalize_phone(celular)),
+    ):
+        if clave:
+            keys.add((tipo, clave[:255]))
+    return keys
+
+def name_similarity(a: Optional[str], b: Optional[str]) -> float:
+    """Similitud de nombres: palabras fonéticas compartidas o parecido de la cadena normalizada"""
+    tokens_a, tokens_b = name_tokens(a), name_tokens(b)
+    if not tokens_a or not tokens_b:
+        return 0.0
+    shared = len(set(tokens_a) & set(tokens_b))
+    # Un nombre completo contiene al abreviado ("Juan Pérez" / "Juan Carlos Pérez García")
+    overlap = shared / min(len(tokens_a), len(tokens_b)) if shared >= min(2, len(tokens_a), len(tokens_b)) else 0.0
+    ratio = SequenceMatcher(None, ' '.join(sorted(tokens_a)), ' '.join(sorted(tokens_b))).ratio()
+    return max(overlap, ratio)
+
+def score_pair(a, b) -> Tuple[float, List[str]]:
+    """Puntaje (0-1) y motivos de que dos prospectos sean la misma persona"""
+    keys_a = blocking_keys(a.dni, None, a.correo, a.celular)
+    keys_b = blocking_keys(b.dni, None, b.correo, b.celular)
+    reasons = {tipo: WEIGHTS[tipo] for tipo, _ in keys_a & keys_b}
+    similarity = name_similarity(a.nombre, b.nombre)
+    if similarity >= NAME_SIMILARITY:
+        reasons['nombre'] = WEIGHTS['nombre'] * similarity
+    remaining = 1.0
+    for weight in reasons.values():
+        remaining *= 1 - weight
+    return round(1 - remaining, 4), sorted(reasons, key=lambda tipo: -WEIGHTS[tipo])
+
+# --- Procesamiento incremental ---
+
+PROSPECT_COLUMNS = "prospecto_id, dni, nombre, correo, celular"
+
+def _fetch_prospects(connection: Connection, ids: List) -> Dict:
+    rows = connection.execute(
+        text(f"SELECT {PROSPECT_COLUMNS} FROM prospecto WHERE prospecto_id = ANY(:ids)"),
+        {"ids": list(ids)}
+    ).all()
+    return {row.prospecto_id: row for row in rows}
+
+def _process_batch(connection: Connection, batch_size: int) -> int:
+    ids = connection.execute(text("""
+        DELETE FROM prospecto_dedup_pendiente
+        WHERE prospecto_id IN (
+            SELECT prospecto_id FROM prospecto_dedup_pendiente
+            ORDER BY encolado_en
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING prospecto_id
+    """), {"batch_size": batch_size}).scalars().all()
+    if not ids:
+        return 0
+
+    prospects = _fetch_prospects(connection, ids)
+    connection.execute(text("DELETE FROM prospecto_clave_bloqueo WHERE prospecto_id = ANY(:ids)"), {"ids": ids})
+    keys = [
+        {"prospecto_id": prospect.prospecto_id, "tipo": tipo, "clave": clave}
+        for prospect in prospects.values()
+        for tipo, clave in blocking_keys(prospect.dni, prospect.nombre, prospect.correo, prospect.celular)
+    ]
+    if keys:
+        connection.execute(text("""
+            INSERT INTO prospecto_clave_bloqueo (prospecto_id, tipo, clave)
+            VALUES (:prospecto_id, :tipo, :clave)
+            ON CONFLICT DO NOTHING
+        """), keys)
+
+    # Bloques de las claves del lote; los muy grandes (teléfonos o nombres genéricos) se omiten
+    blocks = connection.execute(text("""
+        SELECT k.tipo, k.clave, array_agg(k.prospecto_id) AS miembros
+        FROM prospecto_clave_bloqueo k
+        WHERE (k.tipo, k.clave) IN (
+            SELECT tipo, clave FROM prospecto_clave_bloqueo WHERE prospecto_id = ANY(:ids)
+        )
+        GROUP BY k.tipo, k.clave
+        HAVING COUNT(*) BETWEEN 2 AND :max_block
+    """), {"ids": ids, "max_block": settings.DEDUP_MAX_BLOCK_SIZE}).all()
+
+    pairs = set()
+    for block in blocks:
+        for member in block.miembros:
+            if member in prospects:
+                pairs.update(tuple(sorted((member, other))) for other in block.miembros if other != member)
+
+    # Un prospecto modificado se vuelve a evaluar: sus candidatos pendientes se recalculan
+    connection.execute(text("""
+        DELETE FROM prospecto_duplicado_candidato
+        WHERE estado = 'pendiente' AND (prospecto_a = ANY(:ids) OR prospecto_b = ANY(:ids))
+    """), {"ids": ids})
+    others = _fetch_prospects(connection, {member for pair in pairs for member in pair} - set(prospects))
+    records = {**others, **prospects}
+    candidates = []
+    for a, b in pairs:
+        if a not in records or b not in records:
+            continue
+        score, reasons = score_pair(records[a], records[b])
+        if score >= settings.DEDUP_MIN_SCORE:
+            candidates.append({"a": a, "b": b, "score": score, "reasons": ','.join(reasons)})
+    if candidates:
+        connection.execute(text("""
+            INSERT INTO prospecto_duplicado_candidato (prospecto_a, prospecto_b, puntaje, motivos)
+            VALUES (:a, :b, :score, :reasons)
+            ON CONFLICT (prospecto_a, prospecto_b)
+            DO UPDATE SET puntaje = EXCLUDED.puntaje, motivos = EXCLUDED.motivos
+        """), candidates)
+    return len(ids)
+
+def process_pending(engine=None) -> int:
+    """Calcular claves y candidatos de los prospectos encolados, por lotes.
+
+    Cada lote es una transacción. Se usa un advisory lock para que una sola
+    instancia procese la cola: dos lotes concurrentes no verían las claves del
+    otro y podrían perder pares. Devuelve el número de prospectos procesados.
+    """
+    if engine is None:
+        from models.database import engine
+
+    processed = 0
+    while True:
+        with engine.begin() as connection:
+            locked = connection.execute(
+                text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": LOCK_NAME}
+            ).scalar()
+            if not locked:
+                logger.info("Deduplicación en proceso en otra instancia; se omite")
+                return processed
+            count = _process_batch(connection, settings.DEDUP_BATCH_SIZE)
+        processed += count
+        if count < settings.DEDUP_BATCH_SIZE:
+            return processed
+
+# --- Consulta y resolución de candidatos ---
+
+def list_candidates(db: Session, status: str, min_score: float, limit: int, offset: int) -> Dict:
+    """Pares candidatos con los datos de ambos prospectos, de mayor a menor puntaje"""
+    params = {"status": status, "min_score": min_score, "limit": limit, "offset": offset}
+    total = db.execute(text("""
+        SELECT COUNT(*) FROM prospecto_duplicado_candidato
+        WHERE estado = :status AND puntaje >= :min_score
+    """), params).scalar()
+    rows = db.execute(text(f"""
+        SELECT c.puntaje, c.motivos, c.estado, c.detectado_en,
+               {', '.join(f'a.{column} AS a_{column}' for column in PROSPECT_COLUMNS.split(', '))},
+               a.estado AS a_estado, a.fecha_registro AS a_fecha_registro,
+               {', '.join(f'b.{column} AS b_{column}' for column in PROSPECT_COLUMNS.split(', '))},
+               b.estado AS b_estado, b.fecha_registro AS b_fecha_registro
+        FROM prospecto_duplicado_candidato c
+        JOIN prospecto a ON a.prospecto_id = c.prospecto_a
+        JOIN prospecto b ON b.prospecto_id = c.prospecto_b
+        WHERE c.estado = :status AND c.puntaje >= :min_score
+        ORDER BY c.puntaje DESC, c.detectado_en
+        LIMIT :limit OFFSET :offset
+    """), params).mappings().all()
+
+    def prospect(row, side):
+        return {
+            "id": str(row[f"{side}_prospecto_id"]),
+            "dni": row[f"{side}_dni"],
+            "full_name": row[f"{side}_nombre"],
+            "email": row[f"{side}_correo"],
+            "phone": row[f"{side}_celular"],
+            "status": row[f"{side}_estado"],
+            "registration_date": row[f"{side}_fecha_registro"].isoformat() if row[f"{side}_fecha_registro"] else None
+        }
+
+    return {
+        "candidates": [{
+            "score": row["puntaje"],
+            "reasons": row["motivos"].split(','),
+            "status": row["estado"],
+            "detected_at": row["detectado_en"].isoformat(),
+            "prospect_a": prospect(row, "a"),
+            "prospect_b": prospect(row, "b")
+        } for row in rows],
+        "total": total
+    }
+
+def dismiss_candidates(db: Session, pairs: List[Tuple[str, str]]) -> int:
+    """Marcar pares como descartados (no son la misma persona)"""
+    result = db.execute(text("""
+        UPDATE prospecto_duplicado_candidato
+        SET estado = 'descartado'
+        WHERE (prospecto_a, prospecto_b) IN (
+            SELECT LEAST(a, b), GREATEST(a, b)
+            FROM unnest(CAST(:a AS UUID[]), CAST(:b AS UUID[])) AS par(a, b)
+        )
+    """), {"a": [a for a, _ in pairs], "b": [b for _, b in pairs]})
+    return result.rowcount
+
+def merge_prospects(db: Session, merges: List[Tuple[str, str]]) -> Dict:
+    """Fusionar prospectos duplicados en lote: [(conservar, fusionar)].
+
+    Las filas hijas pasan al prospecto conservado, sus campos vacíos se completan
+    con los del duplicado y el duplicado se elimina. Las sesiones de visita del
+    duplicado pasan al conservado y se unen con las suyas. Todo ocurre en la
+    transacción de la sesión; el llamador hace commit.
+    """
+    params = {"destinos": [keep for keep, _ in merges], "origenes": [merge for _, merge in merges]}
+    mapping = "SELECT * FROM unnest(CAST(:origenes AS UUID[]), CAST(:destinos AS UUID[])) AS mapa(origen, destino)"
+
+    moved = {}
+    for table in CHILD_TABLES:
+        moved[table] = db.execute(text(f"""
+            UPDATE {table} t SET prospecto_id = mapa.destino
+            FROM ({mapping}) mapa
+            WHERE t.prospecto_id = mapa.origen
+        """), params).rowcount
+
+    merge_prospect_sessions(db.connection(), merges)
+
+    # El duplicado se borra antes de copiar sus datos, para no chocar con índices únicos (dni, correo)
+    merged = db.execute(text(f"""
+        WITH mapa AS ({mapping}),
+        borrados AS (
+            DELETE FROM prospecto o USING mapa
+            WHERE o.prospecto_id = mapa.origen
+            RETURNING mapa.destino, o.tipo_documento, o.dni, o.correo, o.celular, o.ciudad, o.consentimiento_datos
+        )
+        UPDATE prospecto p SET
+            tipo_documento = COALESCE(NULLIF(p.tipo_documento, ''), b.tipo_documento),
+            dni = COALESCE(NULLIF(p.dni, ''), b.dni),
+            correo = COALESCE(NULLIF(p.correo, ''), b.correo),
+            celular = COALESCE(NULLIF(p.celular, ''), b.celular),
+            ciudad = COALESCE(NULLIF(p.ciudad, ''), b.ciudad),
+            consentimiento_datos = COALESCE(p.consentimiento_datos, false) OR COALESCE(b.consentimiento_datos, false)
+        FROM borrados b
+        WHERE p.prospecto_id = b.destino
+        RETURNING p.prospecto_id
+    """), params).scalars().all()
+
+    db.execute(text(f"""
+        WITH mapa AS ({mapping})
+        UPDATE prospecto_fusion f SET prospecto_destino = mapa.destino
+        FROM mapa WHERE f.prospecto_destino = mapa.origen
+    """), params)
+    db.execute(text(f"""
+        INSERT INTO prospecto_fusion (prospecto_origen, prospecto_destino)
+        {mapping}
+        ON CONFLICT (prospecto_origen) DO UPDATE SET
+            prospecto_destino = EXCLUDED.prospecto_destino,
+            fecha_fusion = now() AT TIME ZONE 'utc'
+    """), params)
+    return {"merged": len(merges), "kept": len(set(merged)), "moved_rows": moved}
@@ -0,0 +1,201 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from config import settings
+from services.incremental import refresh_incremental
+from services.time_series import _to_utc
+
+ROLLUP_NAME = "dispositivo_hora"
+
+def error_states() -> List[str]:
+    """Valores de estado_interaccion que cuentan como error (en minúsculas)"""
+    return [state.strip().lower() for state in settings.DEVICE_ERROR_STATES.split(",") if state.strip()]
+
+def _refresh_device_hours(connection: Connection, since: Optional[datetime], until: datetime):
+    params = {"since": since, "until": until, "error_states": error_states()}
+    connection.execute(text("""
+        DELETE FROM dispositivo_hora
+        WHERE CAST(:since AS TIMESTAMP) IS NULL OR hora >= date_trunc('hour', CAST(:since AS TIMESTAMP))
+    """), params)
+    connection.execute(text("""
+        INSERT INTO dispositivo_hora (dispositivo_id, hora, total, errores, ultima_interaccion)
+        SELECT dispositivo_id,
+               date_trunc('hour', timestamp),
+               COUNT(*),
+               COUNT(*) FILTER (WHERE lower(estado_interaccion) = ANY(:error_states)),
+               MAX(timestamp)
+        FROM interaccion
+        WHERE dispositivo_id IS NOT NULL
+          AND timestamp IS NOT NULL
+          AND (CAST(:since AS TIMESTAMP) IS NULL OR timestamp >= date_trunc('hour', CAST(:since AS TIMESTAMP)))
+          AND timestamp < :until
+        GROUP BY 1, 2
+    """), params)
+
+def refresh_device_rollup():
+    """Actualizar incrementalmente los conteos por dispositivo y hora (UTC)"""
+    refresh_incremental(
+        ROLLUP_NAME,
+        timedelta(hours=settings.ANALYTICS_ROLLUP_LOOKBACK_HOURS),
+        _refresh_device_hours,
+        tables=("dispositivo_hora",)
+    )
+
+def device_health(db: Session, start: datetime, end: datetime, granularity: str, timezone: str,
+                  idle_minutes: int, centro_id: Optional[str] = None) -> Dict:
+    """Throughput por intervalo, última interacción, tasa de error y estado de cada dispositivo.
+
+    Las horas consolidadas salen de `dispositivo_hora`; solo el tramo posterior a
+    la marca del rollup (minutos) se lee de `interaccion`. `start` y `end` son
+    horas locales de `timezone`.
+    """
+    tz = ZoneInfo(timezone)
+    center = "AND d.centro_id = CAST(:centro_id AS UUID)" if centro_id else ""
+    params = {
+        "rollup": ROLLUP_NAME,
+        "granularity": granularity,
+        "timezone": timezone,
+        "step": f"1 {granularity}",
+        "start_local": start,
+        "end_local": end,
+        "start_utc": _to_utc(start, tz),
+        "end_utc": _to_utc(end, tz),
+        "error_states": error_states(),
+        "centro_id": centro_id,
+    }
+    corte = """
+        corte AS (
+            SELECT COALESCE(
+                (SELECT date_trunc('hour', valor) FROM agregado_watermark WHERE nombre = :rollup),
+                date_trunc('hour', CAST(:start_utc AS TIMESTAMP))
+            ) AS hora
+        ),
+        reciente AS (
+            SELECT dispositivo_id,
+                   date_trunc('hour', timestamp) AS hora,
+                   COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE lower(estado_interaccion) = ANY(:error_states)) AS errores,
+                   MAX(timestamp) AS ultima_interaccion
+            FROM interaccion, corte
+            WHERE dispositivo_id IS NOT NULL AND timestamp >= corte.hora
+            GROUP BY 1, 2
+        )
+    """
+
+    # Dispositivos registrados (última hora vía la PK) y, sin filtro de centro, los no
+    # registrados que tuvieron actividad en el rango pedido
+    unregistered = "" if centro_id else """
+        UNION ALL
+        SELECT v.dispositivo_id, NULL, NULL, NULL, FALSE, MAX(v.ultima_interaccion)
+        FROM (
+            SELECT dispositivo_id, ultima_interaccion FROM dispositivo_hora
+            WHERE hora >= date_trunc('hour', CAST(:start_utc AS TIMESTAMP)) AND hora < :end_utc
+            UNION ALL
+            SELECT dispositivo_id, ultima_interaccion FROM reciente
+        ) v
+        WHERE NOT EXISTS (SELECT 1 FROM dispositivo d WHERE d.dispositivo_id = v.dispositivo_id)
+        GROUP BY 1
+    """
+    devices = db.execute(text(f"""
+        WITH {corte}
+        SELECT d.dispositivo_id, d.centro_id, d.tipo, d.ubicacion, TRUE AS registrado,
+               GREATEST(
+                   ultima.valor,
+                   (SELECT MAX(r.ultima_interaccion) FROM reciente r WHERE r.dispositivo_id = d.dispositivo_id)
+               ) AS ultima_interaccion
+        FROM dispositivo d
+        LEFT JOIN LATERAL (
+            SELECT h.ultima_interaccion AS valor
+            FROM dispositivo_hora h
+            WHERE h.dispositivo_id = d.dispositivo_id
+            ORDER BY h.hora DESC
+            LIMIT 1
+        ) ultima ON TRUE
+        WHERE TRUE {center}
+        {unregistered}
+        ORDER BY 1
+    """), params).all()
+
+    buckets = [row.bucket for row in db.execute(text("""
+        SELECT generate_series(
+            date_trunc(:granularity, CAST(:start_local AS TIMESTAMP)),
+            CAST(:end_local AS TIMESTAMP) - INTERVAL '1 microsecond',
+            CAST(:step AS INTERVAL)
+        ) AS bucket
+    """), params)]
+
+    rows = db.execute(text(f"""
+        WITH {corte},
+        horas AS (
+            SELECT h.dispositivo_id, h.hora, h.total, h.errores
+            FROM dispositivo_hora h, corte
+            WHERE h.hora >= :start_utc AND h.hora < LEAST(CAST(:end_utc AS TIMESTAMP), corte.hora)
+            UNION ALL
+            SELECT dispositivo_id, hora, total, errores
+            FROM reciente
+            WHERE hora >= date_trunc('hour', CAST(:start_utc AS TIMESTAMP)) AND hora < :end_utc
+        )
+        SELECT dispositivo_id,
+               date_trunc(:granularity, hora AT TIME ZONE 'UTC' AT TIME ZONE :timezone) AS bucket,
+               SUM(total) AS total,
+               SUM(errores) AS errores
+        FROM horas
+        GROUP BY 1, 2
+    """), params).all()
+
+    throughput: Dict[str, Dict[datetime, tuple]] = {}
+    for row in rows:
+        throughput.setdefault(row.dispositivo_id, {})[row.bucket] = (int(row.total), int(row.errores))
+
+    now = datetime.utcnow()
+    idle_after = timedelta(minutes=idle_minutes)
+    result = []
+    summary = {'devices': 0, 'active': 0, 'idle': 0, 'never_seen': 0, 'interactions': 0, 'errors': 0}
+    for device in devices:
+        counts = throughput.get(device.dispositivo_id, {})
+        interactions = sum(total for total, _ in counts.values())
+        errors = sum(errores for _, errores in counts.values())
+        last_seen = device.ultima_interaccion
+        if last_seen is None:
+            status = 'never_seen'
+        elif now - last_seen > idle_after:
+            status = 'idle'
+        else:
+            status = 'active'
+        summary['devices'] += 1
+        summary[status] += 1
+        summary['interactions'] += interactions
+        summary['errors'] += errors
+        result.append({
+            'device_id': device.dispositivo_id,
+            'centro_id': str(device.centro_id) if device.centro_id else None,
+            'type': device.tipo,
+            'location': device.ubicacion,
+            'registered': device.registrado,
+            'last_seen': last_seen.isoformat() if last_seen else None,
+            'minutes_since_last_seen': round((now - last_seen).total_seconds() / 60, 1) if last_seen else None,
+            'status': status,
+            'interactions': interactions,
+            'errors': errors,
+            'error_rate': round(errors / interactions * 100, 2) if interactions else 0,
+            'throughput': [{
+                'bucket': bucket.isoformat(),
+                'interactions': counts.get(bucket, (0, 0))[0],
+                'errors': counts.get(bucket, (0, 0))[1]
+            } for bucket in buckets]
+        })
+
+    summary['error_rate'] = round(summary['errors'] / summary['interactions'] * 100, 2) if summary['interactions'] else 0
+    return {
+        'granularity': granularity,
+        'timezone': timezone,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'idle_minutes': idle_minutes,
+        'error_states': error_states(),
+        'summary': summary,
+        'devices': result
+    }
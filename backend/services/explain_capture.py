@@ -0,0 +1,277 @@
+"""Captura automática de planes (EXPLAIN ANALYZE, BUFFERS) de consultas lentas o muestreadas.
+
+Las sentencias SELECT de las clases de endpoint en EXPLAIN_CLASSES que superan
+EXPLAIN_THRESHOLD_MS, o que caen en la fracción EXPLAIN_SAMPLE_RATE, se encolan.
+Un hilo en segundo plano las vuelve a ejecutar con EXPLAIN sobre el mismo engine,
+dentro de una transacción que se revierte. Los planes se guardan en un buffer
+circular con una huella de su forma, que permite detectar cambios de plan.
+"""
+import hashlib
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Nunca se re-ejecutan sentencias que escriben (ANALYZE las ejecuta de verdad)
+WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|COPY|LOCK|CALL)\b|\bFOR\s+(UPDATE|SHARE|NO KEY UPDATE|KEY SHARE)\b", re.IGNORECASE)
+QUEUE_SIZE = 100
+# Atributos de un nodo que definen la forma del plan (sin costos, filas ni tiempos)
+SHAPE_KEYS = ("Node Type", "Join Type", "Strategy", "Parent Relationship", "Relation Name", "Index Name", "Scan Direction")
+
+def _walk(node: Dict, depth: int = 0):
+    yield node, depth
+    for child in node.get("Plans", []):
+        yield from _walk(child, depth + 1)
+
+def plan_fingerprint(plan: Dict) -> str:
+    """Huella de la forma del plan: nodos, relaciones e índices, sin costos ni filas"""
+    shape = "|".join(
+        f"{depth}:" + ",".join(str(node.get(key, "")) for key in SHAPE_KEYS)
+        for node, depth in _walk(plan)
+    )
+    return hashlib.sha1(shape.encode()).hexdigest()[:16]
+
+def statement_fingerprint(statement: str) -> str:
+    # Las sentencias llegan con placeholders: el texto normalizado identifica la consulta
+    return hashlib.sha1(" ".join(statement.split()).encode()).hexdigest()[:16]
+
+def summarize_plan(plan: Dict) -> Dict:
+    """Forma compacta del plan: nodos en orden, scans secuenciales y buffers"""
+    nodes, seq_scans = [], []
+    for node, depth in _walk(plan):
+        label = node.get("Node Type", "?")
+        if node.get("Relation Name"):
+            label += f" on {node['Relation Name']}"
+        if node.get("Index Name"):
+            label += f" using {node['Index Name']}"
+        nodes.append("  " * depth + label)
+        if node.get("Node Type") == "Seq Scan":
+            seq_scans.append({
+                'relation': node.get("Relation Name"),
+                'rows': node.get("Actual Rows", node.get("Plan Rows")),
+                'loops': node.get("Actual Loops"),
+                'rows_removed_by_filter': node.get("Rows Removed by Filter")
+            })
+    return {
+        'nodes': nodes,
+        'seq_scans': seq_scans,
+        'buffers': {
+            'shared_hit': plan.get("Shared Hit Blocks"),
+            'shared_read': plan.get("Shared Read Blocks"),
+            'temp_written': plan.get("Temp Written Blocks")
+        }
+    }
+
+class ExplainCapture:
+    def __init__(self, enabled: bool, threshold_ms: float, sample_rate: float, classes: List[str],
+                 analyze: bool, buffer_size: int, max_per_minute: int, dedup_seconds: float):
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.classes = set(classes)
+        self.analyze = analyze
+        self.max_per_minute = max_per_minute
+        self.dedup_seconds = dedup_seconds
+        self.plans: deque = deque(maxlen=buffer_size)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._recent_runs: deque = deque()
+        self._last_explained: Dict[str, float] = {}
+        # Última huella de plan por sentencia (para marcar cambios de plan)
+        self._last_plan: Dict[str, str] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.captured = 0
+        self.skipped = {'rate_limit': 0, 'duplicate': 0, 'queue_full': 0}
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def install(self):
+        """Registrar los eventos de SQLAlchemy (solo si EXPLAIN_ENABLED)"""
+        if not self.enabled or self._thread is not None:
+            return
+        event.listen(Engine, "before_cursor_execute", self._before_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_execute)
+        event.listen(Engine, "handle_error", self._on_error)
+        self._thread = threading.Thread(target=self._worker, name="explain-capture", daemon=True)
+        self._thread.start()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("explain_started", []).append(time.perf_counter())
+
+    def _on_error(self, exception_context):
+        connection = exception_context.connection
+        started = connection.info.get("explain_started") if connection is not None else None
+        if started:
+            started.pop()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("explain_started")
+        if not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+        endpoint_class = conn.info.get("endpoint_class")
+        if executemany or endpoint_class not in self.classes or conn.dialect.name != "postgresql":
+            return
+        if elapsed_ms >= self.threshold_ms:
+            reason = 'slow'
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            reason = 'sample'
+        else:
+            return
+        head = statement.lstrip()[:6].upper()
+        if head not in ("SELECT", "WITH") or WRITE_RE.search(statement):
+            return
+        self._submit(conn.engine, statement, parameters, elapsed_ms, endpoint_class, reason)
+
+    def _submit(self, engine, statement, parameters, elapsed_ms, endpoint_class, reason):
+        key = statement_fingerprint(statement)
+        now = time.monotonic()
+        with self._lock:
+            # La misma consulta no se vuelve a explicar dentro de EXPLAIN_DEDUP_SECONDS
+            if now - self._last_explained.get(key, -self.dedup_seconds) < self.dedup_seconds:
+                self.skipped['duplicate'] += 1
+                return
+            while self._recent_runs and now - self._recent_runs[0] > 60:
+                self._recent_runs.popleft()
+            if len(self._recent_runs) >= self.max_per_minute:
+                self.skipped['rate_limit'] += 1
+                return
+            self._recent_runs.append(now)
+            self._last_explained[key] = now
+            if len(self._last_explained) > 10000:
+                self._last_explained = {k: t for k, t in self._last_explained.items() if now - t < self.dedup_seconds}
+        try:
+            self._queue.put_nowait((engine, statement, parameters, elapsed_ms, endpoint_class, reason, key))
+        except queue.Full:
+            self.skipped['queue_full'] += 1
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._explain(*job)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.warning("No se pudo capturar el plan de una consulta lenta: %s", e)
+
+    def _explain(self, engine, statement, parameters, elapsed_ms, endpoint_class, reason, statement_key):
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if self.analyze else "FORMAT JSON"
+        # Sin endpoint_class en la conexión: estas sentencias no se vuelven a capturar
+        with engine.connect() as connection:
+            try:
+                connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.EXPLAIN_STATEMENT_TIMEOUT_MS)}")
+                result = connection.exec_driver_sql(f"EXPLAIN ({options}) {statement}", parameters).scalar()
+            finally:
+                connection.rollback()
+
+        document = result[0] if isinstance(result, list) else result
+        plan = document["Plan"]
+        fingerprint = plan_fingerprint(plan)
+        with self._lock:
+            previous = self._last_plan.get(statement_key)
+            self._last_plan[statement_key] = fingerprint
+            self.captured += 1
+            self.plans.append({
+                'id': uuid.uuid4().hex[:12],
+                'captured_at': datetime.utcnow().isoformat(),
+                'endpoint_class': endpoint_class,
+                'reason': reason,
+                'duration_ms': round(elapsed_ms, 1),
+                'statement_fingerprint': statement_key,
+                'plan_fingerprint': fingerprint,
+                'plan_changed': previous is not None and previous != fingerprint,
+                'previous_plan_fingerprint': previous if previous != fingerprint else None,
+                'statement': " ".join(statement.split())[:4000],
+                'execution_ms': document.get("Execution Time"),
+                'planning_ms': document.get("Planning Time"),
+                'total_cost': plan.get("Total Cost"),
+                **summarize_plan(plan),
+                'plan': document
+            })
+
+    def query(self, endpoint_class: Optional[str] = None, fingerprint: Optional[str] = None,
+              seq_scan: Optional[str] = None, changed_only: bool = False, limit: int = 50,
+              include_plan: bool = False) -> List[Dict]:
+        """Planes capturados (más reciente primero) con filtros"""
+        with self._lock:
+            plans = list(self.plans)
+        result = []
+        for entry in reversed(plans):
+            if endpoint_class and entry['endpoint_class'] != endpoint_class:
+                continue
+            if fingerprint and fingerprint not in (entry['plan_fingerprint'], entry['statement_fingerprint']):
+                continue
+            if seq_scan and not any(scan['relation'] == seq_scan for scan in entry['seq_scans']):
+                continue
+            if changed_only and not entry['plan_changed']:
+                continue
+            result.append(entry if include_plan else {k: v for k, v in entry.items() if k != 'plan'})
+            if len(result) >= limit:
+                break
+        return result
+
+    def fingerprints(self) -> List[Dict]:
+        """Por sentencia: planes distintos observados, con conteo, duración máxima y última vez"""
+        with self._lock:
+            plans = list(self.plans)
+        statements: Dict[str, Dict] = {}
+        for entry in plans:
+            statement = statements.setdefault(entry['statement_fingerprint'], {
+                'statement_fingerprint': entry['statement_fingerprint'],
+                'statement': entry['statement'][:300],
+                'endpoint_class': entry['endpoint_class'],
+                'plans': {}
+            })
+            shape = statement['plans'].setdefault(entry['plan_fingerprint'], {
+                'plan_fingerprint': entry['plan_fingerprint'],
+                'captures': 0,
+                'max_duration_ms': 0,
+                'seq_scans': sorted({scan['relation'] for scan in entry['seq_scans'] if scan['relation']}),
+                'first_seen': entry['captured_at']
+            })
+            shape['captures'] += 1
+            shape['max_duration_ms'] = max(shape['max_duration_ms'], entry['duration_ms'])
+            shape['last_seen'] = entry['captured_at']
+        return sorted((
+            {**statement, 'plan_count': len(statement['plans']), 'plans': list(statement['plans'].values())}
+            for statement in statements.values()
+        ), key=lambda statement: statement['plan_count'], reverse=True)
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': self.threshold_ms,
+            'sample_rate': self.sample_rate,
+            'classes': sorted(self.classes),
+            'analyze': self.analyze,
+            'buffered': len(self.plans),
+            'buffer_size': self.plans.maxlen,
+            'queued': self._queue.qsize(),
+            'captured': self.captured,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+explain_capture = ExplainCapture(
+    settings.EXPLAIN_ENABLED,
+    settings.EXPLAIN_THRESHOLD_MS,
+    settings.EXPLAIN_SAMPLE_RATE,
+    [name.strip() for name in settings.EXPLAIN_CLASSES.split(",") if name.strip()],
+    settings.EXPLAIN_ANALYZE,
+    settings.EXPLAIN_BUFFER_SIZE,
+    settings.EXPLAIN_MAX_PER_MINUTE,
+    settings.EXPLAIN_DEDUP_SECONDS
+)
@@ -0,0 +1,195 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from config import settings
+from services.incremental import refresh_incremental
+
+ROLLUP_NAME = "flujo_transiciones"
+NO_MODULE = "(sin módulo)"
+EXIT_NODE = "(salida)"
+
+def _refresh_flows(connection: Connection, since: Optional[datetime], until: datetime):
+    """Recalcular los recorridos con interacciones en [since, until) y ajustar los agregados"""
+    params = {
+        "since": since,
+        "until": until,
+        # Un recorrido se reconstruye con sus interacciones de las últimas FLOW_MAX_HOURS
+        "window_start": since - timedelta(hours=settings.FLOW_MAX_HOURS) if since else None,
+        "max_steps": settings.FLOW_MAX_PATH_STEPS,
+        "no_module": NO_MODULE,
+    }
+    if since is None:
+        connection.execute(text("TRUNCATE flujo_recorrido, flujo_transicion, flujo_paso, flujo_ruta"))
+
+    connection.execute(text("""
+        CREATE TEMP TABLE flujos_afectados ON COMMIT DROP AS
+        SELECT DISTINCT flow_id FROM interaccion
+        WHERE flow_id IS NOT NULL
+          AND (CAST(:since AS TIMESTAMP) IS NULL OR timestamp >= CAST(:since AS TIMESTAMP))
+          AND timestamp < :until
+    """), params)
+    connection.execute(text("""
+        CREATE TEMP TABLE flujo_delta (
+            flow_id UUID, modulos TEXT[], ruta TEXT, signo INTEGER
+        ) ON COMMIT DROP
+    """))
+
+    # Contribución anterior de los recorridos afectados (se resta)
+    connection.execute(text("""
+        WITH previos AS (
+            DELETE FROM flujo_recorrido r
+            USING flujos_afectados a
+            WHERE r.flow_id = a.flow_id
+            RETURNING r.flow_id, r.modulos, r.ruta
+        )
+        INSERT INTO flujo_delta SELECT flow_id, modulos, ruta, -1 FROM previos
+    """))
+
+    # Recorridos recalculados: orden por orden_en_flujo (numérico) y timestamp, sin repetir
+    # el mismo módulo en pasos consecutivos (se suma)
+    connection.execute(text("""
+        WITH eventos AS (
+            SELECT i.flow_id, i.timestamp,
+                   COALESCE(i.modulo, :no_module) AS modulo,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY i.flow_id
+                       ORDER BY safe_numeric(i.orden_en_flujo) NULLS LAST, i.timestamp, i.interaccion_id
+                   ) AS orden
+            FROM interaccion i
+            JOIN flujos_afectados a ON a.flow_id = i.flow_id
+            WHERE (CAST(:window_start AS TIMESTAMP) IS NULL OR i.timestamp >= CAST(:window_start AS TIMESTAMP))
+              AND i.timestamp < :until
+        ),
+        cambios AS (
+            SELECT *, LAG(modulo) OVER (PARTITION BY flow_id ORDER BY orden) AS anterior
+            FROM eventos
+        ),
+        nuevos AS (
+            INSERT INTO flujo_recorrido (flow_id, inicio, fin, interacciones, modulos, ruta)
+            SELECT e.flow_id, MIN(e.timestamp), MAX(e.timestamp), COUNT(*), p.modulos,
+                   array_to_string(p.modulos[1:CAST(:max_steps AS INTEGER)], ' > ')
+                   || CASE WHEN cardinality(p.modulos) > CAST(:max_steps AS INTEGER) THEN ' > …' ELSE '' END
+            FROM eventos e
+            JOIN (
+                SELECT flow_id, array_agg(modulo ORDER BY orden) AS modulos
+                FROM cambios
+                WHERE anterior IS DISTINCT FROM modulo
+                GROUP BY flow_id
+            ) p ON p.flow_id = e.flow_id
+            GROUP BY e.flow_id, p.modulos
+            RETURNING flow_id, modulos, ruta
+        )
+        INSERT INTO flujo_delta SELECT flow_id, modulos, ruta, 1 FROM nuevos
+    """), params)
+
+    # Deltas de transiciones, llegadas/abandonos por paso y rutas
+    connection.execute(text("""
+        INSERT INTO flujo_transicion (paso, origen, destino, total)
+        SELECT paso, origen, destino, SUM(signo)
+        FROM (
+            SELECT d.signo, CAST(t.paso AS INTEGER) AS paso, t.modulo AS origen,
+                   LEAD(t.modulo) OVER (PARTITION BY d.flow_id, d.signo ORDER BY t.paso) AS destino
+            FROM flujo_delta d, unnest(d.modulos) WITH ORDINALITY AS t(modulo, paso)
+        ) x
+        WHERE destino IS NOT NULL AND paso < CAST(:max_steps AS INTEGER)
+        GROUP BY 1, 2, 3
+        ON CONFLICT (paso, origen, destino) DO UPDATE SET total = flujo_transicion.total + EXCLUDED.total
+    """), params)
+    connection.execute(text("""
+        INSERT INTO flujo_paso (paso, modulo, llegan, abandonan)
+        SELECT CAST(t.paso AS INTEGER), t.modulo, SUM(d.signo),
+               COALESCE(SUM(d.signo) FILTER (WHERE t.paso = cardinality(d.modulos)), 0)
+        FROM flujo_delta d, unnest(d.modulos) WITH ORDINALITY AS t(modulo, paso)
+        WHERE t.paso <= CAST(:max_steps AS INTEGER)
+        GROUP BY 1, 2
+        ON CONFLICT (paso, modulo) DO UPDATE
+        SET llegan = flujo_paso.llegan + EXCLUDED.llegan,
+            abandonan = flujo_paso.abandonan + EXCLUDED.abandonan
+    """), params)
+    connection.execute(text("""
+        INSERT INTO flujo_ruta (ruta, total)
+        SELECT ruta, SUM(signo) FROM flujo_delta GROUP BY ruta
+        ON CONFLICT (ruta) DO UPDATE SET total = flujo_ruta.total + EXCLUDED.total
+    """))
+    # Combinaciones que ya no ocurren en ningún recorrido
+    connection.execute(text("DELETE FROM flujo_transicion WHERE total = 0"))
+    connection.execute(text("DELETE FROM flujo_paso WHERE llegan = 0"))
+    connection.execute(text("DELETE FROM flujo_ruta WHERE total = 0"))
+
+def refresh_flow_rollup():
+    """Actualizar incrementalmente recorridos y transiciones entre módulos"""
+    refresh_incremental(
+        ROLLUP_NAME,
+        timedelta(hours=settings.ANALYTICS_ROLLUP_LOOKBACK_HOURS),
+        _refresh_flows,
+        tables=("flujo_recorrido", "flujo_transicion", "flujo_paso", "flujo_ruta")
+    )
+
+def flow_paths(db: Session, max_steps: int, min_count: int, paths_limit: int) -> Dict:
+    """Matriz de transiciones, abandono por paso, rutas frecuentes y datos para un Sankey"""
+    params = {"max_steps": max_steps, "min_count": min_count, "paths_limit": paths_limit, "rollup": ROLLUP_NAME}
+    transitions = db.execute(text("""
+        SELECT paso, origen, destino, total FROM flujo_transicion
+        WHERE paso < :max_steps AND total >= :min_count
+        ORDER BY paso, total DESC
+    """), params).all()
+    steps = db.execute(text("""
+        SELECT paso, modulo, llegan, abandonan FROM flujo_paso
+        WHERE paso <= :max_steps
+        ORDER BY paso, llegan DESC
+    """), params).all()
+    paths = db.execute(text("""
+        SELECT ruta, total FROM flujo_ruta ORDER BY total DESC LIMIT :paths_limit
+    """), params).all()
+    refreshed_until = db.execute(
+        text("SELECT valor FROM agregado_watermark WHERE nombre = :rollup"), params
+    ).scalar()
+
+    total_flows = sum(step.llegan for step in steps if step.paso == 1)
+
+    # Matriz módulo → módulo (todas las posiciones)
+    matrix_counts = defaultdict(int)
+    for row in transitions:
+        matrix_counts[(row.origen, row.destino)] += row.total
+    modules = sorted({module for pair in matrix_counts for module in pair})
+    index = {module: i for i, module in enumerate(modules)}
+    matrix = [[0] * len(modules) for _ in modules]
+    for (origin, destination), total in matrix_counts.items():
+        matrix[index[origin]][index[destination]] = total
+
+    # Sankey: un nodo por (paso, módulo); el abandono va a un nodo de salida por paso
+    nodes, links = {}, []
+
+    def node(step: int, module: str) -> str:
+        key = f"{step}:{module}"
+        nodes.setdefault(key, {'id': key, 'step': step, 'module': module})
+        return key
+
+    for row in transitions:
+        links.append({'source': node(row.paso, row.origen), 'target': node(row.paso + 1, row.destino), 'value': row.total})
+    for step in steps:
+        if step.abandonan >= max(min_count, 1):
+            links.append({'source': node(step.paso, step.modulo), 'target': node(step.paso, EXIT_NODE), 'value': step.abandonan})
+
+    return {
+        'total_flows': total_flows,
+        'refreshed_until': refreshed_until.isoformat() if refreshed_until else None,
+        'steps': [{
+            'step': step.paso,
+            'module': step.modulo,
+            'reached': step.llegan,
+            'continued': step.llegan - step.abandonan,
+            'dropped': step.abandonan,
+            'drop_off_rate': round(step.abandonan / step.llegan * 100, 2) if step.llegan else 0
+        } for step in steps],
+        'transition_matrix': {'modules': modules, 'matrix': matrix},
+        'top_paths': [{
+            'path': row.ruta,
+            'flows': row.total,
+            'percentage': round(row.total / total_flows * 100, 2) if total_flows else 0
+        } for row in paths],
+        'sankey': {'nodes': list(nodes.values()), 'links': links}
+    }
@@ -0,0 +1,57 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+def get_watermark(connection: Connection, name: str) -> Optional[datetime]:
+    """Hasta dónde (timestamp UTC) está procesado el agregado `name`"""
+    return connection.execute(
+        text("SELECT valor FROM agregado_watermark WHERE nombre = :name"), {"name": name}
+    ).scalar()
+
+def set_watermark(connection: Connection, name: str, value: datetime):
+    connection.execute(text("""
+        INSERT INTO agregado_watermark (nombre, valor, actualizado_en)
+        VALUES (:name, :value, now() AT TIME ZONE 'utc')
+        ON CONFLICT (nombre) DO UPDATE SET valor = EXCLUDED.valor, actualizado_en = EXCLUDED.actualizado_en
+    """), {"name": name, "value": value})
+
+def refresh_incremental(
+    name: str,
+    lookback: timedelta,
+    refresh: Callable[[Connection, Optional[datetime], datetime], None],
+    tables: Iterable[str] = (),
+    engine=None
+) -> bool:
+    """Recalcular un agregado desde la última marca (menos `lookback`) hasta ahora.
+
+    `refresh(connection, since, until)` debe reemplazar el tramo [since, until) del
+    agregado; `since` es None en la primera ejecución (reconstrucción completa).
+    El lookback vuelve a procesar el tramo reciente para absorber datos tardíos.
+    Todo ocurre en una transacción sobre la base principal y, si otro proceso ya
+    está refrescando el mismo agregado o falta alguna de `tables` (migración sin
+    aplicar), se omite. Devuelve True si se ejecutó.
+    """
+    if engine is None:
+        from models.database import engine
+
+    until = datetime.utcnow()
+    with engine.begin() as connection:
+        for table in ("agregado_watermark", *tables):
+            if connection.execute(text("SELECT to_regclass(:table)"), {"table": table}).scalar() is None:
+                logger.info("Agregado %s omitido: no existe la tabla %s", name, table)
+                return False
+        locked = connection.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": name}
+        ).scalar()
+        if not locked:
+            logger.info("Agregado %s en proceso en otra instancia; se omite", name)
+            return False
+        watermark = get_watermark(connection, name)
+        since = watermark - lookback if watermark else None
+        refresh(connection, since, until)
+        set_watermark(connection, name, until)
+    return True
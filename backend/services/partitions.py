@@ -0,0 +1,83 @@
+import logging
+import re
+from datetime import date, datetime
+from typing import List, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+def is_partitioned(connection: Connection, table: str) -> bool:
+    return bool(connection.execute(text("""
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace
+    """), {"table": table}).scalar())
+
+def list_partitions(connection: Connection, table: str) -> List[Tuple[str, datetime, datetime]]:
+    """Particiones por rango del padre `table`: [(nombre, desde, hasta)], sin la DEFAULT"""
+    rows = connection.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table AND p.relnamespace = 'public'::regnamespace
+    """), {"table": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_PATTERN.search(bound or '')
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda item: item[1])
+
+def create_monthly_partition(connection: Connection, table: str, month: date, prefix: str = None):
+    """Crear la partición del mes; `prefix` permite nombrarla distinto del padre"""
+    month = month_start(month)
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {partition_name(prefix or table, month)}
+        PARTITION OF {table}
+        FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+    """))
+
+def ensure_future_partitions(connection: Connection, table: str, months_ahead: int, prefix: str = None):
+    """Crear las particiones del mes actual y de los `months_ahead` siguientes"""
+    current = month_start(datetime.utcnow().date())
+    for offset in range(months_ahead + 1):
+        create_monthly_partition(connection, table, add_months(current, offset), prefix)
+
+def drop_expired_partitions(connection: Connection, table: str, retention_months: int) -> List[str]:
+    """Desvincular y eliminar las particiones completamente anteriores a la retención"""
+    cutoff = datetime.combine(add_months(month_start(datetime.utcnow().date()), -retention_months), datetime.min.time())
+    dropped = []
+    for name, _, upper in list_partitions(connection, table):
+        if upper <= cutoff:
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+def maintain_interaction_partitions():
+    """Tarea periódica: particiones futuras de `interaccion` y retención"""
+    from models.database import engine
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection, "interaccion"):
+            return
+        ensure_future_partitions(connection, "interaccion", settings.INTERACCION_PARTITIONS_AHEAD)
+        if settings.INTERACCION_RETENTION_MONTHS > 0:
+            dropped = drop_expired_partitions(connection, "interaccion", settings.INTERACCION_RETENTION_MONTHS)
+            if dropped:
+                logger.info("Particiones eliminadas por retención: %s", ", ".join(dropped))
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterable, Optional
+from sqlalchemy import text
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+def _normalize_value(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        # Fechas a ISO para que "2024-01-01" y "2024-01-01T00:00:00" compartan entrada
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        return value
+
+def normalize_filters(filters: Dict) -> Dict:
+    """Filtros sin valores vacíos, con fechas en ISO y en orden estable"""
+    normalized = {k: _normalize_value(v) for k, v in filters.items()}
+    return {k: v for k, v in sorted(normalized.items()) if v is not None}
+
+class ReportCache:
+    """Caché en disco de reportes generados (JSON, CSV, XLSX) con límite de tamaño LRU.
+
+    La clave combina tipo de reporte, formato, filtros normalizados y la versión de
+    datos de las tablas involucradas, de modo que cualquier escritura invalida las
+    entradas.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, version_ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._versions: Dict[tuple, tuple] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        # Reconstruir el índice LRU a partir de los archivos existentes (más antiguo primero)
+        if not os.path.isdir(self.directory):
+            return
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path) and not name.endswith('.tmp'):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+
+    def bump_data_version(self):
+        """Invalidar de inmediato las entradas dependientes de la versión de datos"""
+        with self._lock:
+            self._generation += 1
+            self._versions.clear()
+
+    def data_version(self, tables: Iterable[str]) -> Optional[str]:
+        """Sello de versión de datos a partir de los contadores de escrituras de Postgres"""
+        from models.database import engine
+
+        tables = tuple(sorted(tables))
+        now = time.monotonic()
+        cached = self._versions.get(tables)
+        if cached and now - cached[0] < self.version_ttl:
+            return cached[1]
+        try:
+            # Las estadísticas son locales a cada servidor: se consultan en la principal
+            with engine.connect() as connection:
+                stamp = connection.execute(text("""
+                    SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+                    FROM pg_stat_user_tables
+                    WHERE relname = ANY(:tables)
+                """), {"tables": list(tables)}).scalar()
+        except Exception:
+            logger.exception("No se pudo obtener la versión de datos; se omite la caché")
+            return None
+        version = f"{stamp}:{self._generation}"
+        self._versions[tables] = (now, version)
+        return version
+
+    def key(self, report_type: str, format: str, filters: Dict, tables: Iterable[str]) -> Optional[str]:
+        """Clave de caché del reporte, o None si no se puede cachear"""
+        if not settings.REPORT_CACHE_ENABLED:
+            return None
+        normalized = normalize_filters(filters)
+        version = self.data_version(tables)
+        if version is None:
+            return None
+        raw = json.dumps([report_type, format, normalized, version], sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _filename(self, key: str, extension: str) -> str:
+        return f"{key}.{extension}"
+
+    def get(self, key: str, extension: str) -> Optional[BinaryIO]:
+        """Archivo cacheado abierto para lectura (y lo marca como usado recientemente).
+
+        Se abre bajo el lock: si otra petición lo desaloja mientras se sirve, el
+        descriptor abierto sigue siendo válido hasta que se cierre.
+        """
+        name = self._filename(key, extension)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            fileobj = None
+            if name in self._entries:
+                try:
+                    fileobj = open(path, 'rb')
+                except FileNotFoundError:
+                    pass
+            if fileobj is None:
+                self._size -= self._entries.pop(name, 0)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return fileobj
+
+    def put(self, key: str, extension: str, content: bytes) -> str:
+        """Guardar el contenido y desalojar las entradas menos usadas si se supera el límite"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = self._filename(key, extension)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = len(content)
+            self._size += len(content)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_name, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'size_bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+report_cache = ReportCache(
+    settings.REPORT_CACHE_DIR,
+    settings.REPORT_CACHE_MAX_MB * 1024 * 1024,
+    settings.REPORT_CACHE_VERSION_TTL
+)
@@ -0,0 +1,35 @@
+import csv
+from typing import Any, Dict, IO, List
+
+def _fieldnames(rows: List[Dict]) -> List[str]:
+    # Unión de columnas en orden de aparición (p.ej. embudo + canales en conversiones)
+    fieldnames = []
+    for row in rows:
+        for key in row.keys():
+            if key not in fieldnames:
+                fieldnames.append(key)
+    return fieldnames
+
+def _cell(value: Any):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def write_csv(rows: List[Dict], fileobj: IO[str]):
+    """Escribir filas (dicts) como CSV en un archivo de texto"""
+    writer = csv.DictWriter(fileobj, fieldnames=_fieldnames(rows))
+    writer.writeheader()
+    writer.writerows(rows)
+
+def write_xlsx(sheets: Dict[str, List[Dict]], fileobj: IO[bytes]):
+    """Escribir un libro XLSX con una hoja por entrada de `sheets`"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for title, rows in sheets.items():
+        sheet = workbook.create_sheet(title=title[:31])
+        fieldnames = _fieldnames(rows)
+        sheet.append(fieldnames)
+        for row in rows:
+            sheet.append([_cell(row.get(field)) for field in fieldnames])
+    workbook.save(fileobj)
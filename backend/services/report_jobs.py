@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+EXTENSIONS = {"csv": "csv", "excel": "xlsx"}
+
+class ReportJob:
+    """Trabajo de generación de un reporte en segundo plano"""
+
+    def __init__(self, report_type: str, format: str, filters: Dict, key: str):
+        self.id = uuid.uuid4().hex
+        self.report_type = report_type
+        self.format = format
+        self.filters = filters
+        self.key = key
+        self.status = PENDING
+        self.error: Optional[str] = None
+        self.path: Optional[str] = None
+        self.size_bytes: Optional[int] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def filename(self) -> str:
+        return f"{self.report_type}_{self.created_at.strftime('%Y%m%d_%H%M%S')}.{EXTENSIONS[self.format]}"
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "report_type": self.report_type,
+            "format": self.format,
+            "filters": self.filters,
+            "status": self.status,
+            "error": self.error,
+            "size_bytes": self.size_bytes,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ReportJobManager:
+    """Cola de reportes: un pool de hilos genera los archivos en disco.
+
+    Las solicitudes idénticas (mismo tipo, formato y filtros) mientras un trabajo
+    está pendiente o en curso reciben el mismo trabajo en lugar de uno nuevo.
+    El estado vive en memoria del proceso; los artefactos se guardan en `directory`
+    y se eliminan pasadas `retention_hours`.
+    """
+
+    def __init__(self, directory: str, workers: int, retention_hours: float, max_pending: int):
+        self.directory = directory
+        self.max_pending = max_pending
+        self.retention = timedelta(hours=retention_hours)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-job")
+        self._jobs: Dict[str, ReportJob] = {}
+        self._active: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def job_key(report_type: str, format: str, filters: Dict) -> str:
+        normalized = {k: v for k, v in sorted(filters.items()) if v not in (None, "")}
+        raw = json.dumps([report_type, format, normalized], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def submit(self, report_type: str, format: str, filters: Dict,
+               render: Callable[[str], None]) -> Tuple[ReportJob, bool]:
+        """Encolar un reporte; `render(path)` escribe el archivo. Devuelve (trabajo, deduplicado)"""
+        key = self.job_key(report_type, format, filters)
+        with self._lock:
+            active_id = self._active.get(key)
+            if active_id and self._jobs[active_id].status in (PENDING, RUNNING):
+                return self._jobs[active_id], True
+            pending = sum(1 for queued in self._jobs.values() if queued.status == PENDING)
+            if pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Cola de reportes llena, intente nuevamente",
+                    headers={"Retry-After": "60"}
+                )
+            job = ReportJob(report_type, format, filters, key)
+            self._jobs[job.id] = job
+            self._active[key] = job.id
+        self._executor.submit(self._run, job, render)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        return self._jobs.get(job_id)
+
+    def _run(self, job: ReportJob, render: Callable[[str], None]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{job.id}.{EXTENSIONS[job.format]}")
+        tmp_path = f"{path}.tmp"
+        job.status = RUNNING
+        job.started_at = datetime.utcnow()
+        try:
+            render(tmp_path)
+            os.replace(tmp_path, path)
+            job.path = path
+            job.size_bytes = os.path.getsize(path)
+            job.status = DONE
+        except Exception as e:
+            logger.exception("Error generando reporte %s (%s)", job.report_type, job.id)
+            job.error = str(e)
+            job.status = FAILED
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            job.finished_at = datetime.utcnow()
+            with self._lock:
+                if self._active.get(job.key) == job.id:
+                    del self._active[job.key]
+
+    def cleanup(self):
+        """Eliminar trabajos terminados y artefactos más antiguos que la retención"""
+        cutoff = datetime.utcnow() - self.retention
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.status in (DONE, FAILED) and job.finished_at and job.finished_at < cutoff
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            if job.path and os.path.exists(job.path):
+                os.remove(job.path)
+        # Artefactos huérfanos (p.ej. de un proceso anterior)
+        if os.path.isdir(self.directory):
+            known = {job.path for job in self._jobs.values()}
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                modified = datetime.utcfromtimestamp(os.path.getmtime(path))
+                if path not in known and modified < cutoff:
+                    os.remove(path)
+        return len(expired)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+report_jobs = ReportJobManager(
+    settings.REPORT_JOBS_DIR,
+    settings.REPORT_JOB_WORKERS,
+    settings.REPORT_JOB_RETENTION_HOURS,
+    settings.REPORT_JOB_MAX_PENDING
+)
@@ -0,0 +1,334 @@
+"""Profiler por solicitud bajo demanda (muestreo de pilas + tiempo SQL exacto).
+
+Una solicitud se perfila si trae el header `X-Profile-Token` igual a PROFILER_TOKEN
+o si cae en la fracción PROFILER_SAMPLE_RATE. Mientras dura, un hilo muestrea cada
+PROFILER_INTERVAL_MS las pilas del hilo del event loop que ejecutan esta solicitud
+y las de los hilos del threadpool marcados mientras ejecutan su endpoint. El tiempo SQL se mide
+con eventos de SQLAlchemy. El resultado se guarda en PROFILER_DIR.
+"""
+import contextvars
+import functools
+import hmac
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+from fastapi import Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+TOKEN_HEADER = b"x-profile-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+FOLDED_SUFFIX = ".folded"
+# Los endpoints de diagnóstico protegidos usan el mismo header; no se perfilan
+EXCLUDED_PATHS = ("/monitoring/profiles", "/monitoring/slow-queries")
+
+# Funciones hoja que identifican una muestra como SQL, espera de pool o serialización
+SQL_FUNCTIONS = {"do_execute", "do_executemany", "do_execute_no_params"}
+POOL_FUNCTIONS = {"_do_get"}
+SERIALIZATION_FUNCTIONS = {"jsonable_encoder", "serialize_response", "render", "dumps", "to_dict"}
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _category(stack: List) -> str:
+    """Clasificar una muestra (pila de la raíz a la hoja) por lo que estaba haciendo"""
+    names = [frame.f_code.co_name for frame in stack]
+    files = [frame.f_code.co_filename for frame in stack]
+    if any(name in POOL_FUNCTIONS for name in names):
+        return 'db_pool_wait'
+    if any(name in SQL_FUNCTIONS for name in names):
+        return 'sql'
+    if any(name in SERIALIZATION_FUNCTIONS for name in names) or any(path.endswith(os.path.join('fastapi', 'encoders.py')) for path in files):
+        return 'serialization'
+    return 'python'
+
+class RequestProfile:
+    """Muestras y consultas SQL de una solicitud perfilada"""
+
+    def __init__(self, scope: Dict, frame, trigger: str):
+        self.id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.scope = scope
+        self.frame = frame
+        self.loop_thread = threading.get_ident()
+        # Hilos del threadpool que ejecutan ahora mismo el endpoint de esta solicitud
+        self.threads: set = set()
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.elapsed_ms = 0.0
+        self.status_code: Optional[int] = None
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.samples = 0
+        self.sql: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+
+    def add_sample(self, stack: List):
+        key = ";".join(_label(frame) for frame in stack)
+        with self._lock:
+            self.stacks[key] += 1
+            self.categories[_category(stack)] += 1
+            self.samples += 1
+
+    def add_sql(self, statement: str, elapsed_ms: float):
+        with self._lock:
+            self.sql.setdefault(" ".join(statement.split())[:500], []).append(elapsed_ms)
+
+    def summary(self, top: int = 25) -> Dict:
+        interval_ms = settings.PROFILER_INTERVAL_MS
+        own, cumulative = Counter(), Counter()
+        for key, count in self.stacks.items():
+            labels = key.split(";")
+            own[labels[-1]] += count
+            for label in set(labels):
+                cumulative[label] += count
+        sql_ms = sum(sum(times) for times in self.sql.values())
+        statements = sorted(self.sql.items(), key=lambda item: sum(item[1]), reverse=True)
+
+        def functions(counter: Counter):
+            return [{
+                'function': label,
+                'samples': count,
+                'estimated_ms': round(count * interval_ms, 1),
+                'percentage': round(count / self.samples * 100, 2) if self.samples else 0
+            } for label, count in counter.most_common(top)]
+
+        return {
+            'id': self.id,
+            'method': self.scope.get('method'),
+            'path': self.scope.get('path'),
+            'query_string': self.scope.get('query_string', b'').decode('latin-1'),
+            'trigger': self.trigger,
+            'status_code': self.status_code,
+            'started_at': self.started_at.isoformat(),
+            'elapsed_ms': round(self.elapsed_ms, 1),
+            'interval_ms': interval_ms,
+            'samples': self.samples,
+            'sql': {
+                'statements': sum(len(times) for times in self.sql.values()),
+                'total_ms': round(sql_ms, 1),
+                'percentage': round(sql_ms / self.elapsed_ms * 100, 2) if self.elapsed_ms else 0,
+                'top_statements': [{
+                    'statement': statement,
+                    'calls': len(times),
+                    'total_ms': round(sum(times), 1),
+                    'max_ms': round(max(times), 1)
+                } for statement, times in statements[:10]]
+            },
+            'python_ms': round(max(self.elapsed_ms - sql_ms, 0), 1),
+            'breakdown': {
+                category: {
+                    'samples': count,
+                    'percentage': round(count / self.samples * 100, 2) if self.samples else 0
+                } for category, count in self.categories.most_common()
+            },
+            'top_self': functions(own),
+            'top_cumulative': functions(cumulative)
+        }
+
+class RequestProfiler:
+    def __init__(self, directory: str, token: str, sample_rate: float, max_artifacts: int):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.max_artifacts = max_artifacts
+        self._sampled_active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def trigger(self, scope: Dict) -> Optional[str]:
+        """'header', 'sample' o None según si la solicitud debe perfilarse"""
+        if any(path in scope.get('path', '') for path in EXCLUDED_PATHS):
+            return None
+        if self.token:
+            for name, value in scope.get('headers', []):
+                if name == TOKEN_HEADER and hmac.compare_digest(value, self.token.encode()):
+                    return 'header'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            # Por muestreo, una solicitud a la vez para acotar el overhead
+            with self._lock:
+                if self._sampled_active == 0:
+                    self._sampled_active += 1
+                    return 'sample'
+        return None
+
+    def start(self, scope: Dict, frame, trigger: str) -> RequestProfile:
+        profile = RequestProfile(scope, frame, trigger)
+        _current.set(profile)
+        threading.Thread(target=self._sample, args=(profile,), name=f"profiler-{profile.id}", daemon=True).start()
+        return profile
+
+    def _sample(self, profile: RequestProfile):
+        interval = settings.PROFILER_INTERVAL_MS / 1000
+        own_thread = threading.get_ident()
+        while not profile.done.wait(interval):
+            frames = sys._current_frames()
+            for thread_id in {profile.loop_thread} | set(profile.threads):
+                frame = frames.get(thread_id)
+                if thread_id == own_thread or frame is None:
+                    continue
+                # En el event loop solo cuenta si está ejecutando esta solicitud
+                stack, owned = [], thread_id != profile.loop_thread
+                while frame is not None:
+                    if frame is profile.frame:
+                        owned = True
+                    stack.append(frame)
+                    frame = frame.f_back
+                if owned:
+                    profile.add_sample(stack[::-1])
+
+    def finish(self, profile: RequestProfile):
+        profile.elapsed_ms = (time.perf_counter() - profile.start) * 1000
+        profile.done.set()
+        profile.frame = None
+        if profile.trigger == 'sample':
+            with self._lock:
+                self._sampled_active -= 1
+        try:
+            self._save(profile)
+        except Exception:
+            logger.exception("No se pudo guardar el perfil %s", profile.id)
+
+    def _save(self, profile: RequestProfile):
+        os.makedirs(self.directory, exist_ok=True)
+        summary = profile.summary()
+        with open(os.path.join(self.directory, f"{profile.id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        # Formato "folded" (una pila por línea con su conteo): flamegraph.pl, speedscope
+        with open(os.path.join(self.directory, f"{profile.id}{FOLDED_SUFFIX}"), 'w', encoding='utf-8') as f:
+            for stack, count in profile.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning(
+            "Perfil %s: %s %s %.1f ms (SQL %.1f ms)",
+            profile.id, summary['method'], summary['path'], summary['elapsed_ms'], summary['sql']['total_ms']
+        )
+        self._prune()
+
+    def _prune(self):
+        profiles = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in profiles[:max(len(profiles) - self.max_artifacts, 0)]:
+            for suffix in ('.json', FOLDED_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def path(self, profile_id: str, suffix: str) -> str:
+        """Ruta del artefacto; 404 si no existe o el id no es válido"""
+        path = os.path.join(self.directory, f"{os.path.basename(profile_id)}{suffix}")
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Perfil no encontrado")
+        return path
+
+    def list(self) -> List[Dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                summary = json.load(f)
+            profiles.append({key: summary.get(key) for key in (
+                'id', 'method', 'path', 'trigger', 'status_code', 'started_at', 'elapsed_ms', 'samples'
+            )} | {'sql_ms': summary['sql']['total_ms']})
+        return profiles
+
+    def load(self, profile_id: str) -> Dict:
+        with open(self.path(profile_id, '.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+request_profiler = RequestProfiler(
+    settings.PROFILER_DIR,
+    settings.PROFILER_TOKEN,
+    settings.PROFILER_SAMPLE_RATE,
+    settings.PROFILER_MAX_ARTIFACTS
+)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profiler_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    started = conn.info.get("profiler_started")
+    if profile is not None and started:
+        profile.add_sql(statement, (time.perf_counter() - started.pop()) * 1000)
+
+def _profiled_endpoint(func):
+    @functools.wraps(func)
+    def endpoint(*args, **kwargs):
+        # Corre en el threadpool con una copia del contexto: marca este hilo para la solicitud
+        profile = _current.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        thread_id = threading.get_ident()
+        profile.threads.add(thread_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.threads.discard(thread_id)
+    return endpoint
+
+def instrument_routes(app):
+    """Marcar los hilos que ejecutan endpoints síncronos con el perfil de su solicitud"""
+    from fastapi.routing import APIRoute
+    for route in app.routes:
+        # Los endpoints async corren en el event loop, bajo el frame del middleware
+        if isinstance(route, APIRoute) and not inspect.iscoroutinefunction(route.dependant.call):
+            # El handler lee dependant.call en cada solicitud
+            route.dependant.call = _profiled_endpoint(route.dependant.call)
+
+class ProfilerMiddleware:
+    """Middleware ASGI puro (conserva el contexto, que llega a los hilos del threadpool)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        trigger = request_profiler.trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = request_profiler.start(scope, sys._getframe(), trigger)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            await run_in_threadpool(request_profiler.finish, profile)
+
+def require_profiler_token(x_profile_token: Optional[str] = Header(None)):
+    """Dependencia: los artefactos de perfil solo se sirven con el token del profiler"""
+    if not request_profiler.token:
+        raise HTTPException(status_code=404, detail="Profiler deshabilitado (PROFILER_TOKEN vacío)")
+    if not x_profile_token or not hmac.compare_digest(x_profile_token, request_profiler.token):
+        raise HTTPException(status_code=403, detail="Token de profiler inválido")
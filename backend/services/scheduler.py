@@ -0,0 +1,70 @@
+import logging
+import threading
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Tarea que se ejecuta cada `interval` segundos en un hilo daemon"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], None], run_at_start: bool = False):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_at_start = run_at_start
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"task-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.run_at_start:
+            self._execute()
+        while not self._stop.wait(self.interval):
+            self._execute()
+
+    def _execute(self):
+        try:
+            self.func()
+        except Exception:
+            logger.exception("Error en tarea periódica %s", self.name)
+
+
+class Scheduler:
+    """Registro de tareas periódicas arrancadas con la aplicación"""
+
+    def __init__(self):
+        self._tasks: Dict[str, PeriodicTask] = {}
+        self._running = False
+
+    def register(self, name: str, interval: float, func: Callable[[], None], run_at_start: bool = False):
+        task = PeriodicTask(name, interval, func, run_at_start)
+        self._tasks[name] = task
+        if self._running:
+            task.start()
+        return task
+
+    def start(self):
+        self._running = True
+        for task in self._tasks.values():
+            task.start()
+
+    def stop(self):
+        self._running = False
+        for task in self._tasks.values():
+            task.stop()
+
+    def tasks(self):
+        return {name: task.interval for name, task in self._tasks.items()}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,160 @@
+import math
+from bisect import bisect_right
+from collections import defaultdict
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services.centers import PROSPECTS_IN_CENTER_SQL
+
+PERCENTILES = (0.25, 0.5, 0.75, 0.9)
+
+class ScoreDistribution:
+    """Frecuencias de puntajes (valor -> cantidad) y resultados sin puntaje numérico"""
+
+    def __init__(self):
+        self.frequencies: Dict[float, int] = defaultdict(int)
+        self.unscored = 0
+
+    def add(self, score: Optional[float], count: int):
+        if score is None:
+            self.unscored += count
+        else:
+            self.frequencies[score] += count
+
+    @property
+    def scored(self) -> int:
+        return sum(self.frequencies.values())
+
+    @property
+    def total(self) -> int:
+        return self.scored + self.unscored
+
+    def average(self) -> Optional[float]:
+        scored = self.scored
+        if not scored:
+            return None
+        return sum(value * count for value, count in self.frequencies.items()) / scored
+
+    def stddev(self) -> Optional[float]:
+        # Desviación muestral, como stddev() en Postgres
+        scored = self.scored
+        if scored < 2:
+            return None
+        average = self.average()
+        squares = sum(count * (value - average) ** 2 for value, count in self.frequencies.items())
+        return math.sqrt(squares / (scored - 1))
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Percentil con interpolación lineal (mismo criterio que percentile_cont)"""
+        values = sorted(self.frequencies)
+        if not values:
+            return None
+        cumulative, running = [], 0
+        for value in values:
+            running += self.frequencies[value]
+            cumulative.append(running)
+
+        def value_at(rank: int) -> float:
+            return values[bisect_right(cumulative, rank)]
+
+        position = fraction * (running - 1)
+        lower, upper = value_at(math.floor(position)), value_at(math.ceil(position))
+        return lower + (upper - lower) * (position - math.floor(position))
+
+    def histogram(self, bins: int) -> List[Dict]:
+        """Histograma de `bins` intervalos de igual ancho entre el mínimo y el máximo"""
+        if not self.frequencies:
+            return []
+        low, high = min(self.frequencies), max(self.frequencies)
+        width = (high - low) / bins if high > low else 1
+        counts = [0] * bins
+        for value, count in self.frequencies.items():
+            counts[min(int((value - low) / width), bins - 1)] += count
+        return [
+            {'from': _round(low + i * width), 'to': _round(low + (i + 1) * width), 'count': count}
+            for i, count in enumerate(counts)
+        ]
+
+    def stats(self) -> Dict:
+        return {
+            'total_tests': self.total,
+            'scored_tests': self.scored,
+            'average_score': _round(self.average()),
+            'min_score': _round(min(self.frequencies)) if self.frequencies else None,
+            'max_score': _round(max(self.frequencies)) if self.frequencies else None,
+            'stddev': _round(self.stddev()),
+            'percentiles': {f'p{int(p * 100)}': _round(self.percentile(p)) for p in PERCENTILES}
+        }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+def score_distribution(db: Session, test_id: Optional[str] = None, bins: int = 10,
+                     centro_id: Optional[str] = None) -> Dict:
+    """Histograma, percentiles y estadísticas por clasificación y por test.
+
+    Se calcula a partir de test_puntaje_frecuencia, que los triggers de
+    test_resultado mantienen al día, sin convertir puntajes fila por fila.
+    La tabla de frecuencias es global: por centro, las mismas frecuencias se
+    agrupan desde puntaje_num de los prospectos del centro.
+    """
+    params = {"test_id": test_id, "centro_id": centro_id}
+    if centro_id:
+        rows = db.execute(text(f"""
+            SELECT test_id, clasificacion, puntaje_num AS puntaje, COUNT(*) AS total
+            FROM test_resultado
+            WHERE (CAST(:test_id AS UUID) IS NULL OR test_id = CAST(:test_id AS UUID))
+              AND {PROSPECTS_IN_CENTER_SQL}
+            GROUP BY 1, 2, 3
+        """), params).all()
+    else:
+        rows = db.execute(text("""
+            SELECT test_id, clasificacion, puntaje, total
+            FROM test_puntaje_frecuencia
+            WHERE total > 0
+              AND (CAST(:test_id AS UUID) IS NULL OR test_id = CAST(:test_id AS UUID))
+        """), params).all()
+
+    overall = ScoreDistribution()
+    by_classification: Dict[Optional[str], ScoreDistribution] = defaultdict(ScoreDistribution)
+    by_test: Dict[Optional[str], ScoreDistribution] = defaultdict(ScoreDistribution)
+    for row in rows:
+        score = float(row.puntaje) if row.puntaje is not None else None
+        overall.add(score, row.total)
+        by_classification[row.clasificacion].add(score, row.total)
+        by_test[str(row.test_id) if row.test_id else None].add(score, row.total)
+
+    # La relación con la matrícula depende del estado actual del prospecto: se consulta en vivo
+    center = f"AND t.{PROSPECTS_IN_CENTER_SQL}" if centro_id else ""
+    enrolled_avg = db.execute(text(f"""
+        SELECT AVG(t.puntaje_num)
+        FROM test_resultado t
+        JOIN prospecto p ON p.prospecto_id = t.prospecto_id
+        WHERE p.estado = 'Matriculado'
+          AND (CAST(:test_id AS UUID) IS NULL OR t.test_id = CAST(:test_id AS UUID))
+          {center}
+    """), params).scalar()
+
+    classifications = [{
+        'classification': classification,
+        'count': distribution.total,
+        'percentage': round(distribution.total / overall.total * 100, 2) if overall.total else 0,
+        **{key: value for key, value in distribution.stats().items() if key != 'total_tests'}
+    } for classification, distribution in sorted(
+        by_classification.items(), key=lambda item: item[1].total, reverse=True
+    )]
+
+    tests = [{
+        'test_id': key,
+        'total_tests': distribution.total,
+        'average_score': _round(distribution.average()),
+        'median_score': _round(distribution.percentile(0.5))
+    } for key, distribution in sorted(by_test.items(), key=lambda item: item[1].total, reverse=True)]
+
+    return {
+        'overall_stats': overall.stats(),
+        'histogram': overall.histogram(bins),
+        'classifications': classifications,
+        'tests': tests,
+        'enrolled_avg_score': _round(float(enrolled_avg)) if enrolled_avg is not None else None
+    }
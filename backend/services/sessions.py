@@ -0,0 +1,320 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from config import settings
+from services.incremental import refresh_incremental
+from services.time_series import _to_utc
+
+ROLLUP_NAME = "sesion_visita"
+
+# Identidad del visitante: el prospecto si se conoce; si no, la tarjeta NFC
+VISITOR_SQL = "COALESCE(CAST(i.prospecto_id AS TEXT), 'nfc:' || i.uid_nfc)"
+
+# Límites (en segundos) de los tramos de duración: <1, 1-5, 5-15, 15-30, 30-60 y 60+ minutos
+DURATION_BOUNDS = [60, 300, 900, 1800, 3600]
+DURATION_LABELS = ['<1m', '1-5m', '5-15m', '15-30m', '30-60m', '60m+']
+
+def _refresh_sessions(connection: Connection, since: Optional[datetime], until: datetime):
+    """Reconstruir las sesiones de los visitantes con interacciones en [since, until)"""
+    params = {"since": since, "until": until, "gap_minutes": settings.SESSION_GAP_MINUTES}
+    if since is None:
+        connection.execute(text("TRUNCATE sesion_visita"))
+
+    # Visitantes afectados y desde cuándo hay que releer sus interacciones
+    connection.execute(text(f"""
+        CREATE TEMP TABLE visitantes_afectados ON COMMIT DROP AS
+        SELECT {VISITOR_SQL} AS visitante, MIN(i.timestamp) AS desde
+        FROM interaccion i
+        WHERE (i.prospecto_id IS NOT NULL OR i.uid_nfc IS NOT NULL)
+          AND (CAST(:since AS TIMESTAMP) IS NULL OR i.timestamp >= CAST(:since AS TIMESTAMP))
+          AND i.timestamp < :until
+        GROUP BY 1
+    """), params)
+
+    # Las sesiones guardadas que terminan a menos de un gap de las nuevas interacciones
+    # pueden extenderse o fusionarse: se borran y se recalculan desde su inicio
+    connection.execute(text("""
+        WITH borradas AS (
+            DELETE FROM sesion_visita s
+            USING visitantes_afectados v
+            WHERE s.visitante = v.visitante
+              AND s.fin >= v.desde - :gap_minutes * INTERVAL '1 minute'
+            RETURNING s.visitante, s.inicio
+        )
+        UPDATE visitantes_afectados v
+        SET desde = LEAST(v.desde, b.inicio)
+        FROM (SELECT visitante, MIN(inicio) AS inicio FROM borradas GROUP BY 1) b
+        WHERE v.visitante = b.visitante
+    """), params)
+
+    # Una sesión nueva empieza en la primera interacción o tras más de gap_minutes sin actividad
+    connection.execute(text(f"""
+        WITH eventos AS (
+            SELECT v.visitante, i.interaccion_id, i.timestamp, i.prospecto_id, i.uid_nfc,
+                   i.centro_id, i.modulo, i.dispositivo_id,
+                   CASE WHEN i.timestamp - LAG(i.timestamp) OVER w <= :gap_minutes * INTERVAL '1 minute'
+                        THEN 0 ELSE 1 END AS nueva
+            FROM interaccion i
+            JOIN visitantes_afectados v ON v.visitante = {VISITOR_SQL}
+            WHERE i.timestamp >= v.desde
+              AND i.timestamp >= (SELECT MIN(desde) FROM visitantes_afectados)
+              AND i.timestamp < :until
+            WINDOW w AS (PARTITION BY v.visitante ORDER BY i.timestamp, i.interaccion_id)
+        ),
+        numerados AS (
+            SELECT *, SUM(nueva) OVER (PARTITION BY visitante ORDER BY timestamp, interaccion_id) AS sesion
+            FROM eventos
+        )
+        INSERT INTO sesion_visita (
+            visitante, inicio, fin, prospecto_id, uid_nfc, centro_id,
+            duracion_segundos, interacciones, modulos, dispositivos
+        )
+        SELECT visitante,
+               MIN(timestamp),
+               MAX(timestamp),
+               (array_agg(prospecto_id ORDER BY timestamp) FILTER (WHERE prospecto_id IS NOT NULL))[1],
+               (array_agg(uid_nfc ORDER BY timestamp) FILTER (WHERE uid_nfc IS NOT NULL))[1],
+               (array_agg(centro_id ORDER BY timestamp) FILTER (WHERE centro_id IS NOT NULL))[1],
+               CAST(EXTRACT(EPOCH FROM MAX(timestamp) - MIN(timestamp)) AS INTEGER),
+               COUNT(*),
+               COALESCE(array_agg(DISTINCT modulo) FILTER (WHERE modulo IS NOT NULL), '{{}}'),
+               COALESCE(array_agg(DISTINCT dispositivo_id) FILTER (WHERE dispositivo_id IS NOT NULL), '{{}}')
+        FROM numerados
+        GROUP BY visitante, sesion
+    """), params)
+
+def merge_prospect_sessions(connection: Connection, merges: List[Tuple[str, str]]):
+    """Pasar las sesiones de cada duplicado al prospecto conservado: [(conservar, fusionar)].
+
+    No relee interacciones (pueden estar en el archivo frío): las sesiones de ambos se
+    re-etiquetan y las que ahora se solapan o quedan a menos de un gap se unen.
+    """
+    if connection.execute(text("SELECT to_regclass('sesion_visita')")).scalar() is None:
+        return
+    # Espera a una pasada en curso del rollup y la bloquea hasta el fin de la transacción
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": ROLLUP_NAME})
+    params = {
+        "destinos": [keep for keep, _ in merges],
+        "origenes": [merge for _, merge in merges],
+        "gap_minutes": settings.SESSION_GAP_MINUTES,
+    }
+    connection.execute(text("DROP TABLE IF EXISTS sesiones_fusionadas"))
+    connection.execute(text("CREATE TEMP TABLE sesiones_fusionadas ON COMMIT DROP AS SELECT * FROM sesion_visita LIMIT 0"))
+    # Se sacan las sesiones del conservado y del duplicado, ya con el visitante conservado
+    connection.execute(text("""
+        WITH mapa AS (
+            SELECT DISTINCT CAST(visitante AS TEXT) AS visitante, CAST(destino AS TEXT) AS destino
+            FROM unnest(CAST(:origenes AS UUID[]), CAST(:destinos AS UUID[])) AS m(visitante, destino)
+            UNION
+            SELECT CAST(destino AS TEXT), CAST(destino AS TEXT) FROM unnest(CAST(:destinos AS UUID[])) AS d(destino)
+        ),
+        borradas AS (
+            DELETE FROM sesion_visita s USING mapa
+            WHERE s.visitante = mapa.visitante
+            RETURNING mapa.destino, s.inicio, s.fin, s.uid_nfc, s.centro_id, s.interacciones, s.modulos, s.dispositivos
+        )
+        INSERT INTO sesiones_fusionadas (
+            visitante, inicio, fin, prospecto_id, uid_nfc, centro_id,
+            duracion_segundos, interacciones, modulos, dispositivos
+        )
+        SELECT destino, inicio, fin, CAST(destino AS UUID), uid_nfc, centro_id,
+               CAST(EXTRACT(EPOCH FROM fin - inicio) AS INTEGER), interacciones, modulos, dispositivos
+        FROM borradas
+    """), params)
+    # Una sesión une a las anteriores si empieza a menos de un gap del fin más tardío visto
+    connection.execute(text("""
+        WITH ordenadas AS (
+            SELECT *,
+                   CASE WHEN inicio <= MAX(fin) OVER w + :gap_minutes * INTERVAL '1 minute'
+                        THEN 0 ELSE 1 END AS nueva
+            FROM sesiones_fusionadas
+            WINDOW w AS (PARTITION BY visitante ORDER BY inicio, fin ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+        ),
+        grupos AS (
+            SELECT *, SUM(nueva) OVER (PARTITION BY visitante ORDER BY inicio, fin ROWS UNBOUNDED PRECEDING) AS grupo
+            FROM ordenadas
+        ),
+        modulos AS (
+            SELECT g.visitante, g.grupo, array_agg(DISTINCT m.valor) AS modulos
+            FROM grupos g, unnest(g.modulos) AS m(valor) GROUP BY 1, 2
+        ),
+        dispositivos AS (
+            SELECT g.visitante, g.grupo, array_agg(DISTINCT d.valor) AS dispositivos
+            FROM grupos g, unnest(g.dispositivos) AS d(valor) GROUP BY 1, 2
+        ),
+        unidas AS (
+            SELECT visitante, grupo,
+                   MIN(inicio) AS inicio,
+                   MAX(fin) AS fin,
+                   (array_agg(uid_nfc ORDER BY inicio) FILTER (WHERE uid_nfc IS NOT NULL))[1] AS uid_nfc,
+                   (array_agg(centro_id ORDER BY inicio) FILTER (WHERE centro_id IS NOT NULL))[1] AS centro_id,
+                   SUM(interacciones) AS interacciones
+            FROM grupos
+            GROUP BY visitante, grupo
+        )
+        INSERT INTO sesion_visita (
+            visitante, inicio, fin, prospecto_id, uid_nfc, centro_id,
+            duracion_segundos, interacciones, modulos, dispositivos
+        )
+        SELECT u.visitante, u.inicio, u.fin, CAST(u.visitante AS UUID), u.uid_nfc, u.centro_id,
+               CAST(EXTRACT(EPOCH FROM u.fin - u.inicio) AS INTEGER), u.interacciones,
+               COALESCE(m.modulos, '{}'), COALESCE(d.dispositivos, '{}')
+        FROM unidas u
+        LEFT JOIN modulos m USING (visitante, grupo)
+        LEFT JOIN dispositivos d USING (visitante, grupo)
+    """), params)
+
+def refresh_session_rollup():
+    """Actualizar incrementalmente las sesiones de visita"""
+    refresh_incremental(
+        ROLLUP_NAME,
+        timedelta(hours=settings.ANALYTICS_ROLLUP_LOOKBACK_HOURS),
+        _refresh_sessions,
+        tables=("sesion_visita",)
+    )
+
+def visit_sessions(db: Session, start: datetime, end: datetime, granularity: str, timezone: str,
+                   centro_id: Optional[str] = None, prospecto_id: Optional[str] = None,
+                   limit: int = 20) -> Dict:
+    """Resumen, serie por intervalo, duración y módulos de las sesiones iniciadas en [start, end).
+
+    `start` y `end` son horas locales de `timezone`.
+    """
+    tz = ZoneInfo(timezone)
+    params = {
+        "granularity": granularity,
+        "timezone": timezone,
+        "step": f"1 {granularity}",
+        "start_local": start,
+        "end_local": end,
+        "start_utc": _to_utc(start, tz),
+        "end_utc": _to_utc(end, tz),
+        "centro_id": centro_id,
+        "prospecto_id": prospecto_id,
+        "bounds": DURATION_BOUNDS,
+        "limit": limit,
+        "rollup": ROLLUP_NAME,
+    }
+    where = "s.inicio >= :start_utc AND s.inicio < :end_utc"
+    if centro_id:
+        where += " AND s.centro_id = CAST(:centro_id AS UUID)"
+    if prospecto_id:
+        where += " AND s.prospecto_id = CAST(:prospecto_id AS UUID)"
+
+    summary = db.execute(text(f"""
+        SELECT COUNT(*) AS sesiones,
+               COUNT(DISTINCT s.visitante) AS visitantes,
+               AVG(s.duracion_segundos) AS duracion_media,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY s.duracion_segundos) AS duracion_mediana,
+               AVG(s.interacciones) AS interacciones_media,
+               AVG(cardinality(s.modulos)) AS modulos_media,
+               COUNT(*) FILTER (WHERE s.interacciones = 1) AS una_interaccion
+        FROM sesion_visita s
+        WHERE {where}
+    """), params).one()
+
+    series = db.execute(text(f"""
+        WITH buckets AS (
+            SELECT generate_series(
+                date_trunc(:granularity, CAST(:start_local AS TIMESTAMP)),
+                CAST(:end_local AS TIMESTAMP) - INTERVAL '1 microsecond',
+                CAST(:step AS INTERVAL)
+            ) AS bucket
+        ),
+        sesiones AS (
+            SELECT date_trunc(:granularity, s.inicio AT TIME ZONE 'UTC' AT TIME ZONE :timezone) AS bucket,
+                   s.visitante, s.duracion_segundos
+            FROM sesion_visita s
+            WHERE {where}
+        )
+        SELECT b.bucket,
+               COUNT(s.visitante) AS sesiones,
+               COUNT(DISTINCT s.visitante) AS visitantes,
+               AVG(s.duracion_segundos) AS duracion_media
+        FROM buckets b
+        LEFT JOIN sesiones s ON s.bucket = b.bucket
+        GROUP BY b.bucket
+        ORDER BY b.bucket
+    """), params).all()
+
+    durations = dict(db.execute(text(f"""
+        SELECT width_bucket(s.duracion_segundos, CAST(:bounds AS INTEGER[])), COUNT(*)
+        FROM sesion_visita s
+        WHERE {where}
+        GROUP BY 1
+    """), params).all())
+
+    modules = db.execute(text(f"""
+        SELECT m.modulo, COUNT(*) AS sesiones
+        FROM sesion_visita s, unnest(s.modulos) AS m(modulo)
+        WHERE {where}
+        GROUP BY 1
+        ORDER BY 2 DESC, 1
+        LIMIT 20
+    """), params).all()
+
+    recent = db.execute(text(f"""
+        SELECT s.* FROM sesion_visita s
+        WHERE {where}
+        ORDER BY s.inicio DESC
+        LIMIT :limit
+    """), params).all() if limit else []
+
+    refreshed_until = db.execute(
+        text("SELECT valor FROM agregado_watermark WHERE nombre = :rollup"), params
+    ).scalar()
+
+    def minutes(seconds) -> float:
+        return round(float(seconds) / 60, 2) if seconds is not None else 0
+
+    # Una sesión sigue abierta si su última interacción está a menos de un gap del corte del rollup
+    open_after = refreshed_until - timedelta(minutes=settings.SESSION_GAP_MINUTES) if refreshed_until else None
+    sessions = summary.sesiones or 0
+    return {
+        'granularity': granularity,
+        'timezone': timezone,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'gap_minutes': settings.SESSION_GAP_MINUTES,
+        'refreshed_until': refreshed_until.isoformat() if refreshed_until else None,
+        'summary': {
+            'sessions': sessions,
+            'visitors': summary.visitantes or 0,
+            'avg_duration_minutes': minutes(summary.duracion_media),
+            'median_duration_minutes': minutes(summary.duracion_mediana),
+            'avg_interactions': round(float(summary.interacciones_media), 2) if summary.interacciones_media else 0,
+            'avg_modules': round(float(summary.modulos_media), 2) if summary.modulos_media else 0,
+            'single_interaction_rate': round(summary.una_interaccion / sessions * 100, 2) if sessions else 0
+        },
+        'series': [{
+            'bucket': row.bucket.isoformat(),
+            'sessions': row.sesiones,
+            'visitors': row.visitantes,
+            'avg_duration_minutes': minutes(row.duracion_media)
+        } for row in series],
+        'duration_distribution': [{
+            'range': label,
+            'sessions': durations.get(i, 0)
+        } for i, label in enumerate(DURATION_LABELS)],
+        'top_modules': [{
+            'module': row.modulo,
+            'sessions': row.sesiones,
+            'percentage': round(row.sesiones / sessions * 100, 2) if sessions else 0
+        } for row in modules],
+        'recent_sessions': [{
+            'visitor': row.visitante,
+            'prospecto_id': str(row.prospecto_id) if row.prospecto_id else None,
+            'uid_nfc': row.uid_nfc,
+            'centro_id': str(row.centro_id) if row.centro_id else None,
+            'start': row.inicio.isoformat(),
+            'end': row.fin.isoformat(),
+            'duration_minutes': minutes(row.duracion_segundos),
+            'interactions': row.interacciones,
+            'modules': list(row.modulos),
+            'devices': list(row.dispositivos),
+            'open': bool(open_after and row.fin >= open_after)
+        } for row in recent]
+    }
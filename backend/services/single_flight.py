@@ -0,0 +1,101 @@
+import functools
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, Optional
+from sqlalchemy.orm import Session
+from config import settings
+from services.report_cache import normalize_filters
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        # El líder falló por una causa propia (p.ej. su cliente se desconectó): no se comparte
+        self.abandoned = False
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalescencia de cálculos idénticos en curso.
+
+    La primera solicitud con una clave ejecuta el cálculo (líder); las que llegan
+    mientras tanto con la misma clave esperan y reciben el mismo resultado o la
+    misma excepción. Al terminar, la clave se libera: no es una caché.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = defaultdict(int)
+        self.shared = defaultdict(int)
+
+    def do(self, key: Hashable, fn: Callable[[], Any], abandon: Optional[Callable[[], bool]] = None) -> Any:
+        """Ejecutar `fn` una sola vez por clave entre las llamadas concurrentes.
+
+        `abandon()` se evalúa si `fn` falla: si devuelve True, los que esperan
+        no heredan el error y vuelven a intentarlo (uno de ellos como líder).
+        """
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return fn()
+        name = key[0] if isinstance(key, tuple) else key
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.leaders[name] += 1
+                else:
+                    call.waiters += 1
+                    self.shared[name] += 1
+            if leader:
+                break
+            call.done.wait()
+            if call.abandoned:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            call.abandoned = bool(abandon and abandon())
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def status(self) -> Dict:
+        with self._lock:
+            in_flight = defaultdict(lambda: {'calls': 0, 'waiters': 0})
+            for key, call in self._calls.items():
+                name = key[0] if isinstance(key, tuple) else key
+                in_flight[name]['calls'] += 1
+                in_flight[name]['waiters'] += call.waiters
+            return {
+                'enabled': settings.SINGLE_FLIGHT_ENABLED,
+                'in_flight': dict(in_flight),
+                'leaders': dict(self.leaders),
+                'shared': dict(self.shared)
+            }
+
+single_flight = SingleFlight()
+
+def coalesce(func: Callable) -> Callable:
+    """Decorador de endpoints síncronos: llamadas concurrentes con los mismos
+    parámetros (sin contar la sesión) comparten un único cálculo"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = next((value for value in kwargs.values() if isinstance(value, Session)), None)
+        params = {name: value for name, value in kwargs.items() if not isinstance(value, Session)}
+        key = (func.__name__, tuple(normalize_filters(params).items()))
+        # Si el líder falló porque se canceló su propia sesión, el resto no hereda el error
+        abandon = (lambda: bool(session.info.get("cancelled"))) if session is not None else None
+        return single_flight.do(key, lambda: func(*args, **kwargs), abandon)
+
+    return wrapper
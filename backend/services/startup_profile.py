@@ -0,0 +1,114 @@
+"""Perfil de arranque: tiempo de importación por módulo y fases hasta estar listo.
+
+Se activa con la variable de entorno STARTUP_PROFILE=true. Se lee directamente del
+entorno porque el hook debe instalarse antes de importar config y el resto de la app.
+"""
+import importlib.abc
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+class _TimedLoader(importlib.abc.Loader):
+    """Envuelve el loader real para medir exec_module (tiempo acumulado y propio)"""
+
+    def __init__(self, loader, profile: "StartupProfile"):
+        self._loader = loader
+        self._profile = profile
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profile._enter()
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profile._exit(module.__name__, (time.perf_counter() - start) * 1000)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, profile: "StartupProfile"):
+        self._profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self._profile)
+                return spec
+        return None
+
+class StartupProfile:
+    def __init__(self):
+        self.enabled = os.getenv("STARTUP_PROFILE", "false").lower() == "true"
+        self.started_at = time.perf_counter()
+        self.modules: Dict[str, Dict[str, float]] = {}
+        self.phases: List[Dict] = []
+        self._local = threading.local()
+        self._finder = None
+
+    def install(self):
+        """Instalar el hook de importación (solo con STARTUP_PROFILE=true)"""
+        if self.enabled and self._finder is None:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self._finder = None
+
+    def _enter(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+
+    def _exit(self, name: str, elapsed_ms: float):
+        stack = self._local.stack
+        children_ms = stack.pop()
+        if stack:
+            stack[-1] += elapsed_ms
+        self.modules[name] = {'cumulative_ms': elapsed_ms, 'self_ms': elapsed_ms - children_ms}
+
+    def mark(self, phase: str):
+        """Registrar una fase del arranque (ms desde que se cargó este módulo)"""
+        if self.enabled:
+            self.phases.append({'phase': phase, 'at_ms': round((time.perf_counter() - self.started_at) * 1000, 1)})
+
+    def report(self, top: int = 30) -> Dict:
+        def rows(key):
+            ordered = sorted(self.modules.items(), key=lambda item: item[1][key], reverse=True)[:top]
+            return [{
+                'module': name,
+                'cumulative_ms': round(times['cumulative_ms'], 1),
+                'self_ms': round(times['self_ms'], 1)
+            } for name, times in ordered]
+        return {
+            'enabled': self.enabled,
+            'phases': self.phases,
+            'modules_imported': len(self.modules),
+            'top_cumulative': rows('cumulative_ms'),
+            'top_self': rows('self_ms')
+        }
+
+    def log_summary(self, top: int = 15):
+        if not self.enabled:
+            return
+        for phase in self.phases:
+            logger.warning("arranque: %-28s %8.1f ms", phase['phase'], phase['at_ms'])
+        for row in self.report(top)['top_cumulative']:
+            logger.warning("import: %-40s %8.1f ms (propio %.1f ms)", row['module'], row['cumulative_ms'], row['self_ms'])
+
+startup_profile = StartupProfile()
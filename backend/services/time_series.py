@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from config import settings
+from services.incremental import refresh_incremental
+from services.centers import PROSPECTS_IN_CENTER_SQL, INTERACTIONS_IN_CENTER_SQL
+
+ROLLUP_NAME = "serie_horaria"
+
+# Métricas de la serie: (tabla, columna de tiempo, condición adicional)
+METRICS = {
+    'registrations': ('prospecto', 'fecha_registro', None),
+    'enrollments': ('prospecto_estado_historial', 'fecha_cambio', "estado_nuevo = 'Matriculado'"),
+    'interactions': ('interaccion', 'timestamp', None),
+}
+
+# Condición por centro de cada métrica (el rollup horario es global)
+CENTER_FILTERS = {
+    'registrations': PROSPECTS_IN_CENTER_SQL,
+    'enrollments': PROSPECTS_IN_CENTER_SQL,
+    'interactions': INTERACTIONS_IN_CENTER_SQL,
+}
+
+GRANULARITIES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    # Mínimo posible, para acotar el número de puntos
+    'month': timedelta(days=28),
+}
+
+def _source_filter(metric: str) -> str:
+    _, column, condition = METRICS[metric]
+    return f"{column} IS NOT NULL" + (f" AND {condition}" if condition else "")
+
+def _refresh_hourly(connection: Connection, since: Optional[datetime], until: datetime):
+    params = {"since": since, "until": until}
+    for metric, (table, column, _) in METRICS.items():
+        connection.execute(text("""
+            DELETE FROM serie_horaria
+            WHERE metrica = :metric
+              AND (CAST(:since AS TIMESTAMP) IS NULL OR hora >= date_trunc('hour', CAST(:since AS TIMESTAMP)))
+        """), {"metric": metric, **params})
+        connection.execute(text(f"""
+            INSERT INTO serie_horaria (metrica, hora, total)
+            SELECT :metric, date_trunc('hour', {column}), COUNT(*)
+            FROM {table}
+            WHERE {_source_filter(metric)}
+              AND (CAST(:since AS TIMESTAMP) IS NULL OR {column} >= date_trunc('hour', CAST(:since AS TIMESTAMP)))
+              AND {column} < :until
+            GROUP BY 2
+        """), {"metric": metric, **params})
+
+def refresh_hourly_rollup():
+    """Actualizar incrementalmente los conteos por hora (UTC) de cada métrica"""
+    refresh_incremental(
+        ROLLUP_NAME,
+        timedelta(hours=settings.ANALYTICS_ROLLUP_LOOKBACK_HOURS),
+        _refresh_hourly,
+        tables=("serie_horaria",)
+    )
+
+def _raw_hours(metric: str, centro_id: Optional[str] = None) -> str:
+    # Tramo posterior a la marca del rollup: se cuenta directamente en la tabla fuente
+    table, column, _ = METRICS[metric]
+    center = f"AND {CENTER_FILTERS[metric]}" if centro_id else ""
+    return f"""
+        SELECT '{metric}' AS metrica, date_trunc('hour', {column}) AS hora, COUNT(*) AS total
+        FROM {table}, corte
+        WHERE {_source_filter(metric)} {center}
+          AND {column} >= GREATEST(CAST(:start_utc AS TIMESTAMP), corte.hora)
+          AND {column} < :end_utc
+        GROUP BY 2
+    """
+
+def _to_utc(value: datetime, tz: ZoneInfo) -> datetime:
+    return value.replace(tzinfo=tz).astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+
+def time_series(db: Session, start: datetime, end: datetime, granularity: str, timezone: str,
+                centro_id: Optional[str] = None) -> Dict:
+    """Serie temporal continua (sin huecos) de registros, matrículas e interacciones.
+
+    `start` y `end` son horas locales de `timezone` ([start, end)). Las horas ya
+    consolidadas salen de `serie_horaria` y el tramo reciente de las tablas fuente;
+    los buckets se arman en la zona horaria pedida y se rellenan con ceros en SQL.
+    Con `centro_id` todo el rango se cuenta en las tablas fuente, usando los
+    índices por centro (`serie_horaria` no distingue centros).
+    """
+    tz = ZoneInfo(timezone)
+    sums = ",\n".join(
+        f"SUM(total) FILTER (WHERE metrica = '{metric}') AS {metric}" for metric in METRICS
+    )
+    columns = ",\n".join(f"COALESCE(a.{metric}, 0) AS {metric}" for metric in METRICS)
+    raw = "\nUNION ALL\n".join(_raw_hours(metric, centro_id) for metric in METRICS)
+    rows = db.execute(text(f"""
+        WITH corte AS (
+            SELECT COALESCE(
+                (SELECT date_trunc('hour', valor) FROM agregado_watermark
+                 WHERE nombre = :rollup AND CAST(:centro_id AS UUID) IS NULL),
+                CAST(:start_utc AS TIMESTAMP)
+            ) AS hora
+        ),
+        horas AS (
+            SELECT s.metrica, s.hora, s.total
+            FROM serie_horaria s, corte
+            WHERE s.hora >= :start_utc AND s.hora < LEAST(CAST(:end_utc AS TIMESTAMP), corte.hora)
+            UNION ALL
+            {raw}
+        ),
+        agregado AS (
+            SELECT date_trunc(:granularity, hora AT TIME ZONE 'UTC' AT TIME ZONE :timezone) AS bucket,
+                   {sums}
+            FROM horas
+            GROUP BY 1
+        ),
+        buckets AS (
+            SELECT generate_series(
+                date_trunc(:granularity, CAST(:start_local AS TIMESTAMP)),
+                CAST(:end_local AS TIMESTAMP) - INTERVAL '1 microsecond',
+                CAST(:step AS INTERVAL)
+            ) AS bucket
+        )
+        SELECT b.bucket, {columns}
+        FROM buckets b
+        LEFT JOIN agregado a ON a.bucket = b.bucket
+        ORDER BY b.bucket
+    """), {
+        "rollup": ROLLUP_NAME,
+        "granularity": granularity,
+        "timezone": timezone,
+        "step": f"1 {granularity}",
+        "start_local": start,
+        "end_local": end,
+        "start_utc": _to_utc(start, tz),
+        "end_utc": _to_utc(end, tz),
+        "centro_id": centro_id,
+    }).all()
+
+    points = [{'bucket': row.bucket.isoformat(), **{metric: int(getattr(row, metric)) for metric in METRICS}} for row in rows]
+    return {
+        'granularity': granularity,
+        'timezone': timezone,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'centro_id': centro_id,
+        'points': points,
+        'totals': {metric: sum(point[metric] for point in points) for metric in METRICS}
+    }
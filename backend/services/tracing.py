@@ -0,0 +1,425 @@
+"""Trazas distribuidas con IDs compatibles con OpenTelemetry y propagación W3C traceparent.
+
+Cada solicitud muestreada abre un span raíz. Dentro de él hay spans para el handler
+de la ruta, la sesión de BD (admisión incluida), el endpoint, cada sentencia SQL,
+los bucles de armado de resultados y la codificación de la respuesta. Los spans
+terminados se exportan en segundo plano a un archivo JSONL o, en formato OTLP/JSON,
+a un colector HTTP.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+# Tipos de span de OTLP
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+EXPORT_BATCH_SIZE = 512
+RECENT_TRACES = 200
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+class Span:
+    """Un tramo de trabajo; `root` es el span de la solicitud, que acumula el desglose"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: int = KIND_INTERNAL,
+                 attributes: Optional[Dict] = None, root: Optional["Span"] = None, start_ns: Optional[int] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.root = root or self
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        # Solo en el span raíz: ms y cantidad por tipo de span (no excluyentes entre sí)
+        self.breakdown_ms: Counter = Counter()
+        self.breakdown_count: Counter = Counter()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes,
+            'status': 'error' if self.error else 'ok',
+            'error': self.error
+        }
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _otlp(spans: List[Span], service_name: str) -> Dict:
+    """Payload OTLP/JSON (POST /v1/traces)"""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{
+            'scope': {'name': __name__},
+            'spans': [{
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_id or '',
+                'name': span.name,
+                'kind': span.kind,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items() if v is not None],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+            } for span in spans]
+        }]
+    }]}
+
+class Tracer:
+    def __init__(self, enabled: bool, sample_rate: float, exporter: str, path: str, endpoint: str,
+                 service_name: str, queue_size: int):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.path = path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.recent: deque = deque(maxlen=RECENT_TRACES)
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+        self.last_error: Optional[str] = None
+
+    # --- Creación de spans ---
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, attributes: Optional[Dict] = None) -> Optional[Span]:
+        """Span raíz de una solicitud (continúa la traza del header traceparent si viene)"""
+        match = TRACEPARENT_RE.match(traceparent.strip().lower()) if traceparent else None
+        if match:
+            # La decisión de muestreo del llamador manda
+            if not int(match.group(3), 16) & 1:
+                return None
+            trace_id, parent_id = match.group(1), match.group(2)
+        else:
+            if random.random() >= self.sample_rate:
+                return None
+            trace_id, parent_id = os.urandom(16).hex(), None
+        return Span(name, trace_id, parent_id, KIND_SERVER, attributes)
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, start_ns: Optional[int] = None, **attributes) -> Optional[Span]:
+        """Span hijo del actual (sin activarlo); None si no hay traza en curso"""
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return Span(name, parent.trace_id, parent.span_id, kind, attributes, parent.root, start_ns)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Span hijo del actual, activo dentro del bloque; sin traza en curso no hace nada"""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end(span)
+
+    def activate(self, span: Span):
+        return _current_span.set(span)
+
+    def deactivate(self, token):
+        _current_span.reset(token)
+
+    def end(self, span: Span, end_ns: Optional[int] = None):
+        span.end_ns = end_ns or time.time_ns()
+        root = span.root
+        if span is root:
+            span.attributes.update({
+                f"breakdown.{kind}_ms": round(ms, 3) for kind, ms in root.breakdown_ms.items()
+            })
+            self.recent.append(span.to_dict() | {
+                'breakdown': {kind: {'ms': round(ms, 3), 'count': root.breakdown_count[kind]}
+                              for kind, ms in root.breakdown_ms.most_common()}
+            })
+        else:
+            kind = span.name.split(' ')[0]
+            root.breakdown_ms[kind] += span.duration_ms
+            root.breakdown_count[kind] += 1
+        self._enqueue(span)
+
+    # --- Exportación ---
+
+    def _enqueue(self, span: Span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _export_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=1))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            spans = [span for span in batch if span is not None]
+            if spans:
+                try:
+                    self._export(spans)
+                    self.exported += len(spans)
+                except Exception as e:
+                    self.export_errors += 1
+                    self.last_error = str(e)
+                    logger.warning("No se pudieron exportar %d spans: %s", len(spans), e)
+            if stop:
+                return
+
+    def _export(self, spans: List[Span]):
+        if self.exporter == "otlp":
+            request = urllib.request.Request(
+                self.endpoint,
+                data=json.dumps(_otlp(spans, self.service_name)).encode('utf-8'),
+                headers={'Content-Type': 'application/json'},
+                method='POST'
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        else:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for span in spans:
+                    f.write(json.dumps(span.to_dict() | {'service': self.service_name}, default=str) + "\n")
+
+    def shutdown(self, timeout: float = 5):
+        """Exportar los spans pendientes y detener el hilo exportador"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'exporter': self.exporter,
+            'destination': self.endpoint if self.exporter == "otlp" else self.path,
+            'queued': self._queue.qsize(),
+            'exported': self.exported,
+            'dropped': self.dropped,
+            'export_errors': self.export_errors,
+            'last_error': self.last_error
+        }
+
+tracer = Tracer(
+    settings.TRACING_ENABLED,
+    settings.TRACING_SAMPLE_RATE,
+    settings.TRACING_EXPORTER,
+    settings.TRACING_FILE,
+    settings.TRACING_OTLP_ENDPOINT,
+    settings.TRACING_SERVICE_NAME,
+    settings.TRACING_QUEUE_SIZE
+)
+
+# --- SQL: un span por sentencia ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_span(conn, cursor, statement, parameters, context, executemany):
+    span = tracer.start_span(
+        "db.query",
+        KIND_CLIENT,
+        **{
+            'db.system': conn.dialect.name,
+            'db.operation': statement.lstrip().split(' ', 1)[0].upper(),
+            'db.statement': " ".join(statement.split())[:1000],
+            'db.executemany': executemany
+        }
+    )
+    if span is not None:
+        conn.info.setdefault("trace_spans", []).append(span)
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_query_span(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set_attribute('db.rowcount', cursor.rowcount)
+        tracer.end(span)
+
+@event.listens_for(Engine, "handle_error")
+def _fail_query_span(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get("trace_spans") if connection is not None else None
+    if spans:
+        span = spans.pop()
+        span.error = f"{type(exception_context.original_exception).__name__}: {exception_context.original_exception}"
+        tracer.end(span)
+
+# --- HTTP: span raíz, handler de la ruta, endpoint y codificación de la respuesta ---
+
+class TracingMiddleware:
+    """Middleware ASGI puro: span raíz por solicitud y header traceparent en la respuesta"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", []))
+        traceparent = headers.get(b"traceparent")
+        root = tracer.start_trace(
+            f"HTTP {scope['method']}",
+            traceparent.decode('latin-1') if traceparent else None,
+            {
+                'http.method': scope['method'],
+                'http.target': scope['path'],
+                'http.client_ip': scope['client'][0] if scope.get('client') else None
+            }
+        )
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_traceparent(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute('http.status_code', message["status"])
+                message["headers"] = list(message.get("headers", [])) + [(b"traceparent", root.traceparent.encode())]
+            await send(message)
+
+        token = tracer.activate(root)
+        try:
+            await self.app(scope, receive, send_with_traceparent)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            tracer.deactivate(token)
+            route = scope.get("route")
+            if route is not None:
+                root.set_attribute('http.route', route.path)
+                root.name = f"HTTP {scope['method']} {route.path}"
+            tracer.end(root)
+
+def _traced_route_app(app, path: str, timing_holder: contextvars.ContextVar):
+    async def traced_app(scope, receive, send):
+        route_span = tracer.start_span(f"route {path}", **{'http.route': path})
+        if route_span is None:
+            await app(scope, receive, send)
+            return
+        timing = {}
+        holder_token = timing_holder.set(timing)
+        encode_span = None
+
+        async def traced_send(message):
+            nonlocal encode_span
+            if message["type"] == "http.response.start":
+                # Entre el fin del endpoint y el inicio de la respuesta: jsonable_encoder + render
+                endpoint_end = timing.get('endpoint_end')
+                if endpoint_end:
+                    span = Span("response.encode", route_span.trace_id, route_span.span_id,
+                                root=route_span.root, start_ns=endpoint_end)
+                    tracer.end(span)
+                encode_span = Span("response.send", route_span.trace_id, route_span.span_id, root=route_span.root)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body") and encode_span:
+                tracer.end(encode_span)
+
+        token = tracer.activate(route_span)
+        try:
+            await app(scope, receive, traced_send)
+        except BaseException as e:
+            route_span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            tracer.deactivate(token)
+            timing_holder.reset(holder_token)
+            tracer.end(route_span)
+    return traced_app
+
+def _traced_endpoint(func, name: str, timing_holder: contextvars.ContextVar):
+    def mark_end():
+        timing = timing_holder.get()
+        if timing is not None:
+            timing['endpoint_end'] = time.time_ns()
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_endpoint(*args, **kwargs):
+            try:
+                with tracer.span(f"endpoint {name}"):
+                    return await func(*args, **kwargs)
+            finally:
+                mark_end()
+        return async_endpoint
+
+    @functools.wraps(func)
+    def endpoint(*args, **kwargs):
+        # Corre en el threadpool con una copia del contexto: el span padre es el de la ruta
+        try:
+            with tracer.span(f"endpoint {name}"):
+                return func(*args, **kwargs)
+        finally:
+            mark_end()
+    return endpoint
+
+def instrument_routes(app):
+    """Envolver cada ruta de la API con spans de handler, endpoint y codificación de la respuesta"""
+    from fastapi.routing import APIRoute
+    timing_holder = contextvars.ContextVar("trace_route_timing", default=None)
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            # El handler lee dependant.call en cada solicitud
+            route.dependant.call = _traced_endpoint(route.dependant.call, route.name, timing_holder)
+            route.app = _traced_route_app(route.app, route.path, timing_holder)
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+from fastapi import HTTPException, Request
+from services import admission as admission_module
+from services.admission import Bulkhead, TokenBucketLimiter, client_key
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission_module.time, "monotonic", fake)
+    return fake
+
+def test_token_bucket_allows_burst_then_rejects_with_retry_after(clock):
+    limiter = TokenBucketLimiter("reports", per_minute=6, burst=2)
+    limiter.check("1.1.1.1")
+    limiter.check("1.1.1.1")
+    with pytest.raises(HTTPException) as rejected:
+        limiter.check("1.1.1.1")
+    assert rejected.value.status_code == 429
+    # 6 por minuto: un token cada 10 segundos
+    assert rejected.value.headers["Retry-After"] == "10"
+    assert (limiter.allowed, limiter.rejected) == (2, 1)
+
+def test_token_bucket_refills_over_time(clock):
+    limiter = TokenBucketLimiter("reports", per_minute=60, burst=1)
+    limiter.check("cliente")
+    with pytest.raises(HTTPException):
+        limiter.check("cliente")
+    clock.now += 0.5
+    with pytest.raises(HTTPException) as rejected:
+        limiter.check("cliente")
+    assert rejected.value.headers["Retry-After"] == "1"
+    clock.now += 0.5
+    limiter.check("cliente")
+    assert limiter.allowed == 2
+
+def test_token_bucket_refill_is_capped_at_burst(clock):
+    limiter = TokenBucketLimiter("analytics", per_minute=60, burst=2)
+    limiter.check("cliente")
+    clock.now += 3600
+    limiter.check("cliente")
+    limiter.check("cliente")
+    with pytest.raises(HTTPException):
+        limiter.check("cliente")
+
+def test_token_bucket_is_per_client(clock):
+    limiter = TokenBucketLimiter("reports", per_minute=60, burst=1)
+    limiter.check("a")
+    limiter.check("b")
+    with pytest.raises(HTTPException):
+        limiter.check("a")
+
+def test_bulkhead_rejects_when_queue_is_full():
+    async def scenario():
+        bulkhead = Bulkhead("reports", limit=1, queue_size=0, queue_timeout=1)
+        await bulkhead.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await bulkhead.acquire()
+        return bulkhead, rejected.value
+
+    bulkhead, error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.headers["Retry-After"] == "1"
+    assert bulkhead.rejected_queue_full == 1
+    assert bulkhead.active == 1
+
+def test_bulkhead_rejects_after_queue_timeout():
+    async def scenario():
+        bulkhead = Bulkhead("analytics", limit=1, queue_size=1, queue_timeout=0.05)
+        await bulkhead.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await bulkhead.acquire()
+        return bulkhead, rejected.value
+
+    bulkhead, error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert bulkhead.rejected_timeout == 1
+    assert bulkhead.waiting == 0
+
+def test_bulkhead_admits_queued_request_on_release():
+    async def scenario():
+        bulkhead = Bulkhead("crud", limit=1, queue_size=1, queue_timeout=1)
+        await bulkhead.acquire()
+        waiter = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        assert bulkhead.waiting == 1
+        bulkhead.release(3.2)
+        await waiter
+        return bulkhead
+
+    bulkhead = asyncio.run(scenario())
+    assert bulkhead.admitted == 2
+    assert bulkhead.active == 1
+    assert bulkhead.waiting == 0
+    # Retry-After estima con el tiempo medio que se ocupa un cupo
+    assert bulkhead.retry_after() == 4
+
+def request_from(forwarded_for=None, host="10.0.0.5"):
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "headers": headers, "client": (host, 1234)})
+
+def test_client_key_ignores_forwarded_for_without_trusted_proxies():
+    assert client_key(request_from("1.2.3.4"), trusted_hops=0) == "10.0.0.5"
+
+def test_client_key_uses_the_hop_added_by_the_trusted_proxy():
+    # El cliente inventa la primera entrada; el proxy agrega la IP real al final
+    assert client_key(request_from("6.6.6.6, 200.1.1.1"), trusted_hops=1) == "200.1.1.1"
+    assert client_key(request_from("6.6.6.6, 200.1.1.1, 10.1.1.1"), trusted_hops=2) == "200.1.1.1"
+
+def test_client_key_falls_back_to_connection_without_header():
+    assert client_key(request_from(), trusted_hops=1) == "10.0.0.5"
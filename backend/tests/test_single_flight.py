@@ -0,0 +1,102 @@
+import threading
+import time
+import pytest
+from config import settings
+from services.single_flight import SingleFlight
+
+KEY = ("reporte", (("formato", "csv"),))
+
+def wait_for_calls(flight: SingleFlight):
+    deadline = time.monotonic() + 5
+    while KEY not in flight._calls:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def wait_for_waiters(flight: SingleFlight, key, count: int):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with flight._lock:
+            call = flight._calls.get(key)
+            if call is not None and call.waiters >= count:
+                return
+        time.sleep(0.001)
+    raise AssertionError("las llamadas concurrentes no llegaron a esperar al líder")
+
+def run_concurrently(flight: SingleFlight, leader_fn, waiter_fn, leader_abandon=None):
+    """Líder bloqueado hasta que el segundo llamador espera; devuelve (resultado o error) de cada uno"""
+    release = threading.Event()
+    outcomes = {}
+
+    def call(name, fn, abandon=None):
+        try:
+            outcomes[name] = flight.do(KEY, fn, abandon)
+        except BaseException as e:
+            outcomes[name] = e
+
+    def blocking_leader():
+        release.wait(5)
+        return leader_fn()
+
+    leader = threading.Thread(target=call, args=("leader", blocking_leader, leader_abandon))
+    leader.start()
+    wait_for_calls(flight)
+    waiter = threading.Thread(target=call, args=("waiter", waiter_fn))
+    waiter.start()
+    wait_for_waiters(flight, KEY, 1)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    return outcomes["leader"], outcomes["waiter"]
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", True)
+
+def test_concurrent_callers_share_one_result():
+    flight = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"total": 42}
+
+    leader, waiter = run_concurrently(flight, compute, compute)
+    assert leader == {"total": 42}
+    assert waiter is leader
+    assert len(calls) == 1
+    assert flight.leaders["reporte"] == 1
+    assert flight.shared["reporte"] == 1
+    assert flight.status()["in_flight"] == {}
+
+def test_waiters_share_the_leader_error():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("consulta fallida")
+
+    leader, waiter = run_concurrently(flight, fail, lambda: "no debería ejecutarse")
+    assert isinstance(leader, ValueError)
+    assert waiter is leader
+
+def test_abandoned_leader_error_makes_waiters_retry():
+    flight = SingleFlight()
+
+    def cancelled():
+        raise RuntimeError("cliente desconectado")
+
+    leader, waiter = run_concurrently(flight, cancelled, lambda: "recalculado", leader_abandon=lambda: True)
+    assert isinstance(leader, RuntimeError)
+    assert waiter == "recalculado"
+    # El que esperaba pasa a ser líder del reintento
+    assert flight.leaders["reporte"] == 2
+
+def test_key_is_released_after_the_call():
+    flight = SingleFlight()
+    assert flight.do(KEY, lambda: 1) == 1
+    assert flight.do(KEY, lambda: 2) == 2
+
+def test_disabled_runs_every_call(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", False)
+    flight = SingleFlight()
+    assert flight.do(KEY, lambda: "directo") == "directo"
+    assert flight.leaders == {}